@@ -0,0 +1,63 @@
+"""
+Compare the cost of serving the json status and the prtg data of all the services
+  rebuild: the original implementation, the result is rebuilt from all the services for each request
+  cached: the cached result, the entry of the changed service is recomputed and the result is reassembled
+  unchanged: the cached result if no healthstatus is changed between the requests
+The healthstatus of one service is changed before each request in 'rebuild' and 'cached'
+Usage: HEALTHCHECK_DATA_DIR=<data dir> python -m healthcheck.benchmarks.aggregates [services] [requests]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from datetime import timedelta
+
+from .. import utils
+from ..healthcheck import HealthCheck
+from .startup import get_configs
+
+def set_healthstatus(service,i):
+    now = utils.now()
+    service.healthstatus = [now + timedelta(seconds=60),[now,now + timedelta(milliseconds=50),"red" if i % 7 == 0 else "green","OK",None,False]]
+
+def run(healthcheck,services,requests,f_request,change=True):
+    starttime = time.perf_counter()
+    for i in range(requests):
+        if change:
+            set_healthstatus(services[i % len(services)],i)
+        f_request()
+    return (time.perf_counter() - starttime) * 1000000 / requests
+
+def main():
+    services = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    tmpdir = tempfile.mkdtemp()
+    configfile = os.path.join(tmpdir,"aggregatesbenchmark.json")
+    try:
+        with open(configfile,'w') as f:
+            f.write(json.dumps(get_configs(services)))
+        healthcheck = HealthCheck(configfile)
+        servicelist = [service for section in healthcheck.sections.values() for service in section["services"].values()]
+        for i,service in enumerate(servicelist):
+            set_healthstatus(service,i)
+
+        print("{:<12}{:>14}{:>12}{:>14}".format("result","rebuild(us)","cached(us)","unchanged(us)"))
+        for name,f_rebuild,f_cached in (
+            ("json",lambda:json.dumps(healthcheck.get_jsonstatus()),healthcheck.get_cached_jsonstatus),
+            ("json details",lambda:json.dumps(healthcheck.get_jsonstatus(True)),lambda:healthcheck.get_cached_jsonstatus(True)),
+            ("prtg",lambda:json.dumps(healthcheck.get_prtgdata()),healthcheck.get_cached_prtgdata)
+        ):
+            print("{:<12}{:>14.1f}{:>12.1f}{:>14.1f}".format(
+                name,
+                run(healthcheck,servicelist,requests,f_rebuild),
+                run(healthcheck,servicelist,requests,f_cached),
+                run(healthcheck,servicelist,requests,f_cached,change=False)
+            ))
+    finally:
+        shutil.rmtree(tmpdir,ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
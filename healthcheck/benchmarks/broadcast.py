@@ -0,0 +1,129 @@
+"""
+Compare the cost of broadcasting a healthstatus to the subscriptors
+  per subscriptor: the original implementation, each subscriptor encodes the data and the broadcast waits until all the subscriptors have sent the data
+  encode once: the data is encoded once and put into the send queue of each subscriptor, the time includes waiting until all the queues are sent
+  stalled: same as 'encode once' with an extra subscriptor whose peer never reads, the time excludes waiting for the stalled subscriptor
+Each subscriptor is connected by a socket pair, the other end is read and discarded by a reader task
+Usage: python -m healthcheck.benchmarks.broadcast [broadcasts] [subscriptor numbers separated by comma]
+"""
+import sys
+import time
+import asyncio
+import socket as builtinsocket
+from datetime import timedelta
+
+from .. import utils
+from .. import socket
+from .. import settings
+from ..lists import CycleList
+from ..healthcheckserver import BaseHealthStatusSubscriptor
+
+class Server(object):
+    def unregister_connection(self,conn):
+        pass
+
+    def __str__(self):
+        return "Benchmark server"
+
+class Subscriptor(BaseHealthStatusSubscriptor):
+    subscriptors = []
+    _frames = CycleList(settings.HEALTHSTATUS_REPLAY_BUFFER)
+    _lock = asyncio.Lock()
+    conn_type = socket.HEALTHSTATUS_SUBSCRIPTOR
+
+    @property
+    def healthcheck(self):
+        return None
+
+    @staticmethod
+    def get_snapshot(healthcheck,keys=None):
+        #no healthcheck configuration in the benchmark, the coalesced snapshot of the stalled subscriptor is empty
+        return []
+
+    @classmethod
+    async def _send_data_per_subscriptor(cls,data):
+        """
+        The original implementation: each subscriptor encodes the data itself
+        """
+        async with cls._lock:
+            tasks = [asyncio.create_task(subscriptor.send(data)) for subscriptor in cls.subscriptors]
+            for task in tasks:
+                await task
+
+async def discard(sock):
+    loop = asyncio.get_running_loop()
+    while True:
+        data = await loop.sock_recv(sock,65536)
+        if not data:
+            break
+
+def get_healthstatus(i):
+    now = utils.now()
+    return [["section{}".format(i % 10),"service{}".format(i % 500)],[now + timedelta(seconds=60),[now,now + timedelta(milliseconds=50),"green","OK",{"channel":[{"channel":"Response Time","value":50,"unit":"TimeResponse"}]},False]]]
+
+async def create_subscriptor(server,name,socks,tasks,stalled=False):
+    a,b = builtinsocket.socketpair()
+    b.setblocking(False)
+    socks.append((a,b))
+    reader,writer = await asyncio.open_connection(sock=a)
+    subscriptor = Subscriptor(server,name,reader,writer)
+    #no initial data is sent in the benchmark, register the subscriptor directly
+    Subscriptor.subscriptors.append(subscriptor)
+    subscriptor.start()
+    if not stalled:
+        tasks.append(asyncio.create_task(discard(b)))
+    return subscriptor
+
+async def run(broadcasts,subscriptors):
+    server = Server()
+    tasks = []
+    socks = []
+    for i in range(subscriptors):
+        await create_subscriptor(server,"subscriptor{}".format(i),socks,tasks)
+
+    healthstatuslist = [get_healthstatus(i) for i in range(broadcasts)]
+    result = []
+
+    starttime = time.perf_counter()
+    for healthstatus in healthstatuslist:
+        await Subscriptor._send_data_per_subscriptor([socket.HEALTHSTATUS,healthstatus])
+    result.append((time.perf_counter() - starttime) * 1000000 / broadcasts)
+
+    starttime = time.perf_counter()
+    for healthstatus in healthstatuslist:
+        await Subscriptor.send_healthstatus(healthstatus)
+        #the healthstatus is broadcasted by different healthcheck tasks, let the sender tasks run between the broadcasts
+        await asyncio.sleep(0)
+    for subscriptor in Subscriptor.subscriptors:
+        await subscriptor.flush()
+    result.append((time.perf_counter() - starttime) * 1000000 / broadcasts)
+
+    subscriptors = list(Subscriptor.subscriptors)
+    stalled = await create_subscriptor(server,"stalled subscriptor",socks,tasks,stalled=True)
+    starttime = time.perf_counter()
+    for healthstatus in healthstatuslist:
+        await Subscriptor.send_healthstatus(healthstatus)
+        #the healthstatus is broadcasted by different healthcheck tasks, let the sender tasks run between the broadcasts
+        await asyncio.sleep(0)
+    for subscriptor in subscriptors:
+        await subscriptor.flush()
+    result.append((time.perf_counter() - starttime) * 1000000 / broadcasts)
+
+    stalled.writer.transport.abort()
+    for subscriptor in list(Subscriptor.subscriptors):
+        await subscriptor.close()
+    for a,b in socks:
+        b.close()
+    for task in tasks:
+        task.cancel()
+    return result
+
+async def main():
+    broadcasts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    subscriptors = [int(n) for n in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1,2,4,8,16,32]
+    print("{:<14}{:>24}{:>20}{:>16}".format("subscriptors","per subscriptor(us)","encode once(us)","stalled(us)"))
+    for n in subscriptors:
+        print("{:<14}{:>24.1f}{:>20.1f}{:>16.1f}".format(n,*(await run(broadcasts,n))))
+
+if __name__ == "__main__":
+    asyncio.run(main())
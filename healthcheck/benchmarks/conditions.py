@@ -0,0 +1,70 @@
+"""
+Compare the evaluation speed of the compiled conditions with the condition interpreter
+Usage: python -m healthcheck.benchmarks.conditions [evaluations]
+"""
+import sys
+import copy
+import time
+import json
+
+import httpx
+
+from .. import checks
+from ..response import CachedResponse
+
+RESPONSE = {
+    "status":"ok",
+    "version":"1.2.3",
+    "count":42,
+    "latency":0.35,
+    "updated":"2025-01-01T00:00:00+08:00",
+    "items":[{"name":"db","status":"ok"},{"name":"cache","status":"ok"},{"name":"queue","status":"degraded"}]
+}
+
+CONDITIONS = [
+    ["httpstatus",200],
+    ["json","status","==","ok"],
+    ["and",["json","count",">",10],["json","latency","<",1.0]],
+    ["or",["json","version","startswith","2."],["json","version","mstartswith",["1.","0."]]],
+    ["json","items[2].status","in",["ok","degraded"]],
+    ["json","count","between",[0,100]],
+    ["not",["json","status","==","down"]],
+    ["json","missing","not_exists"],
+    ["text","pattern","\"status\":\\s*\"ok\""],
+    ["headers","content-type","contain","json"],
+    ["json","count","lambda v:v % 2 == 0"]
+]
+
+def get_response():
+    return httpx.Response(200,content=json.dumps(RESPONSE).encode(),headers={"content-type":"application/json"})
+
+class ParsedResponse(object):
+    """
+    A response whose body is already parsed, used to measure the condition evaluation overhead only
+    """
+    def __init__(self,res):
+        self.status_code = res.status_code
+        self.headers = res.headers
+        self.text = res.text
+        self._json = res.json()
+
+    def json(self):
+        return self._json
+
+if __name__ == '__main__':
+    evaluations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    conds = checks.init_conds(None,["and",*copy.deepcopy(CONDITIONS)])
+    compiled = checks.compile_conds(checks.init_conds(None,["and",*copy.deepcopy(CONDITIONS)]))
+    for resname,res in (("httpx response",get_response()),("cached response",CachedResponse(get_response())),("parsed response",ParsedResponse(get_response()))):
+        if checks.check(res,conds) != compiled(res):
+            raise Exception("The result of the compiled conditions is different from the result of the interpreter")
+
+        results = []
+        for name,func in (("interpreter",lambda:checks.check(res,conds)),("compiled",lambda:compiled(res))):
+            begin = time.perf_counter()
+            for i in range(evaluations):
+                func()
+            spent = time.perf_counter() - begin
+            results.append(evaluations / spent)
+            print("{:<16} {:<12}: conditions={} , evaluations={} , spent={:.3f}s , {:.0f} evaluations/second".format(resname,name,len(CONDITIONS),evaluations,spent,evaluations / spent))
+        print("{:<16} {:<12}: {:.2f}x".format(resname,"speedup",results[1] / results[0]))
@@ -0,0 +1,53 @@
+"""
+Report the per-second probe density of the configured offsets and the auto offsets
+Usage: python -m healthcheck.benchmarks.offsets [healthcheck config file]
+If the config file is not provided, 1000 synthetic services without offset are used.
+"""
+import sys
+import math
+import random
+
+from ..healthcheck import HealthCheck,ServiceHealthCheck
+
+INTERVALS = [30,60,60,60,120,300,300,600]
+
+def get_services(configfile=None):
+    """
+    Return a list of (sectionid,serviceid,interval,offset)
+    """
+    if configfile:
+        healthcheck = HealthCheck(configfile)
+        return [(service.sectionid,service.serviceid,service.interval,service.offset) for section in healthcheck.healthchecksections for service in section.healthcheckservices if section.enabled and service.enabled]
+    else:
+        random.seed(0)
+        return [("section{}".format(i // 20),"service{}".format(i),random.choice(INTERVALS),0) for i in range(1000)]
+
+def get_density(services,auto):
+    """
+    Return the probes per second in a period which is the least common multiple of all the intervals
+    """
+    period = 1
+    for service in services:
+        period = math.lcm(period,service[2])
+    density = [0] * period
+    for sectionid,serviceid,interval,offset in services:
+        if auto:
+            offset = ServiceHealthCheck.get_auto_offset(sectionid,serviceid,interval)
+        for second in range(offset % interval,period,interval):
+            density[second] += 1
+    return density
+
+def report(name,density):
+    probes = sum(density)
+    mean = probes / len(density)
+    ordered = sorted(density)
+    stddev = math.sqrt(sum((d - mean) ** 2 for d in density) / len(density))
+    print("{:<10}: period={}s , probes={} , mean={:.2f}/s , stddev={:.2f} , p50={}/s , p99={}/s , max={}/s , idle seconds={}".format(
+        name,len(density),probes,mean,stddev,ordered[len(ordered) // 2],ordered[int(len(ordered) * 0.99)],ordered[-1],density.count(0)
+    ))
+
+if __name__ == '__main__':
+    services = get_services(sys.argv[1] if len(sys.argv) > 1 else None)
+    print("services={}".format(len(services)))
+    report("configured",get_density(services,False))
+    report("auto",get_density(services,True))
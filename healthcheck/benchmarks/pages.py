@@ -0,0 +1,105 @@
+"""
+Compare the cost of reading the latest records of a history page
+  materialised: the original implementation, the whole page is parsed into a list and reversed
+  reversed: the page is read backwards in blocks from the end of the file, only the returned records are parsed
+Compare the cost of writing and reading the json pages and the binary pages, uncompressed and compressed by gzip and lzma
+  write: save the records one by one to a new page; compress the closed page for the compressed pages
+  read: read all the records of the page
+  latest: read the latest 50 records of the page
+Usage: python -m healthcheck.benchmarks.pages [records per page] [limits separated by comma] [repeats]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+
+from .. import utils
+from .. import settings
+from ..healthcheck import HealthCheckPage,BinaryHealthCheckPage,HealthCheckStatus,PAGE_COMPRESSIONS
+
+def get_records(records):
+    now = utils.now()
+    return [[
+        now + timedelta(seconds=i * 60),
+        now + timedelta(seconds=i * 60,milliseconds=random.randint(10,500)),
+        "red" if i % 13 == 0 else "green",
+        "OK" if i % 13 else "Failed to check the service. ReadTimeout: timed out",
+        None,
+        False
+    ] for i in range(records)]
+
+def write_page(filepath,records):
+    with open(filepath,'w') as f:
+        f.write("\n".join(HealthCheckStatus.serialize(record) for record in get_records(records)))
+
+def compare_formats(tmpdir,records,repeats):
+    recordlist = get_records(records)
+    settings.HEALTHSTATUS_PAGESIZE = records
+    print("{:<14}{:>16}{:>14}{:>16}{:>12}".format("format","write(us/rec)","read(us)","latest(us)","size"))
+    for name,pagecls in (("json",HealthCheckPage),("binary",BinaryHealthCheckPage)):
+        filepath = os.path.join(tmpdir,"formatpage.{}".format(name))
+        starttime = time.perf_counter()
+        page = pagecls(None,utils.now(),filepath)
+        for record in recordlist:
+            page.save(record)
+        write = (time.perf_counter() - starttime) * 1000000 / records
+        for compression in (None,*PAGE_COMPRESSIONS.keys()):
+            if compression:
+                starttime = time.perf_counter()
+                compressedpage = page.compress(compression)
+                testpage = pagecls(None,utils.now(),compressedpage.filepath)
+                #move the index file back to the uncompressed page for the next compression
+                if os.path.exists(compressedpage.indexfile):
+                    os.replace(compressedpage.indexfile,page.indexfile)
+                compresstime = (time.perf_counter() - starttime) * 1000000 / records
+            else:
+                testpage = pagecls(None,utils.now(),filepath)
+                compresstime = 0
+            testpage._load()
+            print("{:<14}{:>16.1f}{:>14.1f}{:>16.1f}{:>12}".format(
+                "{}.{}".format(name,compression) if compression else name,
+                write + compresstime,
+                run(testpage,None,repeats,lambda page,limit:page.pageitems()),
+                run(testpage,50,repeats,lambda page,limit:page.reversed_pageitems(limit)),
+                os.path.getsize(testpage.filepath)
+            ))
+
+def run(page,limit,repeats,f_read):
+    starttime = time.perf_counter()
+    for i in range(repeats):
+        for item in f_read(page,limit):
+            pass
+    return (time.perf_counter() - starttime) * 1000000 / repeats
+
+def materialised(page,limit):
+    items = reversed([d for d in page.pageitems()])
+    return items if limit is None else list(items)[:limit]
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    limits = [None if n == "all" else int(n) for n in sys.argv[2].split(",")] if len(sys.argv) > 2 else [50,500,None]
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filepath = os.path.join(tmpdir,"page.txt")
+        write_page(filepath,records)
+        page = HealthCheckPage(None,utils.now(),filepath)
+        page._load()
+        print("{:<10}{:>20}{:>16}".format("limit","materialised(us)","reversed(us)"))
+        for limit in limits:
+            print("{:<10}{:>20.1f}{:>16.1f}".format(
+                "all" if limit is None else limit,
+                run(page,limit,repeats,materialised),
+                run(page,limit,repeats,lambda page,limit:page.reversed_pageitems(limit))
+            ))
+        print()
+        compare_formats(tmpdir,records,repeats)
+    finally:
+        shutil.rmtree(tmpdir,ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Compare the scheduling overhead of the full service scan with the heap based scheduler
+Usage: python -m healthcheck.benchmarks.scheduler [services] [simulated seconds]
+"""
+import sys
+import time
+import random
+from collections import UserDict
+from datetime import datetime,timedelta
+
+from .. import settings
+from ..healthcheck import SectionHealthCheck,ServiceHealthCheck
+from ..scheduler import ServiceScheduler
+
+INTERVALS = [30,60,120,300,600,3600]
+
+def get_sections(services,starttime):
+    random.seed(0)
+    sections = {}
+    section = None
+    for i in range(services):
+        if i % 100 == 0:
+            section = SectionHealthCheck({"id":"section{}".format(len(sections)),"enabled":True,"services":{}})
+            sections[section.sectionid] = section
+        interval = random.choice(INTERVALS)
+        service = ServiceHealthCheck.__new__(ServiceHealthCheck)
+        UserDict.__init__(service,{
+            "section":section,
+            "id":"service{}".format(i),
+            "interval":interval,
+            "offset":random.randint(0,interval - 1),
+            "checkingtime":None,
+            "enabled":True,
+            "healthstatus":[None,None]
+        })
+        service.healthstatus_nextchecktime = service.get_nextchecktime(service["offset"],None,starttime,*get_day(starttime))
+        section["services"][service.serviceid] = service
+    return sections
+
+def get_day(now):
+    today = datetime(year = now.year,month=now.month,day=now.day,tzinfo=settings.TZ)
+    return (today,today + timedelta(days=1),int((now - today).total_seconds()))
+
+def scan(sections,now):
+    """
+    The original implementation: scan all the services in each wake-up
+    Return (the number of due services,next runtime)
+    """
+    today,tomorrow,seconds_in_day = get_day(now)
+    next_runtime = None
+    dues = 0
+    for section in sections.values():
+        if not section.enabled:
+            continue
+        for service in section["services"].values():
+            if not service.enabled:
+                continue
+            if now >= service.healthstatus_nextchecktime:
+                dues += 1
+                next_checktime = service.get_nextchecktime(service["offset"],service.healthstatus_nextchecktime,now,today,tomorrow,seconds_in_day)
+                service.healthstatus_nextchecktime = next_checktime
+            else:
+                next_checktime = service.healthstatus_nextchecktime
+            if not next_runtime or next_runtime > next_checktime:
+                next_runtime = next_checktime
+    return (dues,next_runtime)
+
+def schedule(scheduler,sections,now):
+    """
+    The heap based implementation: only pop the due services
+    Return (the number of due services,next runtime)
+    """
+    if scheduler.is_outdated(sections):
+        scheduler.rebuild(sections,now)
+    today,tomorrow,seconds_in_day = get_day(now)
+    dues = 0
+    for service in list(scheduler.pop_dues(now)):
+        dues += 1
+        next_checktime = service.get_nextchecktime(service["offset"],service.healthstatus_nextchecktime,now,today,tomorrow,seconds_in_day)
+        if next_checktime <= now:
+            next_checktime = service.get_nextchecktime(service["offset"],now,now,today,tomorrow,seconds_in_day)
+        service.healthstatus_nextchecktime = next_checktime
+        scheduler.push(service)
+    return (dues,scheduler.next_checktime)
+
+def run(name,services,duration,func):
+    starttime = datetime(2025,1,1,1,0,0,tzinfo=settings.TZ)
+    endtime = starttime + timedelta(seconds=duration)
+    sections = get_sections(services,starttime)
+    now = starttime
+    wakeups = 0
+    checks = 0
+    spent = 0
+    while now < endtime:
+        begin = time.perf_counter()
+        dues,next_runtime = func(sections,now)
+        spent += time.perf_counter() - begin
+        wakeups += 1
+        checks += dues
+        #wake up at the next runtime, the same as call_later
+        now = max(next_runtime,now)
+    print("{:<10}: services={} , wakeups={} , checks={} , total={:.3f}s , per wakeup={:.3f}ms , per check={:.2f}us".format(
+        name,services,wakeups,checks,spent,spent * 1000 / wakeups,spent * 1000000 / checks if checks else 0
+    ))
+
+if __name__ == '__main__':
+    services = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    duration = int(sys.argv[2]) if len(sys.argv) > 2 else 3600
+    run("scan",services,duration,scan)
+    scheduler = ServiceScheduler()
+    run("heap",services,duration,lambda sections,now:schedule(scheduler,sections,now))
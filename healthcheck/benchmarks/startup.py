@@ -0,0 +1,155 @@
+"""
+Compare the startup time of loading the healthcheck status from the pages, from the pages with the sidecar index files and from the checkpoint file
+The history of the services is generated in the data dir before the benchmark and removed after it,
+the files are in the os page cache in both cases, so the difference is the cpu time of reading and parsing the files
+Usage: HEALTHCHECK_DATA_DIR=<data dir> python -m healthcheck.benchmarks.startup [services] [days] [interval in seconds]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+from datetime import timedelta
+
+from .. import settings
+from .. import utils
+from ..healthcheck import HealthCheck,HealthCheckStatus,HealthCheckPages,HealthCheckErrorPages,HealthCheckCheckpoint
+
+CONFIGNAME = "startupbenchmark"
+
+def get_configs(services):
+    sections = []
+    for i in range(services):
+        if i % 100 == 0:
+            section = {"id":"section{}".format(len(sections)),"name":"section{}".format(len(sections)),"interval":60,"historyexpire":0,"errorhistoryexpire":0,"services":[]}
+            sections.append(section)
+        section["services"].append({
+            "id":"service{}".format(i),
+            "name":"service{}".format(i),
+            "historyexpire":60,
+            "errorhistoryexpire":0,
+            "location":"http://127.0.0.1/service{}".format(i),
+            "healthchecks":{"green":["httpstatus","=",200]}
+        })
+    return sections
+
+def generate(basedir,configs,days,interval):
+    """
+    Write the page index and the pages of the services directly, the first status is yellow and there is a red status every 1000 status,
+    so finding the last yellow status needs to read all the pages.
+    Return the number of the generated status
+    """
+    endtime = utils.now()
+    starttime = endtime - timedelta(days=days)
+    records = 0
+    for section in configs:
+        for service in section["services"]:
+            servicedir = os.path.join(basedir,section["id"],service["id"])
+            os.makedirs(os.path.join(servicedir,"pages"))
+            pageindex = []
+            page = None
+            checktime = starttime
+            i = 0
+            while checktime < endtime:
+                if i % settings.HEALTHSTATUS_PAGESIZE == 0:
+                    if page:
+                        page.close()
+                    pagefile = os.path.join("pages","page_{}.json".format(checktime.strftime("%Y%m%dT%H%M%S")))
+                    pageindex.append(json.dumps([checktime.strftime("%Y-%m-%dT%H:%M:%S.%f"),pagefile]))
+                    page = open(os.path.join(servicedir,pagefile),'w')
+                else:
+                    page.write("\n")
+                if i == 0:
+                    status = "yellow"
+                elif i % 1000 == 0:
+                    status = "red"
+                else:
+                    status = "green"
+                page.write(HealthCheckStatus.serialize([checktime,checktime + timedelta(milliseconds=50),status,"",None,False]))
+                checktime += timedelta(seconds=interval)
+                i += 1
+            if page:
+                page.close()
+            with open(os.path.join(servicedir,"pageindex.json"),'w') as f:
+                f.write("\n".join(pageindex))
+            records += i
+    return records
+
+def clear_caches():
+    HealthCheckPages._instances.clear()
+    HealthCheckErrorPages._instances.clear()
+    HealthCheckCheckpoint._instances.clear()
+
+def load(configfile):
+    """
+    Return (the time to load the last status,the time to load the last status of each colour,the loaded status,the healthcheck)
+    """
+    clear_caches()
+    starttime = time.perf_counter()
+    healthcheck = HealthCheck(configfile)
+    healthcheck.load_checkingstatus()
+    loadtime = time.perf_counter() - starttime
+    result = []
+    for section in healthcheck.sections.values():
+        for service in section["services"].values():
+            result.append((service.healthstatus_healthdata,service.last_greenhealthcheck,service.last_yellowhealthcheck,service.last_redhealthcheck,service.last_errorhealthcheck))
+    return (loadtime,time.perf_counter() - starttime,result,healthcheck)
+
+def build_checkpoint(healthcheck):
+    """
+    Build the checkpoint from the loaded pages, same as the healthstatus writer does after saving the first status of each service
+    """
+    for section in healthcheck.sections.values():
+        for service in section["services"].values():
+            checkpoint = service.healthcheckpages.checkpoint
+            if checkpoint:
+                checkpoint.update(service.healthcheckpages,service.healthstatus_healthdata)
+    checkpoint = HealthCheckCheckpoint.get_instance(healthcheck.configfile)
+    checkpoint.save(force=True)
+    return checkpoint
+
+def main():
+    services = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    interval = int(sys.argv[3]) if len(sys.argv) > 3 else 900
+
+    basedir = os.path.join(settings.HEALTHCHECK_DATA_DIR,CONFIGNAME)
+    if os.path.exists(basedir):
+        print("The folder({}) already exists, remove it before running the benchmark".format(basedir))
+        sys.exit(1)
+    tmpdir = tempfile.mkdtemp()
+    configfile = os.path.join(tmpdir,"{}.json".format(CONFIGNAME))
+    try:
+        configs = get_configs(services)
+        with open(configfile,'w') as f:
+            f.write(json.dumps(configs))
+
+        starttime = time.perf_counter()
+        records = generate(basedir,configs,days,interval)
+        print("services={} days={} interval={}s status={} generated in {:.1f}s".format(services,days,interval,records,time.perf_counter() - starttime))
+
+        settings.HEALTHSTATUS_CHECKPOINT = False
+        settings.HEALTHSTATUS_PAGE_INDEX = False
+        pages_loadtime,pages_totaltime,pages_result,healthcheck = load(configfile)
+
+        #the index files of the full pages are created by the first load
+        settings.HEALTHSTATUS_PAGE_INDEX = True
+        load(configfile)
+        index_loadtime,index_totaltime,index_result,healthcheck = load(configfile)
+
+        settings.HEALTHSTATUS_CHECKPOINT = True
+        checkpoint = build_checkpoint(healthcheck)
+        checkpoint_loadtime,checkpoint_totaltime,checkpoint_result,healthcheck = load(configfile)
+
+        print("{:<12}{:>16}{:>28}".format("source","last status(s)","last status by colour(s)"))
+        print("{:<12}{:>16.3f}{:>28.3f}".format("pages",pages_loadtime,pages_totaltime))
+        print("{:<12}{:>16.3f}{:>28.3f}".format("page index",index_loadtime,index_totaltime))
+        print("{:<12}{:>16.3f}{:>28.3f}".format("checkpoint",checkpoint_loadtime,checkpoint_totaltime))
+        print("checkpoint file size={} bytes, same result={}".format(os.path.getsize(checkpoint.file),pages_result == index_result == checkpoint_result))
+    finally:
+        shutil.rmtree(basedir,ignore_errors=True)
+        shutil.rmtree(tmpdir,ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
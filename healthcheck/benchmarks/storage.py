@@ -0,0 +1,98 @@
+"""
+Compare the file history storage and the sqlite history storage
+  write: save the statuses of the services through the pages in batches, same as the healthstatus writer does
+  query: find all the red statuses of a section in the last 7 days, the file storage reads the pages of all the services in the section
+The history of the services is generated in the data dir by the benchmark and removed after it
+Usage: HEALTHCHECK_DATA_DIR=<data dir> python -m healthcheck.benchmarks.storage [services] [days] [interval in seconds]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+from datetime import timedelta
+
+from .. import settings
+from .. import utils
+from ..healthcheck import HealthCheck,HealthCheckPages,HealthCheckErrorPages,SqliteHistoryStorage
+from .startup import get_configs
+
+CONFIGNAME = "storagebenchmark"
+
+def write(healthcheck,days,interval):
+    """
+    Return (the number of the saved statuses,the time per status in microseconds)
+    """
+    services = [service for section in healthcheck.sections.values() for service in section["services"].values() if service.url]
+    endtime = utils.now()
+    checktime = endtime - timedelta(days=days)
+    batch = []
+    records = 0
+    starttime = time.perf_counter()
+    while checktime < endtime:
+        for service in services:
+            batch.append((service.healthcheckpages,[checktime,checktime + timedelta(milliseconds=50),"red" if records % 20 == 0 else "green","",None,False]))
+            records += 1
+            if len(batch) >= settings.HEALTHSTATUS_WRITER_BATCHSIZE:
+                save(batch)
+        checktime += timedelta(seconds=interval)
+    save(batch)
+    return (records,(time.perf_counter() - starttime) * 1000000 / records)
+
+def save(batch):
+    storages = set(healthcheckpages.storage for healthcheckpages,healthstatus in batch)
+    for storage in storages:
+        storage.begin_batch()
+    for healthcheckpages,healthstatus in batch:
+        healthcheckpages.save(healthstatus)
+    for storage in storages:
+        storage.commit()
+    batch.clear()
+
+def query_pages(healthcheck,sectionid,since):
+    result = []
+    for service in healthcheck.sections[sectionid]["services"].values():
+        pages = service.healthcheckpages.get_pages()
+        for i,page in enumerate(pages):
+            if i < len(pages) - 1 and pages[i + 1].starttime <= since:
+                continue
+            for healthstatus in page.pageitems():
+                if healthstatus[2] == "red" and healthstatus[0] >= since:
+                    result.append([sectionid,service.serviceid,healthstatus])
+    return result
+
+def run(storage,services,days,interval):
+    settings.HEALTHSTATUS_STORAGE = storage
+    HealthCheckPages._instances.clear()
+    HealthCheckErrorPages._instances.clear()
+    configfile = os.path.join(settings.HEALTHCHECK_DATA_DIR,"{}_{}.json".format(CONFIGNAME,storage))
+    with open(configfile,'w') as f:
+        f.write(json.dumps(get_configs(services)))
+    healthcheck = HealthCheck(configfile)
+    records,writetime = write(healthcheck,days,interval)
+
+    since = utils.now() - timedelta(days=7)
+    starttime = time.perf_counter()
+    if storage == "sqlite":
+        result = SqliteHistoryStorage.get_instance(configfile).query(section="section0",status="red",starttime=since)
+    else:
+        result = query_pages(healthcheck,"section0",since)
+    querytime = (time.perf_counter() - starttime) * 1000
+    return (records,writetime,querytime,len(result))
+
+def main():
+    services = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 14
+    interval = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+
+    print("{:<10}{:>10}{:>16}{:>12}{:>8}".format("storage","records","write(us/rec)","query(ms)","red"))
+    try:
+        for storage in ("file","sqlite"):
+            print("{:<10}{:>10}{:>16.1f}{:>12.1f}{:>8}".format(storage,*run(storage,services,days,interval)))
+    finally:
+        for storage in ("file","sqlite"):
+            shutil.rmtree(os.path.join(settings.HEALTHCHECK_DATA_DIR,"{}_{}".format(CONFIGNAME,storage)),ignore_errors=True)
+            utils.remove_file(os.path.join(settings.HEALTHCHECK_DATA_DIR,"{}_{}.json".format(CONFIGNAME,storage)))
+
+if __name__ == "__main__":
+    main()
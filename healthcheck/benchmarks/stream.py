@@ -0,0 +1,51 @@
+"""
+Compare the cost of streaming the received healthstatus to the dashboards
+  per stream: the original implementation, each stream formats and encodes the healthstatus read from the status list
+  shared: the listener encodes the healthstatus once when it is added to the status list, each stream yields the shared bytes
+Each dashboard stream is simulated by a reader of the status list, the time is the time of one healthstatus delivered to all the streams
+Usage: python -m healthcheck.benchmarks.stream [healthstatus] [stream numbers separated by comma]
+"""
+import sys
+import time
+from datetime import timedelta
+
+from .. import utils
+from ..healthcheckclient import HealthStatusListenerClient,dump_servicehealthstatus
+
+def get_healthstatus(i):
+    now = utils.now()
+    return [["section{}".format(i % 10),"service{}".format(i % 500)],[now + timedelta(seconds=60),[now,now + timedelta(milliseconds=50),"green","OK",None,False]]]
+
+def run(healthstatuslist,streams):
+    listener = HealthStatusListenerClient()
+    result = []
+
+    readers = [listener.get_healthstatusreader() for i in range(streams)]
+    starttime = time.perf_counter()
+    for healthstatus in healthstatuslist:
+        listener._statuslist.add(healthstatus)
+        for reader in readers:
+            for data in reader.items():
+                data = dump_servicehealthstatus(*data[0],data[1]).encode()
+    result.append((time.perf_counter() - starttime) * 1000000 / len(healthstatuslist))
+
+    readers = [listener.get_healthstatusreader() for i in range(streams)]
+    starttime = time.perf_counter()
+    for healthstatus in healthstatuslist:
+        listener._add(healthstatus)
+        for reader in readers:
+            for healthstatus,data in reader.items():
+                pass
+    result.append((time.perf_counter() - starttime) * 1000000 / len(healthstatuslist))
+    return result
+
+def main():
+    healthstatus = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    streams = [int(n) for n in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1,10,50,200]
+    healthstatuslist = [get_healthstatus(i) for i in range(healthstatus)]
+    print("{:<10}{:>18}{:>14}".format("streams","per stream(us)","shared(us)"))
+    for n in streams:
+        print("{:<10}{:>18.1f}{:>14.1f}".format(n,*run(healthstatuslist,n)))
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ from .. import settings
 from .base import datanotfound
 from . import httpstatus,jsonresponse,textresponse,httpheaders,redirect,regexresponse
 from .. import utils
+from ..response import CachedResponse
 
 TZ = settings.TZ
 
@@ -40,6 +41,21 @@ def lambda_func_fatctory(service,func):
     else:
         return func
 
+def _lambda_response(res):
+    """
+    Return the response whose data is passed to the user lambdas
+    The json data of the cached response is shared by all conditions, messages and prtg data, the user lambdas read a private copy of it
+    """
+    return res.private if isinstance(res,CachedResponse) else res
+
+def _lambda_func_factory(f):
+    """
+    Return a function which calls the user lambda with the response for the user lambdas
+    """
+    def _func(res):
+        return f(_lambda_response(res))
+    return _func
+
 
 def parse_checkingtime(checkingtime):
     if not checkingtime:
@@ -114,11 +130,11 @@ def _convert_datatype(val,dt,params=None):
 
     if isinstance(val,dt):
         #sort the list data, if ignore_order is True
+        #sort a copy, the val is shared with other conditions through the cached response
         if dt == list and params and params.get("ignore_order",False):
-            val.sort()
+            val = sorted(val)
         elif dt == tuple and params and params.get("ignore_order",False):
-            val = list(val)
-            val.sort()
+            val = sorted(val)
 
         return val
 
@@ -273,7 +289,7 @@ def _init_cond(service,cond):
     
     if cond[1] in ("and","or"):
         if len(cond) < 3:
-            raise Exception("The condition({}) is invalid.logical operator({}) should have at least one logical expression.{}".format(cond,con[1],conds_help))
+            raise Exception("The condition({}) is invalid.logical operator({}) should have at least one logical expression.{}".format(cond,cond[1],conds_help))
         #convert the condition from [module,and|or,val1,val2...] to [and|or,[module,key,conditon,expectedvalue],...]
         newcond=[cond[1]]
         for i in range(2,len(cond),1):
@@ -285,7 +301,7 @@ def _init_cond(service,cond):
 
     elif cond[1] == "not":
         if len(cond) != 3:
-            raise Exception("The condition({}) is invalid.logical operator({}) only accept one logical expression.{}".format(cond,con[1],conds_help))
+            raise Exception("The condition({}) is invalid.logical operator({}) only accept one logical expression.{}".format(cond,cond[1],conds_help))
         newcond=[cond[1]]
         #convert the condition from [module,not,val1] to [not,[module,key,conditon,expectedvalue]]
         if isinstance(cond[2],(list,tuple)):
@@ -303,7 +319,7 @@ def _init_cond(service,cond):
         if len(cond) == 2:
             cond.append(None)
         elif len(cond) > 3:
-            raise Exception("The condition({}) is invalid.{}".format(conds,conds_help))
+            raise Exception("The condition({}) is invalid.{}".format(cond,conds_help))
         cond.insert(1,None)
         cond.insert(2,"lambda")
     elif len(cond) >=3 and isinstance(cond[2],str) and cond[2].strip().startswith("lambda "):
@@ -314,7 +330,7 @@ def _init_cond(service,cond):
         if len(cond) == 3:
             cond.append(None)
         elif len(cond) > 4:
-            raise Exception("The condition({}) is invalid.{}".format(conds,conds_help))
+            raise Exception("The condition({}) is invalid.{}".format(cond,conds_help))
         cond.insert(2,"lambda")
     elif cond[1] in operators:
         """
@@ -324,7 +340,7 @@ def _init_cond(service,cond):
         if len(cond) == 3:
             cond.append(None)
         elif len(cond) > 4:
-            raise Exception("The condition({}) is invalid.{}".format(conds,conds_help))
+            raise Exception("The condition({}) is invalid.{}".format(cond,conds_help))
         cond.insert(1,None)
     elif len(cond) >= 3 and isinstance(cond[2],str) and cond[2] in operators:
         """
@@ -467,7 +483,7 @@ def init_conds(service,conds):
         if len(conds) < 2:
             raise Exception("The condition({}) is invalid, missing logical expressions of the logical operator({})".format(conds,conds[0]))
         elif any(not isinstance(cond,(list,tuple)) for cond in conds[1:]):
-            raise Exception("The condition({}) is invalid, The logical expressions of the logical operator({}) must be type list or tuple).{}".format(conds,conds_help))
+            raise Exception("The condition({}) is invalid, The logical expressions of the logical operator({}) must be type list or tuple).{}".format(conds,conds[0],conds_help))
         for i in range(1,len(conds),1):
             conds[i] = init_conds(service,conds[i])
         return conds
@@ -475,7 +491,7 @@ def init_conds(service,conds):
         if len(conds) != 2:
             raise Exception("The condition({}) is invalid, the logical operator({}) only accept one logical expression.{}".format(conds,conds[0],conds_help))
         elif not isinstance(conds[1],(list,tuple)):
-            raise Exception("The condition({}) is invalid, The logical expression of the logical operator({}) must be type list or tuple).{}".format(conds,conds_help))
+            raise Exception("The condition({}) is invalid, The logical expression of the logical operator({}) must be type list or tuple).{}".format(conds,conds[0],conds_help))
         conds[1] = init_conds(service,conds[1])
         return conds
     else:
@@ -597,8 +613,8 @@ def _cond_or(res,conds,messages = None):
 
     return False
 
-def _cond_not(res,conds,messages = None):
-    return not check(res,conds,messages = messages)
+def _cond_not(res,cond,messages = None):
+    return not check(res,cond,messages = messages)
 
 def check(res,conds,messages=None):
     valid = None
@@ -609,9 +625,9 @@ def check(res,conds,messages=None):
     elif conds[0] == "or":
         return _cond_or(res,conds[1:],messages = messages)
     elif conds[0] == "not":
-        return _cond_not(res,conds[1:],messages = messages)
+        return _cond_not(res,conds[1],messages = messages)
     else:
-        val = _get_value(modules[conds[0]],res,key=conds[1])
+        val = _get_value(modules[conds[0]],_lambda_response(res) if conds[2] == "lambda" else res,key=conds[1])
         checkresult = _check_cond(val,conds[2],conds[3],conds[4])
         if messages is not None:
             if conds[2] == "lambda":
@@ -622,6 +638,141 @@ def check(res,conds,messages=None):
                 messages.append("{} : {}({}) {} {}".format("True " if checkresult else "False",conds[5],val,conds[2],conds[3]))
         return checkresult
 
+_null_operators = {
+    "exists":lambda val:val != datanotfound,
+    "exist":lambda val:val != datanotfound,
+    "not_exists":lambda val:val == datanotfound,
+    "not_exist":lambda val:val == datanotfound,
+    "is_null":lambda val:True if val == datanotfound else val is None,
+    "is_not_null":lambda val:False if val == datanotfound else val is not None
+}
+
+_value_operators = {
+    "==":lambda val,expected_val:val == expected_val,
+    "=":lambda val,expected_val:val == expected_val,
+    "!=":lambda val,expected_val:val != expected_val,
+    "<>":lambda val,expected_val:val != expected_val,
+    "<":lambda val,expected_val:val < expected_val,
+    "<=":lambda val,expected_val:val <= expected_val,
+    ">":lambda val,expected_val:val > expected_val,
+    ">=":lambda val,expected_val:val >= expected_val,
+    "between":lambda val,expected_val:val >= expected_val[0] and val < expected_val[1],
+    "in":lambda val,expected_val:val in expected_val,
+    "not_in":lambda val,expected_val:val not in expected_val,
+    "startswith":lambda val,expected_val:val.startswith(expected_val),
+    "mstartswith":lambda val,expected_val:any(val.startswith(v) for v in expected_val),
+    "endswith":lambda val,expected_val:val.endswith(expected_val),
+    "mendswith":lambda val,expected_val:any(val.endswith(v) for v in expected_val),
+    "pattern":lambda val,expected_val:True if expected_val.search(val) else False,
+    "mpattern":lambda val,expected_val:any(True if v.search(val) else False for v in expected_val),
+    "contain":lambda val,expected_val:expected_val in val,
+    "mcontain":lambda val,expected_val:any(v in val for v in expected_val)
+}
+
+def _is_relativedate(val):
+    if isinstance(val,str):
+        return True if relativedate_re.search(val) else False
+    elif isinstance(val,(list,tuple)):
+        return any(_is_relativedate(v) for v in val)
+    else:
+        return False
+
+def _compile_cond(cond):
+    """
+    Compile a single condition [module,key,operator,expected_value,params,label] which is initialized by _init_cond
+    The operator is resolved and the expected value is converted only once, except the relative date which is relative to the checking time
+    """
+    module,key,operator,expected_val,params,label = cond
+    f_get_value = modules[module].get_value
+    dt = params.get("dtype") if params else None
+    convert_val = True if dt and dt != re.Pattern and dt != "function" else False
+
+    if operator == "lambda":
+        f_expected_val = None
+    elif dt in (date,datetime,timedelta) and _is_relativedate(expected_val):
+        #relative date, should be converted in each checking
+        def f_expected_val():
+            return _convert_datatype(expected_val,dt,params=params)
+    else:
+        if operator != "pattern":
+            expected_val = _convert_datatype(expected_val,dt,params=params)
+        f_expected_val = None
+
+    if operator == "lambda":
+        def f_check(val):
+            return expected_val(val)
+    elif operator in _null_operators:
+        f_check = _null_operators[operator]
+    elif operator in _value_operators:
+        f_operator = _value_operators[operator]
+        def f_check(val):
+            if val == datanotfound or val is None:
+                return False
+            return f_operator(val,f_expected_val() if f_expected_val else expected_val)
+    else:
+        raise Exception("The operation({} {}) with data type({}) Not Support".format(operator,expected_val,dt))
+
+    if operator == "lambda":
+        def f_message(checkresult,val):
+            return "{} : lambda({}({}))".format("True " if checkresult else "False",label,val)
+    elif operators[operator][0] == 0:
+        def f_message(checkresult,val):
+            return "{} : {}({}) {}".format("True " if checkresult else "False",label,val,operator)
+    else:
+        def f_message(checkresult,val):
+            return "{} : {}({}) {} {}".format("True " if checkresult else "False",label,val,operator,cond[3])
+
+    def _func(res,messages=None):
+        if operator == "lambda":
+            res = _lambda_response(res)
+        try:
+            val = f_get_value(res,key) if key else f_get_value(res)
+        except KeyError as ex:
+            val = datanotfound
+        except IndexError as ex:
+            val = datanotfound
+        #the message shows the original value, the same as 'check'
+        checkresult = f_check(_convert_datatype(val,dt,params=params) if convert_val else val)
+        if messages is not None:
+            messages.append(f_message(checkresult,val))
+        return checkresult
+
+    return _func
+
+def _always_true(res,messages=None):
+    return True
+
+def compile_conds(conds):
+    """
+    Compile the conditions initialized by init_conds to a function with signature (res,messages=None)
+    The compiled function has the same result and messages as 'check(res,conds,messages)'
+    """
+    if not conds:
+        return _always_true
+    elif conds[0] == "and":
+        funcs = [compile_conds(cond) for cond in conds[1:]]
+        def _cond_and(res,messages=None):
+            for f in funcs:
+                if not f(res,messages=messages):
+                    return False
+            return True
+        return _cond_and
+    elif conds[0] == "or":
+        funcs = [compile_conds(cond) for cond in conds[1:]]
+        def _cond_or(res,messages=None):
+            for f in funcs:
+                if f(res,messages=messages):
+                    return True
+            return False
+        return _cond_or
+    elif conds[0] == "not":
+        func = compile_conds(conds[1])
+        def _cond_not(res,messages=None):
+            return not func(res,messages=messages)
+        return _cond_not
+    else:
+        return _compile_cond(conds)
+
 get_message_help = """Only support the following retrieving message configurations
 1. constant message string
 2. lambda express with parameter response
@@ -652,6 +803,8 @@ def _get_value_factory(service,config,datanotfound_value="N/A"):
         raise Exception(get_message_help)
 
     def _func(res):
+        if _f:
+            res = _lambda_response(res)
         try:
             if params:
                 data = f_get_value(res,params)
@@ -692,7 +845,7 @@ def get_message_factory(service,config,datanotfound_value="N/A"):
 
     if isinstance(config,str):
         if config.startswith("lambda"):
-            return lambda_func_fatctory(service,eval(config))
+            return _lambda_func_factory(lambda_func_fatctory(service,eval(config)))
         else:
             config = [config]
     elif not isinstance(config,(tuple,list)):
@@ -716,7 +869,7 @@ def get_prtg_factory(service,config):
 
     if isinstance(config,str):
         if config.startswith("lambda"):
-            return lambda_func_fatctory(service,eval(config))
+            return _lambda_func_factory(lambda_func_fatctory(service,eval(config)))
         else:
             config = [config]
     elif not isinstance(config,(tuple,list)):
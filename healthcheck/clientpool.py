@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import http.cookiejar
+from datetime import timedelta
+from contextlib import asynccontextmanager
+
+import httpx
+
+from . import settings
+from . import shutdown
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+class PooledClient(object):
+    """
+    A long-lived httpx client shared by all the services with the same connection parameters.
+    The keep-alive connections are reused across the healthcheck runs.
+    The cookies are never stored, the same as a new client per request, so the cookies set by one service don't leak to other services and probes
+    """
+    def __init__(self,key):
+        self.key = key
+        auth,sslverify,headers,timeout = key
+        self.client = httpx.AsyncClient(
+            auth=auth,
+            timeout=timeout,
+            verify=sslverify,
+            headers=dict(headers) if headers else None,
+            cookies=self.get_cookiejar(),
+            limits=httpx.Limits(
+                max_connections=settings.HTTPCLIENT_MAX_CONNECTIONS or None,
+                max_keepalive_connections=settings.HTTPCLIENT_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTPCLIENT_KEEPALIVE_EXPIRY
+            )
+        )
+        self.extensions = {"trace":self._trace}
+        self.requests = 0
+        self.connections = 0
+        self.inflight = 0
+        self.retired = False
+        self.last_usetime = utils.now()
+
+    @staticmethod
+    def get_cookiejar():
+        #a cookie jar which rejects all cookies
+        return http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+    def __str__(self):
+        auth,sslverify,headers,timeout = self.key
+        return "user={},sslverify={},headers={},timeout={}".format(auth[0] if auth else None,sslverify,[h[0] for h in headers] if headers else None,timeout)
+
+    async def _trace(self,event,info):
+        #only the new established connections are traced, the request served by a keep-alive connection doesn't connect again
+        if event in ("connection.connect_tcp.complete","connection.connect_unix_socket.complete"):
+            self.connections += 1
+
+    @property
+    def reuserate(self):
+        if not self.requests:
+            return 0
+        return max(0,self.requests - self.connections) / self.requests
+
+    async def close(self):
+        try:
+            await self.client.aclose()
+        except Exception as ex:
+            logger.error("Failed to close the http client({}).{}: {}".format(self,ex.__class__.__name__,str(ex)))
+
+class HttpClientPool(object):
+    """
+    The pool of long-lived httpx clients, keyed by (auth,sslverify,headers,timeout)
+    Only one pool per process.
+    """
+    def __init__(self):
+        self._clients = {}
+        #the statistics of the closed clients
+        self._closed_requests = 0
+        self._closed_connections = 0
+        self._next_sweeptime = None
+        shutdown.register_service(self)
+
+    def __str__(self):
+        return "HttpClientPool"
+
+    @staticmethod
+    def get_key(servicehealthcheck):
+        headers = servicehealthcheck.headers
+        return (
+            servicehealthcheck.auth,
+            servicehealthcheck.sslverify,
+            tuple(sorted(headers.items())) if headers else None,
+            servicehealthcheck.request_timeout
+        )
+
+    @asynccontextmanager
+    async def client(self,servicehealthcheck):
+        """
+        Return a pooled client for the service
+        The client will not be closed until it is not used by any running healthcheck task
+        """
+        key = self.get_key(servicehealthcheck)
+        pooledclient = self._clients.get(key)
+        if not pooledclient:
+            pooledclient = PooledClient(key)
+            self._clients[key] = pooledclient
+            logger.debug("Create a pooled http client({})".format(pooledclient))
+
+        pooledclient.inflight += 1
+        pooledclient.requests += 1
+        try:
+            yield pooledclient
+        finally:
+            pooledclient.inflight -= 1
+            pooledclient.last_usetime = utils.now()
+            if pooledclient.retired and pooledclient.inflight == 0:
+                await self._close(pooledclient)
+            self._sweep()
+
+    def _retire(self,pooledclient):
+        if self._clients.get(pooledclient.key) is pooledclient:
+            del self._clients[pooledclient.key]
+        pooledclient.retired = True
+        if pooledclient.inflight == 0:
+            try:
+                asyncio.get_running_loop().create_task(self._close(pooledclient))
+            except RuntimeError as ex:
+                #no running loop, the client has never been used in this process
+                pass
+
+    async def _close(self,pooledclient):
+        self._closed_requests += pooledclient.requests
+        self._closed_connections += pooledclient.connections
+        pooledclient.requests = 0
+        pooledclient.connections = 0
+        await pooledclient.close()
+        logger.debug("Close the pooled http client({})".format(pooledclient))
+
+    def _sweep(self):
+        """
+        Close the clients which are idle for more than HTTPCLIENT_IDLE_TIMEOUT
+        """
+        now = utils.now()
+        if self._next_sweeptime and now < self._next_sweeptime:
+            return
+        self._next_sweeptime = now + timedelta(seconds=settings.HTTPCLIENT_SWEEP_INTERVAL)
+        for pooledclient in list(self._clients.values()):
+            if pooledclient.inflight == 0 and (now - pooledclient.last_usetime).total_seconds() > settings.HTTPCLIENT_IDLE_TIMEOUT:
+                self._retire(pooledclient)
+
+    def invalidate(self,keys):
+        """
+        Retire the clients with the keys, the retired client will be closed right after it is not used by any running task.
+        """
+        for key in keys:
+            pooledclient = self._clients.get(key)
+            if pooledclient:
+                logger.debug("Invalidate the pooled http client({})".format(pooledclient))
+                self._retire(pooledclient)
+
+    @property
+    def stats(self):
+        requests = self._closed_requests
+        connections = self._closed_connections
+        clients = []
+        for pooledclient in self._clients.values():
+            requests += pooledclient.requests
+            connections += pooledclient.connections
+            clients.append({
+                "client":str(pooledclient),
+                "requests":pooledclient.requests,
+                "connections":pooledclient.connections,
+                "inflight":pooledclient.inflight,
+                "reuserate":round(pooledclient.reuserate,4)
+            })
+
+        return {
+            "clients":clients,
+            "requests":requests,
+            "connections":connections,
+            "reuserate":round(max(0,requests - connections) / requests,4) if requests else 0
+        }
+
+    async def shutdown(self):
+        while self._clients:
+            key,pooledclient = self._clients.popitem()
+            await pooledclient.close()
+
+clientpool = HttpClientPool()
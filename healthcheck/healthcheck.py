@@ -1,4 +1,5 @@
 import sys
+import abc
 import inspect
 import re
 import hashlib
@@ -9,6 +10,13 @@ import math
 import json
 import os
 import time
+import struct
+import mmap
+import gzip
+import lzma
+import contextlib
+import sqlite3
+import threading
 import logging
 import httpx
 import urllib.parse
@@ -25,11 +33,16 @@ from . import utils
 from . import serializers
 from . import shutdown
 from .locks import FileLock
+from .response import CachedResponse
+from .writer import writer
+from .clientpool import clientpool
+from .scheduler import ServiceScheduler,dispatcher
 
 logger = logging.getLogger("healthcheck.healthcheck")
 
 #urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 PRTGDATA_NOT_ENABLED = "Disabled"
+AUTO_OFFSET = "auto"
 
 class BaseServiceHealthCheckTask(object):
     def __init__(self,servicehealthcheck):
@@ -48,54 +61,65 @@ class BaseServiceHealthCheckTask(object):
         ))
         pass
 
-    async def run(self):
+    async def fetch(self):
+        """
+        Send the request of the service
+        Return (starttime,endtime,response,healthstatus), healthstatus is not None if the request is failed
+        """
         starttime = utils.now()
         endtime = None
         res = None
+        healthstatus = None
         if self.servicehealthcheck.url:
             try:
                 try:
-                    res = None
                     data = None
                     #logger.debug("{} : Start to run the healthcheck task({})".format(self.servicehealthcheck,self.__class__.__name__))
-                    async with httpx.AsyncClient(auth=self.servicehealthcheck.auth,timeout=self.servicehealthcheck.request_timeout,verify=self.servicehealthcheck.sslverify,headers=self.servicehealthcheck.headers) as client:
-                        if self.servicehealthcheck.method == "GET":
-                            func = client.get
-                        elif self.servicehealthcheck.method == "POST":
-                            func = client.post
-                            data = self.servicehealthcheck.formdata
-                        elif self.servicehealthcheck.method == "PUT":
-                            func = client.put
-                            data = self.servicehealthcheck.formdata
-                        elif self.servicehealthcheck.method == "DELETE":
-                            func = client.delete
-                        else:
-                            #Not support
-                            raise Exception("Http method({}) Not Support".format(self.method))
-                        if data:
-                            res = await func(self.servicehealthcheck.url,data=data)
-                        else:
-                            res = await func(self.servicehealthcheck.url)
+                    if self.servicehealthcheck.method in ("POST","PUT"):
+                        data = self.servicehealthcheck.formdata
+                    elif self.servicehealthcheck.method not in ("GET","DELETE"):
+                        #Not support
+                        raise Exception("Http method({}) Not Support".format(self.servicehealthcheck.method))
+                    #httpx timeout is applied to each phase, the whole request should also be finished in time
+                    async with asyncio.timeout(self.servicehealthcheck.request_timeout + settings.HEALTHCHECK_DEADLINE_GRACE):
+                        async with clientpool.client(self.servicehealthcheck) as pooledclient:
+                            if data:
+                                res = await pooledclient.client.request(self.servicehealthcheck.method,self.servicehealthcheck.url,data=data,extensions=pooledclient.extensions)
+                            else:
+                                res = await pooledclient.client.request(self.servicehealthcheck.method,self.servicehealthcheck.url,extensions=pooledclient.extensions)
                 finally:
                     endtime = utils.now()
-    
-                healthstatus = HealthCheck.check_response(self.servicehealthcheck,res)
+                #the response body is parsed only once, and shared by all the services checked by this request
+                res = CachedResponse.wrap(res)
             except httpx.TimeoutException as ex:
                 healthstatus = ["red","httpx.{} : {}".format(ex.__class__.__name__,str(ex)),None]
-                if not endtime:
-                    endtime = utils.now()
+            except TimeoutError as ex:
+                healthstatus = ["red","The request is not finished in {} seconds".format(self.servicehealthcheck.request_timeout + settings.HEALTHCHECK_DEADLINE_GRACE),None]
             except Exception as ex:
                 healthstatus = ["error","{} : {}".format(ex.__class__.__name__,str(ex)),None]
-                if not endtime:
-                    endtime = utils.now()
         else:
             healthstatus = ["green","OK",None]
             endtime = utils.now()
 
+        return (starttime,endtime,res,healthstatus)
+
+    async def process(self,starttime,endtime,res,healthstatus=None):
+        """
+        Check the response, save and publish the healthcheck status of the service
+        healthstatus: the healthstatus if the request is failed.
+        """
+        if healthstatus:
+            healthstatus = list(healthstatus)
+        else:
+            try:
+                healthstatus = HealthCheck.check_response(self.servicehealthcheck,res)
+            except Exception as ex:
+                healthstatus = ["error","{} : {}".format(ex.__class__.__name__,str(ex)),None]
+
         healthstatus.insert(0,starttime)
         healthstatus.insert(1,endtime)
         
-        healthstatus.append(healthstatus[2] in self.servicehealthcheck.healthdetailpersistent)
+        healthstatus.append(self.servicehealthcheck.is_healthdetailpersistent(healthstatus[2]))
         self.servicehealthcheck.healthstatus_healthdata = healthstatus
 
         try:
@@ -112,6 +136,41 @@ class BaseServiceHealthCheckTask(object):
         except Exception as ex:
             logger.error("Failed to call 'post_healthcheck'({2}) of service({0}.{1}). {3}: {4}".format(self.servicehealthcheck.sectionid,self.servicehealthcheck.serviceid,healthstatus,ex.__class__.__name__,str(ex)))
 
+    @property
+    def servicehealthchecks(self):
+        return [self.servicehealthcheck]
+
+    async def run(self):
+        await self.process(*(await self.fetch()))
+
+    async def skip(self,skiptime,reason):
+        """
+        Save a 'skipped' status with the reason in the history, the service is not checked.
+        The healthstatus of the service is still the status of the running check, so it is not changed and not published.
+        """
+        healthstatus = [skiptime,skiptime,"skipped",reason,None,self.servicehealthcheck.is_healthdetailpersistent("skipped")]
+        await self.servicehealthcheck.save_checkingstatus(healthstatus,None)
+
+class CoalescedHealthCheckTask(object):
+    """
+    Run the healthcheck tasks of the services with the same request signature by sending only one request.
+    The response is checked by each service and each service keeps its own healthcheck status
+    """
+    def __init__(self,tasks):
+        self.tasks = tasks
+
+    @property
+    def servicehealthcheck(self):
+        return self.tasks[0].servicehealthcheck
+
+    @property
+    def servicehealthchecks(self):
+        return [task.servicehealthcheck for task in self.tasks]
+
+    async def run(self):
+        starttime,endtime,res,healthstatus = await self.tasks[0].fetch()
+        for task in self.tasks:
+            await task.process(starttime,endtime,res,healthstatus)
 
 class SectionHealthCheck(UserDict):
 
@@ -155,11 +214,28 @@ class HealthCheckStatus(object):
 
         return checkstatus
 
+#the file extension and the module of the page compressions
+PAGE_COMPRESSIONS = {"gzip":(".gz",gzip),"lzma":(".xz",lzma)}
+
 class HealthCheckPage(object):
+    """
+    A page of the healthcheck status, one json status per line.
+    The page has a sidecar index file which contains an entry(offset,length,status) for each status in the page,
+    so the size of the page and the last status of each colour can be loaded without parsing the page
+    """
     _last_greenhealthcheck = None
     _last_yellowhealthcheck = None
     _last_redhealthcheck = None
     _last_errorhealthcheck = None
+    #the page has a sidecar index file
+    _indexed = True
+    #the entry of the index file: offset, length, status
+    INDEX_ENTRY = struct.Struct("<IIB")
+    STATUS_CODES = {"green":1,"yellow":2,"red":3}
+    #the key of the last status of each colour, the status code of the other statuses is 0(error)
+    LAST_KEYS = {1:"_last_greenhealthcheck",2:"_last_yellowhealthcheck",3:"_last_redhealthcheck",0:"_last_errorhealthcheck"}
+    #the size of the block read by 'reversed_pageitems'
+    READ_BLOCKSIZE = 8192
 
     def __init__(self,healthcheckpages,starttime,filepath):
         self._healthcheckpages = healthcheckpages
@@ -167,6 +243,10 @@ class HealthCheckPage(object):
         self._filepath = filepath
         self._size = None
         self._last_healthcheck = None
+        #the (offset,length) of the last status which is not read from the page yet, key: the attribute of the last status
+        self._unread = {}
+        #the index file is consistent with the page
+        self._index_uptodate = False
 
     def __str__(self):
         return "starttime={} , filepath={}".format(self.starttime,self.filepath)
@@ -183,37 +263,90 @@ class HealthCheckPage(object):
         return self._filepath
 
     @property
-    def last_healthcheck(self):
+    def indexfile(self):
+        return "{}.idx".format(self._filepath)
+
+    @staticmethod
+    def split_compression(filepath):
+        """
+        Return (the file path of the uncompressed page,the compression of the page file or None)
+        """
+        for compression,(ext,module) in PAGE_COMPRESSIONS.items():
+            if filepath.endswith(ext):
+                return (filepath[:-len(ext)],compression)
+        return (filepath,None)
+
+    @property
+    def compression(self):
+        """
+        The compression of the page file, None if the page is not compressed
+        """
+        return self.split_compression(self._filepath)[1]
+
+    def _open(self,mode='rb'):
+        """
+        Open the page file to read, the compressed page is decompressed transparently
+        """
+        compression = self.compression
+        if compression:
+            return PAGE_COMPRESSIONS[compression][1].open(self._filepath,"rt" if mode == "r" else mode)
+        else:
+            return open(self._filepath,mode)
+
+    def _read_data(self):
+        """
+        Return the uncompressed data of the page
+        """
+        with self._open() as f:
+            return f.read()
+
+    def _get_last(self,key):
         if self._size is None:
             self._load()
-        return self._last_healthcheck
+        if key in self._unread:
+            if self.compression:
+                #decompress the page only once, and read all the unread last statuses
+                data = self._read_data()
+                for k,(offset,length) in self._unread.items():
+                    setattr(self,k,HealthCheckStatus.deserialize(data[offset:offset + length].decode()))
+                self._unread.clear()
+            else:
+                offset,length = self._unread.pop(key)
+                with open(self._filepath,'rb') as f:
+                    f.seek(offset)
+                    data = f.read(length)
+                setattr(self,key,HealthCheckStatus.deserialize(data.decode()))
+        return getattr(self,key)
+
+    @property
+    def last_healthcheck(self):
+        return self._get_last("_last_healthcheck")
  
     @property
     def last_greenhealthcheck(self):
-        if self._size is None:
-            self._load()
-        return self._last_greenhealthcheck
+        return self._get_last("_last_greenhealthcheck")
 
     @property
     def last_yellowhealthcheck(self):
-        if self._size is None:
-            self._load()
-        return self._last_yellowhealthcheck
+        return self._get_last("_last_yellowhealthcheck")
 
     @property
     def last_redhealthcheck(self):
-        if self._size is None:
-            self._load()
-        return self._last_redhealthcheck
+        return self._get_last("_last_redhealthcheck")
 
     @property
     def last_errorhealthcheck(self):
-        if self._size is None:
-            self._load()
-        return self._last_errorhealthcheck
+        return self._get_last("_last_errorhealthcheck")
 
     def delete(self):
         utils.remove_file(self._filepath)
+        if self._indexed and os.path.exists(self.indexfile):
+            utils.remove_file(self.indexfile)
+        if self.compression:
+            #the uncompressed page file is kept for a while after compression
+            originalfile = self.split_compression(self._filepath)[0]
+            if os.path.exists(originalfile):
+                utils.remove_file(originalfile)
 
     def serialize(self):
         return json.dumps([self._starttime.strftime("%Y-%m-%dT%H:%M:%S.%f"),self._filepath[len(self._healthcheckpages.basedir) + 1:]])
@@ -224,10 +357,17 @@ class HealthCheckPage(object):
             pageindexdata = json.loads(data)
             pageindexdata[0] = utils.parse_datetime(pageindexdata[0])
             pageindexdata[1] = os.path.join(healthcheckpages.basedir,pageindexdata[1])
-            return cls(healthcheckpages,*pageindexdata)
+            return cls.get_pagecls(pageindexdata[1])(healthcheckpages,*pageindexdata)
         except Exception as ex:
             raise Exception("The page index data({}) is corrupted".format(data))
 
+    @staticmethod
+    def get_pagecls(filepath):
+        """
+        Return the page class of the page file
+        """
+        return BinaryHealthCheckPage if HealthCheckPage.split_compression(filepath)[0].endswith(BinaryHealthCheckPage.FILE_EXT) else HealthCheckPage
+
     @property
     def size(self):
         if self._size is None:
@@ -237,58 +377,178 @@ class HealthCheckPage(object):
     def detailfile(self,starttime):
         return self._healthcheckpages.detailfile(starttime)
 
-    def _load(self):
+    def _load_index(self):
+        """
+        Load the size and the offsets of the last statuses from the index file
+        Return True if the index file is consistent with the page; otherwise return False
+        """
+        if not settings.HEALTHSTATUS_PAGE_INDEX or not self._indexed:
+            return False
+        try:
+            with open(self.indexfile,'rb') as f:
+                data = f.read()
+        except FileNotFoundError as ex:
+            return False
+        entrysize = self.INDEX_ENTRY.size
+        if not data or len(data) % entrysize != 0:
+            return False
+        size = len(data) // entrysize
+        offset,length,status = self.INDEX_ENTRY.unpack_from(data,(size - 1) * entrysize)
+        if not self.compression and offset + length != os.path.getsize(self._filepath):
+            #the page was changed without updating the index file; a compressed page is never changed
+            return False
+        self._size = size
+        self._unread.clear()
+        self._unread["_last_healthcheck"] = (offset,length)
+        #find the last status of each colour from the end
+        for i in range(size - 1,-1,-1):
+            offset,length,status = self.INDEX_ENTRY.unpack_from(data,i * entrysize)
+            key = self.LAST_KEYS.get(status,"_last_errorhealthcheck")
+            if key not in self._unread:
+                self._unread[key] = (offset,length)
+                if len(self._unread) == len(self.LAST_KEYS) + 1:
+                    break
+        return True
+
+    def _scan(self):
+        """
+        Parse all the statuses in the page
+        Return the list of the index entries
+        """
+        entries = []
+        offset = 0
+        with self._open() as f:
+            for data in f:
+                healthcheckstatus = HealthCheckStatus.deserialize(data.decode())
+                self._set_last_healthcheck(healthcheckstatus)
+                entries.append((offset,len(data.rstrip(b"\n")),self.STATUS_CODES.get(healthcheckstatus[2],0)))
+                offset += len(data)
+        return entries
+
+    def _write_index(self,entries,writtenfiles=None):
+        """
+        Write the index file of the page
+        """
+        tmpfile = "{}.tmp".format(self.indexfile)
+        with open(tmpfile,'wb') as f:
+            for entry in entries:
+                f.write(self.INDEX_ENTRY.pack(*entry))
+        os.replace(tmpfile,self.indexfile)
+        if writtenfiles is not None:
+            writtenfiles.add(self.indexfile)
+        self._index_uptodate = True
+
+    def _load(self,indexing=False):
+        """
+        indexing: rebuild the index file if it is not consistent with the page
+        """
         if self._size is not None:
             return
 
         if not os.path.exists(self._filepath):
             self._size = 0
             self._last_healthcheck = None
+            self._index_uptodate = False
             folder = os.path.dirname(self._filepath)
             utils.makedir(folder)
         elif not os.path.isfile(self._filepath):
             raise Exception("The file path({}) is not a file".format(self._filepath))
+        elif self._load_index():
+            self._index_uptodate = True
         else:
-            size = 0
-            with open(self._filepath,'r') as f:
-                while True:
-                    data = f.readline()
-                    if data == "":
-                        break
-                    size += 1
-                    self._last_healthcheck = HealthCheckStatus.deserialize(data)
-                    if self._last_healthcheck[2] == "green":
-                        self._last_greenhealthcheck = self._last_healthcheck
-                    elif self._last_healthcheck[2] == "yellow":
-                        self._last_yellowhealthcheck = self._last_healthcheck
-                    elif self._last_healthcheck[2] == "red":
-                        self._last_redhealthcheck = self._last_healthcheck
-                    else:
-                        self._last_errorhealthcheck = self._last_healthcheck
-
-            self._size = size
+            entries = self._scan()
+            self._size = len(entries)
+            self._index_uptodate = False
+            if self._indexed and settings.HEALTHSTATUS_PAGE_INDEX and entries and (indexing or self._size >= settings.HEALTHSTATUS_PAGESIZE):
+                #a full page will never be changed, the index file can be created by any process
+                try:
+                    self._write_index(entries)
+                except Exception as ex:
+                    logger.error("Failed to create the index file of the page({}).{}: {}".format(self._filepath,ex.__class__.__name__,str(ex)))
         
+    def _set_last_healthcheck(self,healthcheckstatus):
+        self._last_healthcheck = healthcheckstatus
+        self._unread.pop("_last_healthcheck",None)
+        key = self.LAST_KEYS[self.STATUS_CODES.get(healthcheckstatus[2],0)]
+        setattr(self,key,healthcheckstatus)
+        self._unread.pop(key,None)
+
 
-    def save(self,healthcheckstatus):
+    def save(self,healthcheckstatus,writtenfiles=None):
         """
+        writtenfiles: a set to collect the written files if not None
         Return True if write; Return False if the page is already full and can't write anymore.
 
         """
         if self._size is None:
-            self._load()
-        if self._size >= settings.HEALTHSTATUS_PAGESIZE:
+            self._load(indexing=True)
+        if self._size >= settings.HEALTHSTATUS_PAGESIZE or self.compression:
             return False
-        data = HealthCheckStatus.serialize(healthcheckstatus)
+        data = HealthCheckStatus.serialize(healthcheckstatus).encode()
         with open(self._filepath,'ab') as f:
+            offset = f.tell()
             if self._size > 0:
                 f.write(b"\n")
-            f.write(data.encode())
+                offset += 1
+            f.write(data)
             self._size += 1
+        if writtenfiles is not None:
+            writtenfiles.add(self._filepath)
 
-        self._last_healthcheck = healthcheckstatus
+        self._set_last_healthcheck(healthcheckstatus)
+
+        if self._indexed and settings.HEALTHSTATUS_PAGE_INDEX:
+            try:
+                if self._index_uptodate or self._size == 1:
+                    with open(self.indexfile,'ab' if self._size > 1 else 'wb') as f:
+                        f.write(self.INDEX_ENTRY.pack(offset,len(data),self.STATUS_CODES.get(healthcheckstatus[2],0)))
+                    if writtenfiles is not None:
+                        writtenfiles.add(self.indexfile)
+                    self._index_uptodate = True
+                else:
+                    self._write_index(self._scan(),writtenfiles=writtenfiles)
+            except Exception as ex:
+                self._index_uptodate = False
+                logger.error("Failed to update the index file of the page({}).{}: {}".format(self._filepath,ex.__class__.__name__,str(ex)))
 
         return True
 
+    def compress(self,compression,writtenfiles=None):
+        """
+        Compress the closed page to a new page file, the index file is moved to the compressed page
+        The original page file is not removed
+        Return the compressed page
+        """
+        ext,module = PAGE_COMPRESSIONS[compression]
+        if self._size is None:
+            self._load(indexing=True)
+        if self._indexed and settings.HEALTHSTATUS_PAGE_INDEX and not self._index_uptodate and self._size:
+            self._write_index(self._scan())
+        page = self.__class__(self._healthcheckpages,self._starttime,"{}{}".format(self._filepath,ext))
+        tmpfile = "{}.tmp".format(page.filepath)
+        with open(self._filepath,'rb') as fin:
+            with module.open(tmpfile,'wb') as fout:
+                shutil.copyfileobj(fin,fout)
+        os.replace(tmpfile,page.filepath)
+        if writtenfiles is not None:
+            writtenfiles.add(page.filepath)
+        if os.path.exists(self.indexfile):
+            os.replace(self.indexfile,page.indexfile)
+            if writtenfiles is not None:
+                writtenfiles.add(page.indexfile)
+        return page
+
+    def write_items(self,items,capacity=None):
+        """
+        Write the statuses to a new page, used to migrate the pages
+        capacity: the max number of the statuses in the page; ignored by the json page
+        """
+        with open(self._filepath,'w') as f:
+            f.write("\n".join(HealthCheckStatus.serialize(item) for item in items))
+        self._size = None
+        self._unread.clear()
+        self._load(indexing=True)
+
     def pageitems(self):
         """
         used by history page 
@@ -300,7 +560,7 @@ class HealthCheckPage(object):
             self._load()
         if self._size  == 0:
             return
-        with open(self._filepath,'r') as f:
+        with self._open('r') as f:
             while True:
                 data = f.readline()
                 if data == "":
@@ -312,11 +572,378 @@ class HealthCheckPage(object):
                         logger.error("The data({0}) in file({0}) is corrupted.".format(self._filepath,data))
                         continue
 
-    def reversed_pageitems(self):
-        data = [d for d in self.pageitems()]
-        return reversed(data)
+    def reversed_pageitems(self,limit=None):
+        """
+        used by history page 
+        Ignore the corrupted data
+        limit: the maximum number of the returned items if not None
+        Return a generator for healthcheck items in this page from the latest to the earliest,
+        the page is read backwards in blocks from the end of the file, and only the returned items are parsed
+
+        """
+        if self._size is None:
+            self._load()
+        if self._size  == 0:
+            return
+        if limit is not None and limit <= 0:
+            return
+        count = 0
+        for data in self._reversed_lines():
+            if not data:
+                continue
+            try:
+                yield HealthCheckStatus.deserialize(data.decode())
+            except Exception as ex:
+                logger.error("The data({1}) in file({0}) is corrupted.".format(self._filepath,data))
+                continue
+            count += 1
+            if limit and count >= limit:
+                return
+
+    def _reversed_lines(self):
+        """
+        Return a generator for the lines in this page from the last to the first, the page is read backwards in blocks from the end of the file
+        The compressed page is decompressed in memory
+        """
+        if self.compression:
+            lines = self._read_data().split(b"\n")
+            for i in range(len(lines) - 1,-1,-1):
+                yield lines[i]
+            return
+        with open(self._filepath,'rb') as f:
+            position = f.seek(0,os.SEEK_END)
+            remaining = b""
+            while position > 0:
+                blocksize = min(self.READ_BLOCKSIZE,position)
+                position -= blocksize
+                f.seek(position)
+                lines = (f.read(blocksize) + remaining).split(b"\n")
+                #the first line may be incomplete if the beginning of the file is not reached
+                remaining = lines[0]
+                for i in range(len(lines) - 1,0,-1):
+                    yield lines[i]
+            yield remaining
+
+class BinaryHealthCheckPage(HealthCheckPage):
+    """
+    A page of the healthcheck status in a compact binary format, the page is memory-mapped and the statuses are read without parsing json and datetime strings.
+    The page contains a file header(magic,version,capacity,size), the fixed-width headers of the statuses and a string section.
+    The header of a status contains the check start and check end in epoch microseconds, the status code, the flags, and the offset and length of the message and the extra data in the string section.
+    The extra data is a json list [status,prtgdata] and only saved if the status is unknown or the prtgdata is not None;
+    a message which is not a string is saved in the extra data as [status,prtgdata,message] to keep its type, the same as the json page.
+    The size in the file header is updated after the status is written, so the page can be read while it is written by the healthcheck server.
+    """
+    #the size and the status code of the statuses are read from the page, no sidecar index file
+    _indexed = False
+    FILE_EXT = ".bin"
+    MAGIC = b"HCBP"
+    VERSION = 1
+    #magic,version,capacity,size
+    FILE_HEADER = struct.Struct("<4sB3xII")
+    SIZE = struct.Struct("<I")
+    #check start,check end,status code,flags,offset,message length,extra length
+    STATUS_HEADER = struct.Struct("<qqBB2xIII")
+    STATUS_CODES = {"green":1,"yellow":2,"red":3,"error":4}
+    STATUSES = {1:"green",2:"yellow",3:"red",4:"error"}
+    LAST_KEYS = {1:"_last_greenhealthcheck",2:"_last_yellowhealthcheck",3:"_last_redhealthcheck",4:"_last_errorhealthcheck",0:"_last_errorhealthcheck"}
+    #flags
+    PERSISTENT = 1
+    NO_MESSAGE = 2
+
+    def __init__(self,healthcheckpages,starttime,filepath):
+        super().__init__(healthcheckpages,starttime,filepath)
+        self._capacity = None
+
+    def _open_data(self):
+        """
+        Return the memory-mapped page, or the uncompressed data of the compressed page, as a context manager
+        """
+        if self.compression:
+            return contextlib.nullcontext(self._read_data())
+        with open(self._filepath,'rb') as f:
+            return mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+
+    def _read_fileheader(self,data):
+        """
+        Return (capacity,size)
+        """
+        if len(data) < self.FILE_HEADER.size:
+            raise Exception("The binary page({}) is corrupted".format(self._filepath))
+        magic,version,capacity,size = self.FILE_HEADER.unpack_from(data,0)
+        if magic != self.MAGIC or version != self.VERSION or size > capacity:
+            raise Exception("The binary page({}) is corrupted or the version({}) is not supported".format(self._filepath,version))
+        return (capacity,size)
+
+    def _read_status(self,data,index):
+        checkstart,checkend,code,flags,offset,msglength,extralength = self.STATUS_HEADER.unpack_from(data,self.FILE_HEADER.size + index * self.STATUS_HEADER.size)
+        if offset + msglength + extralength > len(data):
+            raise Exception("The status({1}) in the binary page({0}) is corrupted".format(self._filepath,index))
+        extra = json.loads(data[offset + msglength:offset + msglength + extralength]) if extralength else None
+        if flags & self.NO_MESSAGE:
+            message = None
+        elif extra and len(extra) > 2:
+            message = extra[2]
+        else:
+            message = data[offset:offset + msglength].decode()
+        return [
+            utils.from_epoch_microseconds(checkstart),
+            utils.from_epoch_microseconds(checkend),
+            self.STATUSES.get(code) or (extra[0] if extra else None),
+            message,
+            extra[1] if extra else None,
+            True if flags & self.PERSISTENT else False
+        ]
+
+    def _get_last(self,key):
+        if self._size is None:
+            self._load()
+        if key in self._unread:
+            if self.compression:
+                #decompress the page only once, and read all the unread last statuses
+                with self._open_data() as data:
+                    for k,index in self._unread.items():
+                        setattr(self,k,self._read_status(data,index))
+                self._unread.clear()
+            else:
+                index = self._unread.pop(key)
+                with self._open_data() as data:
+                    setattr(self,key,self._read_status(data,index))
+        return getattr(self,key)
+
+    def _load(self,indexing=False):
+        """
+        Load the size and the indexes of the last statuses from the page
+        """
+        if self._size is not None:
+            return
+
+        if not os.path.exists(self._filepath):
+            self._size = 0
+            self._capacity = None
+            self._last_healthcheck = None
+            folder = os.path.dirname(self._filepath)
+            utils.makedir(folder)
+        elif not os.path.isfile(self._filepath):
+            raise Exception("The file path({}) is not a file".format(self._filepath))
+        else:
+            with self._open() as f:
+                capacity,size = self._read_fileheader(f.read(self.FILE_HEADER.size))
+                headers = f.read(size * self.STATUS_HEADER.size)
+            self._capacity = capacity
+            self._size = size
+            self._unread.clear()
+            if size:
+                self._unread["_last_healthcheck"] = size - 1
+            #find the last status of each colour from the end, the status code is the 17th byte of the status header
+            keys = len(set(self.LAST_KEYS.values())) + 1
+            for i in range(size - 1,-1,-1):
+                key = self.LAST_KEYS.get(headers[i * self.STATUS_HEADER.size + 16],"_last_errorhealthcheck")
+                if key not in self._unread:
+                    self._unread[key] = i
+                    if len(self._unread) == keys:
+                        break
+
+    def _create(self,capacity):
+        """
+        Create the page file with the space for the headers of 'capacity' statuses
+        """
+        with open(self._filepath,'wb') as f:
+            f.write(self.FILE_HEADER.pack(self.MAGIC,self.VERSION,capacity,0))
+            f.truncate(self.FILE_HEADER.size + capacity * self.STATUS_HEADER.size)
+        self._capacity = capacity
+        self._size = 0
+
+    def save(self,healthcheckstatus,writtenfiles=None):
+        """
+        writtenfiles: a set to collect the written files if not None
+        Return True if write; Return False if the page is already full and can't write anymore.
+
+        """
+        if self._size is None:
+            self._load()
+        if self._capacity is None:
+            self._create(settings.HEALTHSTATUS_PAGESIZE)
+        if self._size >= self._capacity or self.compression:
+            return False
+        code = self.STATUS_CODES.get(healthcheckstatus[2],0)
+        if healthcheckstatus[3] is None or isinstance(healthcheckstatus[3],str):
+            message = b"" if healthcheckstatus[3] is None else healthcheckstatus[3].encode()
+            if code == 0 or healthcheckstatus[4] is not None:
+                extra = HealthCheckStatus.serialize([None if code else healthcheckstatus[2],healthcheckstatus[4]]).encode()
+            else:
+                extra = b""
+        else:
+            #keep the type of the message in the extra data
+            message = b""
+            extra = HealthCheckStatus.serialize([None if code else healthcheckstatus[2],healthcheckstatus[4],healthcheckstatus[3]]).encode()
+        flags = (self.PERSISTENT if healthcheckstatus[5] else 0) | (self.NO_MESSAGE if healthcheckstatus[3] is None else 0)
+        with open(self._filepath,'r+b') as f:
+            #write the strings, the header and then the size
+            offset = f.seek(0,os.SEEK_END)
+            f.write(message)
+            f.write(extra)
+            f.seek(self.FILE_HEADER.size + self._size * self.STATUS_HEADER.size)
+            f.write(self.STATUS_HEADER.pack(
+                utils.to_epoch_microseconds(healthcheckstatus[0]),
+                utils.to_epoch_microseconds(healthcheckstatus[1]),
+                code,
+                flags,
+                offset,
+                len(message),
+                len(extra)
+            ))
+            f.seek(self.FILE_HEADER.size - self.SIZE.size)
+            f.write(self.SIZE.pack(self._size + 1))
+        self._size += 1
+        if writtenfiles is not None:
+            writtenfiles.add(self._filepath)
+
+        self._set_last_healthcheck(healthcheckstatus)
+
+        return True
+
+    def write_items(self,items,capacity=None):
+        """
+        Write the statuses to a new page, used to migrate the pages
+        capacity: the max number of the statuses in the page; the number of the statuses if None
+        """
+        items = list(items)
+        self._unread.clear()
+        self._create(max(len(items),capacity or 0))
+        for item in items:
+            self.save(item)
+
+    def _refresh(self):
+        """
+        Reload the page if the statuses were appended by the healthcheck server after the page was loaded
+        A full page or a compressed page is never changed
+        """
+        if self._size is None:
+            self._load()
+            return
+        if self.compression or (self._capacity is not None and self._size >= self._capacity):
+            return
+        try:
+            with open(self._filepath,'rb') as f:
+                capacity,size = self._read_fileheader(f.read(self.FILE_HEADER.size))
+        except FileNotFoundError as ex:
+            return
+        if size != self._size:
+            self._size = None
+            self._load()
+
+    def _items(self,indexes):
+        if self._size == 0:
+            return
+        with self._open_data() as data:
+            for i in indexes:
+                try:
+                    yield self._read_status(data,i)
+                except Exception as ex:
+                    logger.error("The status({1}) in file({0}) is corrupted.".format(self._filepath,i))
+                    continue
+
+    def pageitems(self):
+        """
+        used by history page 
+        Ignore the corrupted data
+        Return a generator for healthcheck items in this page
+
+        """
+        self._refresh()
+        return self._items(range(self._size))
+
+    def reversed_pageitems(self,limit=None):
+        """
+        used by history page 
+        Ignore the corrupted data
+        limit: the maximum number of the returned items if not None
+        Return a generator for healthcheck items in this page from the latest to the earliest
+
+        """
+        self._refresh()
+        if limit is not None and limit <= 0:
+            return self._items([])
+        return self._items(range(self._size - 1,max(self._size - limit,0) - 1 if limit else -1,-1))
+
+class SqliteHealthCheckPage(HealthCheckPage):
+    """
+    A page of the healthcheck status saved in the sqlite history storage, the statuses of the page are the rows with the page id
+    """
+    _indexed = False
+    #the status filter of the last statuses, 'error' means the status is not green, yellow or red
+    LAST_STATUSES = {"_last_healthcheck":None,"_last_greenhealthcheck":"green","_last_yellowhealthcheck":"yellow","_last_redhealthcheck":"red","_last_errorhealthcheck":"error"}
+
+    def __init__(self,healthcheckpages,starttime,filepath,id):
+        super().__init__(healthcheckpages,starttime,filepath)
+        self._id = id
+
+    @property
+    def storage(self):
+        return self._healthcheckpages.storage
+
+    def delete(self):
+        self.storage.remove_pages(self._healthcheckpages,[self])
+
+    def serialize(self):
+        raise Exception("Not Support")
+
+    def _get_last(self,key):
+        if self._size is None:
+            self._load()
+        if key in self._unread:
+            self._unread.pop(key)
+            setattr(self,key,self.storage.get_last_status(self._id,self.LAST_STATUSES[key]))
+        return getattr(self,key)
+
+    def _load(self,indexing=False):
+        if self._size is not None:
+            return
+        self._size = self.storage.get_size(self._id)
+        self._unread.clear()
+        if self._size:
+            for key in self.LAST_STATUSES.keys():
+                self._unread[key] = None
+
+    def save(self,healthcheckstatus,writtenfiles=None):
+        """
+        writtenfiles: not used, the database is synced by sqlite
+        Return True if write; Return False if the page is already full and can't write anymore.
+
+        """
+        if self._size is None:
+            self._load()
+        if self._size >= settings.HEALTHSTATUS_PAGESIZE:
+            return False
+        self.storage.insert(self._healthcheckpages,self._id,healthcheckstatus)
+        self._size += 1
+
+        self._set_last_healthcheck(healthcheckstatus)
+
+        return True
+
+    def pageitems(self):
+        """
+        used by history page 
+        Return a generator for healthcheck items in this page
+
+        """
+        return iter(self.storage.get_statuses(self._id))
+
+    def reversed_pageitems(self,limit=None):
+        """
+        used by history page 
+        limit: the maximum number of the returned items if not None
+        Return a generator for healthcheck items in this page from the latest to the earliest
+
+        """
+        if limit is not None and limit <= 0:
+            return iter([])
+        return iter(self.storage.get_statuses(self._id,reverse=True,limit=limit))
 
 class LastHealthCheck(HealthCheckPage):
+    #the file is overwritten by each status
+    _indexed = False
     def __init__(self,healthcheckpages,path):
         super().__init__(healthcheckpages,None,path)
 
@@ -327,8 +954,9 @@ class LastHealthCheck(HealthCheckPage):
     def deserialize(cls,data):
         raise Exception("Not Support")
 
-    def save(self,healthcheckstatus):
+    def save(self,healthcheckstatus,writtenfiles=None):
         """
+        writtenfiles: a set to collect the written files if not None
         Return True if write; Return False if the page is already full and can't write anymore.
 
         """
@@ -338,8 +966,10 @@ class LastHealthCheck(HealthCheckPage):
         with open(self._filepath,'wb') as f:
             f.write(data.encode())
         self._size += 1
+        if writtenfiles is not None:
+            writtenfiles.add(self._filepath)
 
-        self._last_healthcheck = healthcheckstatus
+        self._set_last_healthcheck(healthcheckstatus)
 
         return True
 
@@ -348,7 +978,7 @@ class LastHealthCheckInMemory(LastHealthCheck):
     def detailfile(self,starttime):
         return ""
 
-    def save(self,healthcheckstatus):
+    def save(self,healthcheckstatus,writtenfiles=None):
         """
         The data is in memeory, no need to save
         Return True if write; Return False if the page is already full and can't write anymore.
@@ -367,6 +997,451 @@ class LastHealthCheckInMemory(LastHealthCheck):
         """
         self._size = 0
 
+class HistoryStorage(abc.ABC):
+    """
+    The storage of the history pages of the services in a config file
+    """
+    #the last statuses of the services in the storage can be saved in the checkpoint
+    checkpointed = True
+
+    @staticmethod
+    def get_instance(configfile):
+        """
+        Return the configured history storage of the config file
+        """
+        if settings.HEALTHSTATUS_STORAGE == "sqlite":
+            return SqliteHistoryStorage.get_instance(configfile)
+        else:
+            return FileHistoryStorage.get_instance(configfile)
+
+    @abc.abstractmethod
+    def load_pages(self,healthcheckpages):
+        """
+        Return the pages of the service from the earliest to the latest
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_version(self,healthcheckpages):
+        """
+        Return the version of the pages, the pages should be reloaded if the version is changed
+        """
+        pass
+
+    @abc.abstractmethod
+    def create_page(self,healthcheckpages,starttime,writtenfiles=None):
+        """
+        Create a new page and add it to the storage, the page is not added to the pages of the service
+        Return the new page
+        """
+        pass
+
+    @abc.abstractmethod
+    def remove_pages(self,healthcheckpages,pages,writtenfiles=None):
+        """
+        Remove the pages from the storage, the pages are already removed from the pages of the service
+        """
+        pass
+
+    def compress_pages(self,healthcheckpages,writtenfiles=None):
+        """
+        Compress the closed pages if supported and enabled
+        Return the number of the compressed pages
+        """
+        return 0
+
+    def queue_compression(self,healthcheckpages):
+        """
+        Queue the compression of the closed pages, the queued compressions are run by the healthstatus writer after the current batch is saved
+        """
+        pass
+
+    @property
+    def queued_compressions(self):
+        """
+        The number of the services whose compression is queued
+        """
+        return 0
+
+    def compress_queued_pages(self,writtenfiles=None):
+        """
+        Compress the closed pages of the queued services
+        Return the number of the compressed pages
+        """
+        return 0
+
+    def remove_obsolete_files(self,healthcheckpages):
+        """
+        Remove the obsolete files of the pages, called by the page management
+        """
+        pass
+
+    def begin_batch(self):
+        """
+        The statuses saved before 'commit' are saved in one batch
+        """
+        pass
+
+    def commit(self):
+        """
+        Commit the statuses saved in the batch, the statuses are rolled back if failed
+        """
+        pass
+
+class FileHistoryStorage(HistoryStorage):
+    """
+    The histories are saved in a page index file and the page files per service
+    """
+    _instance = None
+
+    def __init__(self):
+        #the pages whose closed pages should be compressed
+        self._compressions = set()
+
+    def __str__(self):
+        return "File History Storage"
+
+    @classmethod
+    def get_instance(cls,configfile):
+        if not cls._instance:
+            cls._instance = cls()
+        return cls._instance
+
+    def load_pages(self,healthcheckpages):
+        pages = []
+        pageindexfile = healthcheckpages.pageindexfile
+        if not os.path.exists(pageindexfile):
+            folder = os.path.dirname(pageindexfile)
+            utils.makedir(folder)
+        elif not os.path.isfile(pageindexfile):
+            raise Exception("The file path({}) is not a file".format(pageindexfile))
+        else:
+            with open(pageindexfile,'r') as f:
+                while True:
+                    data = f.readline()
+                    if data == "":
+                        break
+                    data = data.strip()
+                    if not data:
+                        continue
+                    try:
+                        pages.append(HealthCheckPage.deserialize(healthcheckpages,data))
+                    except Exception as ex:
+                        logger.error("The page data({1}) in file({0}) is corrupted".format(pageindexfile,data))
+        return pages
+
+    def get_version(self,healthcheckpages):
+        if os.path.exists(healthcheckpages.pageindexfile):
+            return os.path.getsize(healthcheckpages.pageindexfile)
+        else:
+            return 0
+
+    def create_page(self,healthcheckpages,starttime,writtenfiles=None):
+        pagefile = healthcheckpages.pagefile(starttime)
+        newpage = HealthCheckPage.get_pagecls(pagefile)(healthcheckpages,starttime,pagefile)
+
+        with open(healthcheckpages.pageindexfile,'ab') as f:
+            if healthcheckpages._pages:
+                f.write(b"\n")
+            f.write(newpage.serialize().encode())
+        if writtenfiles is not None:
+            writtenfiles.add(healthcheckpages.pageindexfile)
+        return newpage
+
+    def remove_pages(self,healthcheckpages,pages,writtenfiles=None):
+        for page in pages:
+            page.delete()
+        self._save_pageindex(healthcheckpages,writtenfiles=writtenfiles)
+
+    def _save_pageindex(self,healthcheckpages,writtenfiles=None):
+        """
+        Save the pages of the service to the page index file
+        """
+        tmpfile = "{}.tmp".format(healthcheckpages.pageindexfile)
+        with open(tmpfile,'wb') as f:
+            for i in range(len(healthcheckpages._pages)):
+                if i > 0:
+                    f.write(b"\n")
+                f.write(healthcheckpages._pages[i].serialize().encode())
+        os.replace(tmpfile,healthcheckpages.pageindexfile)
+        if writtenfiles is not None:
+            writtenfiles.add(healthcheckpages.pageindexfile)
+
+    def compress_pages(self,healthcheckpages,writtenfiles=None):
+        """
+        Compress the closed pages(all the pages except the last page) which are not compressed, and update the page index file to the compressed page files.
+        The original page files are kept until the next page management, because they can still be read by the web app workers which loaded the pages before
+        """
+        if settings.HEALTHSTATUS_PAGE_COMPRESSION == "none" or not healthcheckpages._pages:
+            return 0
+        compressed = 0
+        for i in range(len(healthcheckpages._pages) - 1):
+            page = healthcheckpages._pages[i]
+            if page.compression:
+                continue
+            try:
+                healthcheckpages._pages[i] = page.compress(settings.HEALTHSTATUS_PAGE_COMPRESSION,writtenfiles=writtenfiles)
+                compressed += 1
+            except Exception as ex:
+                logger.error("Failed to compress the page({}).{}: {}".format(page.filepath,ex.__class__.__name__,str(ex)))
+        if compressed:
+            self._save_pageindex(healthcheckpages,writtenfiles=writtenfiles)
+        return compressed
+
+    def queue_compression(self,healthcheckpages):
+        if settings.HEALTHSTATUS_PAGE_COMPRESSION != "none":
+            self._compressions.add(healthcheckpages)
+
+    @property
+    def queued_compressions(self):
+        return len(self._compressions)
+
+    def compress_queued_pages(self,writtenfiles=None):
+        compressed = 0
+        while self._compressions:
+            healthcheckpages = self._compressions.pop()
+            try:
+                compressed += healthcheckpages.compress_pages(writtenfiles=writtenfiles)
+            except Exception as ex:
+                logger.error("Failed to compress the pages of the service({}).{}: {}".format(healthcheckpages.servicehealthcheck,ex.__class__.__name__,str(ex)))
+        return compressed
+
+    def remove_obsolete_files(self,healthcheckpages):
+        """
+        Remove the original files of the pages which were compressed more than one day ago, 
+        the web app workers have reloaded the pages since then.
+        """
+        expiretime = time.time() - 86400
+        for page in healthcheckpages._pages:
+            if not page.compression:
+                continue
+            originalfile = page.split_compression(page.filepath)[0]
+            try:
+                if os.path.exists(originalfile) and os.path.getmtime(page.filepath) < expiretime:
+                    utils.remove_file(originalfile)
+            except Exception as ex:
+                logger.error("Failed to remove the original file of the compressed page({}).{}: {}".format(page.filepath,ex.__class__.__name__,str(ex)))
+
+class SqliteHistoryStorage(HistoryStorage):
+    """
+    The histories of all the services in a config file are saved in one sqlite database in WAL mode,
+    the statuses are indexed by (section,service,starttime) and (status,starttime) to query the statuses across the services and the pages.
+    The datetimes are saved in epoch microseconds.
+    The statuses saved by the healthstatus writer are committed in batches.
+    The connection is shared by the threads of the process and protected by a lock.
+    """
+    _instances = {}
+    #the last statuses are read from the indexed database, no need to save them in the checkpoint
+    checkpointed = False
+    SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    section TEXT NOT NULL,
+    service TEXT NOT NULL,
+    history TEXT NOT NULL,
+    starttime INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_service ON pages (section,service,history,starttime);
+CREATE TABLE IF NOT EXISTS healthstatus (
+    id INTEGER PRIMARY KEY,
+    pageid INTEGER NOT NULL,
+    section TEXT NOT NULL,
+    service TEXT NOT NULL,
+    history TEXT NOT NULL,
+    starttime INTEGER NOT NULL,
+    endtime INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    message TEXT,
+    prtgdata TEXT,
+    persistent INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS healthstatus_page ON healthstatus (pageid);
+CREATE INDEX IF NOT EXISTS healthstatus_service ON healthstatus (section,service,starttime);
+CREATE INDEX IF NOT EXISTS healthstatus_status ON healthstatus (status,starttime);
+"""
+    STATUS_COLUMNS = "starttime,endtime,status,message,prtgdata,persistent"
+
+    def __init__(self,configfile):
+        folder = os.path.join(settings.HEALTHCHECK_DATA_DIR,os.path.splitext(os.path.basename(configfile))[0])
+        utils.makedir(folder)
+        self._file = os.path.join(folder,"healthstatus.db")
+        self._lock = threading.RLock()
+        self._conn = None
+        self._batching = False
+
+    def __str__(self):
+        return "Sqlite History Storage({})".format(self._file)
+
+    @classmethod
+    def get_instance(cls,configfile):
+        obj = cls._instances.get(configfile)
+        if not obj:
+            obj = cls(configfile)
+            cls._instances[configfile] = obj
+        return obj
+
+    @property
+    def file(self):
+        return self._file
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self._file,timeout=settings.BLOCK_TIMEOUT,check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous={}".format("NORMAL" if settings.HEALTHSTATUS_WRITER_DURABILITY == "none" else "FULL"))
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _query(self,sql,params=()):
+        with self._lock:
+            return self.conn.execute(sql,params).fetchall()
+
+    def _update(self,sql,params=()):
+        """
+        Execute the update statement, commit it if not in a batch
+        Return the cursor
+        """
+        with self._lock:
+            cursor = self.conn.execute(sql,params)
+            if not self._batching:
+                self._commit()
+            return cursor
+
+    @staticmethod
+    def _get_key(healthcheckpages):
+        return (healthcheckpages.servicehealthcheck.sectionid,healthcheckpages.servicehealthcheck.serviceid,healthcheckpages._historytype)
+
+    @staticmethod
+    def _to_status(row):
+        return [
+            utils.from_epoch_microseconds(row[0]),
+            utils.from_epoch_microseconds(row[1]),
+            row[2],
+            row[3],
+            json.loads(row[4]) if row[4] else None,
+            True if row[5] else False
+        ]
+
+    def load_pages(self,healthcheckpages):
+        return [SqliteHealthCheckPage(healthcheckpages,utils.from_epoch_microseconds(starttime),self._file,id) for id,starttime in self._query(
+            "SELECT id,starttime FROM pages WHERE section=? AND service=? AND history=? ORDER BY starttime",
+            self._get_key(healthcheckpages)
+        )]
+
+    def get_version(self,healthcheckpages):
+        return tuple(self._query(
+            "SELECT count(*),max(id) FROM pages WHERE section=? AND service=? AND history=?",
+            self._get_key(healthcheckpages)
+        )[0])
+
+    def create_page(self,healthcheckpages,starttime,writtenfiles=None):
+        cursor = self._update(
+            "INSERT INTO pages (section,service,history,starttime) VALUES (?,?,?,?)",
+            (*self._get_key(healthcheckpages),utils.to_epoch_microseconds(starttime))
+        )
+        return SqliteHealthCheckPage(healthcheckpages,starttime,self._file,cursor.lastrowid)
+
+    def remove_pages(self,healthcheckpages,pages,writtenfiles=None):
+        if not pages:
+            return
+        ids = [page._id for page in pages]
+        params = ",".join("?" for id in ids)
+        with self._lock:
+            self.conn.execute("DELETE FROM healthstatus WHERE pageid IN ({})".format(params),ids)
+            self._update("DELETE FROM pages WHERE id IN ({})".format(params),ids)
+
+    def insert(self,healthcheckpages,pageid,healthcheckstatus):
+        self._update(
+            "INSERT INTO healthstatus (pageid,section,service,history,{}) VALUES (?,?,?,?,?,?,?,?,?,?)".format(self.STATUS_COLUMNS),
+            (
+                pageid,
+                *self._get_key(healthcheckpages),
+                utils.to_epoch_microseconds(healthcheckstatus[0]),
+                utils.to_epoch_microseconds(healthcheckstatus[1]),
+                healthcheckstatus[2],
+                healthcheckstatus[3],
+                None if healthcheckstatus[4] is None else HealthCheckStatus.serialize(healthcheckstatus[4]),
+                1 if healthcheckstatus[5] else 0
+            )
+        )
+
+    def get_size(self,pageid):
+        return self._query("SELECT count(*) FROM healthstatus WHERE pageid=?",(pageid,))[0][0]
+
+    def get_last_status(self,pageid,status=None):
+        """
+        status: the status of the last status; 'error' means any status except green, yellow and red; None means any status
+        """
+        if status is None:
+            rows = self._query("SELECT {} FROM healthstatus WHERE pageid=? ORDER BY id DESC LIMIT 1".format(self.STATUS_COLUMNS),(pageid,))
+        elif status == "error":
+            rows = self._query("SELECT {} FROM healthstatus WHERE pageid=? AND status NOT IN ('green','yellow','red') ORDER BY id DESC LIMIT 1".format(self.STATUS_COLUMNS),(pageid,))
+        else:
+            rows = self._query("SELECT {} FROM healthstatus WHERE pageid=? AND status=? ORDER BY id DESC LIMIT 1".format(self.STATUS_COLUMNS),(pageid,status))
+        return self._to_status(rows[0]) if rows else None
+
+    def get_statuses(self,pageid,reverse=False,limit=None):
+        """
+        Return the statuses of the page
+        """
+        return [self._to_status(row) for row in self._query(
+            "SELECT {} FROM healthstatus WHERE pageid=? ORDER BY id {} LIMIT ?".format(self.STATUS_COLUMNS,"DESC" if reverse else "ASC"),
+            (pageid,limit if limit else -1)
+        )]
+
+    def query(self,section=None,service=None,status=None,starttime=None,endtime=None,history="history",limit=None):
+        """
+        Query the statuses of the services across the pages, for example: all the red statuses of a section in the last 7 days
+        starttime,endtime: the range of the check start time, endtime is exclusive
+        Return the list of [section,service,status] ordered by the check start time
+        """
+        conditions = ["history=?"]
+        params = [history]
+        for column,value in (("section",section),("service",service),("status",status)):
+            if value is not None:
+                conditions.append("{}=?".format(column))
+                params.append(value)
+        if starttime:
+            conditions.append("starttime>=?")
+            params.append(utils.to_epoch_microseconds(starttime))
+        if endtime:
+            conditions.append("starttime<?")
+            params.append(utils.to_epoch_microseconds(endtime))
+        params.append(limit if limit else -1)
+        return [[row[0],row[1],self._to_status(row[2:])] for row in self._query(
+            "SELECT section,service,{} FROM healthstatus WHERE {} ORDER BY starttime LIMIT ?".format(self.STATUS_COLUMNS," AND ".join(conditions)),
+            params
+        )]
+
+    def begin_batch(self):
+        with self._lock:
+            self._batching = True
+
+    def _commit(self):
+        """
+        Commit the transaction, rollback it if failed and raise the exception
+        """
+        try:
+            self._conn.commit()
+        except:
+            try:
+                self._conn.rollback()
+            except Exception as ex:
+                logger.error("Failed to rollback the transaction of {}.{}: {}".format(self,ex.__class__.__name__,str(ex)))
+            raise
+
+    def commit(self):
+        """
+        Commit the statuses saved in the batch, the statuses are rolled back if failed, 
+        the caller should reset the pages of the services in the batch.
+        """
+        with self._lock:
+            self._batching = False
+            if self._conn is not None and self._conn.in_transaction:
+                self._commit()
+
 class BasicHealthCheckPages(object):
     """
     pages: a list of page data([startdatetime,page file])
@@ -375,10 +1450,16 @@ class BasicHealthCheckPages(object):
     _pageindexfilename = None
     _pagefilename = None
     _pagefolder = None
+    #the history type of the pages in the history storage
+    _historytype = None
     def __init__(self,servicehealthcheck):
         self._servicehealthcheck = servicehealthcheck
         self._pages = None #from earlist to latest
-        self._filesize = None
+        #the pages are saved by the healthstatus writer thread and lazily loaded or reset by the event loop
+        self._pageslock = threading.RLock()
+        #the version of the loaded pages in the history storage
+        self._version = None
+        self._storage = None
         self.next_management_time = None
         self._historyexpire = 0
         self.historyenabled = False
@@ -412,10 +1493,17 @@ class BasicHealthCheckPages(object):
     @servicehealthcheck.setter
     def servicehealthcheck(self,servicehealthcheck):
         if self.historyenabled != servicehealthcheck.historyenabled:
-            self._pages = None
+            with self._pageslock:
+                self._pages = None
         self._servicehealthcheck = servicehealthcheck
         self.historyenabled = self._servicehealthcheck.historyenabled
 
+    @property
+    def storage(self):
+        if self._storage is None:
+            self._storage = HistoryStorage.get_instance(self._servicehealthcheck.healthcheck.configfile)
+        return self._storage
+
     _basedir = None
     @property
     def basedir(self):
@@ -440,8 +1528,14 @@ class BasicHealthCheckPages(object):
     def pagedir(self,starttime):
         return os.path.join(self.basedir,self._pagefolder)
 
-    def pagefile(self,starttime):
-        return os.path.join(self.pagedir(starttime),self._pagefilename.format(starttime.strftime("%Y%m%dT%H%M%S")))
+    def pagefile(self,starttime,pageformat=None):
+        """
+        pageformat: the format of the page, 'json' or 'binary'; use the configured page format if None
+        """
+        pagefile = os.path.join(self.pagedir(starttime),self._pagefilename.format(starttime.strftime("%Y%m%dT%H%M%S")))
+        if (pageformat or settings.HEALTHSTATUS_PAGE_FORMAT) == "binary":
+            pagefile = "{}{}".format(os.path.splitext(pagefile)[0],BinaryHealthCheckPage.FILE_EXT)
+        return pagefile
 
     @property
     def detailsdir(self):
@@ -458,134 +1552,163 @@ class BasicHealthCheckPages(object):
     @property
     def last_healthcheck(self):
         """
-        Called by healthcheck server
-        because _pages are loaded and catched in memory and only healthcheck server can change this file, no need to check whether the file was changed by other process after loading.
-        """
-        if self._pages is None:
-            self._load()
-        if self._pages:
-            return self._pages[-1].last_healthcheck
-        else:
-            return None
-
-    def _load(self):
-        pages = []
-        if not os.path.exists(self.pageindexfile):
-            folder = os.path.dirname(self.pageindexfile)
-            utils.makedir(folder)
-        elif not os.path.isfile(self.pageindexfile):
-            raise Exception("The file path({}) is not a file".format(self.pageindexfile))
-        else:
-            with open(self.pageindexfile,'r') as f:
-                while True:
-                    data = f.readline()
-                    if data == "":
-                        break
-                    data = data.strip()
-                    if not data:
-                        continue
-                    try:
-                        pages.append(HealthCheckPage.deserialize(self,data))
-                    except Exception as ex:
-                        logger.error("The page data({1}) in file({0}) is corrupted".format(self.pageindexfile,data))
+        Called by healthcheck server
+        because _pages are loaded and catched in memory and only healthcheck server can change this file, no need to check whether the file was changed by other process after loading.
+        """
+        with self._pageslock:
+            if self._pages is None:
+                self._load()
+            if self._pages:
+                return self._pages[-1].last_healthcheck
+            else:
+                return None
 
-        self._pages = pages
-        if os.path.exists(self.pageindexfile):
-            self._filesize = os.path.getsize(self.pageindexfile)
-        else:
-            self._filesize = 0
+    def _load(self):
+        with self._pageslock:
+            self._pages = self.storage.load_pages(self)
+            self._version = self.storage.get_version(self)
 
     def reset(self):
         """
         Reset the pages to reload it
         """
-        self._filesize = None
-        self._pages = None
+        with self._pageslock:
+            self._version = None
+            self._pages = None
 
     def get_pages(self):
         """
         Called by web app; should reload if if it was changed by healthcheck server
+        Return a copy of the page list, which can be changed by the healthstatus writer
         """
-        if self._pages is None or self._filesize is None or (os.path.exists(self.pageindexfile) and self._filesize != os.path.getsize(self.pageindexfile)):
-            self._load()
-        return self._pages
+        with self._pageslock:
+            if self._pages is None or self._version is None or self._version != self.storage.get_version(self):
+                self._load()
+            return list(self._pages)
 
-    def save_healthcheckstatus(self,healthcheckstatus):
+    def save_healthcheckstatus(self,healthcheckstatus,writtenfiles=None):
         """
+        writtenfiles: a set to collect the written files if not None
         Return True if expired pages have been cleaned; otherwise return False
         """
-        if self._pages is None:
-            self._load()
-
-        try:
-            cleaned = False
-            if self._pages:
-                if self._pages[-1].save(healthcheckstatus):
-                    return False
-
-            newpage = HealthCheckPage(self,healthcheckstatus[0],self.pagefile(healthcheckstatus[0]))
+        with self._pageslock:
+            if self._pages is None:
+                self._load()
 
-            with open(self.pageindexfile,'ab') as f:
+            try:
+                cleaned = False
                 if self._pages:
-                    f.write(b"\n")
-                f.write(newpage.serialize().encode())
-            self._pages.append(newpage)
+                    if self._pages[-1].save(healthcheckstatus,writtenfiles=writtenfiles):
+                        return False
+
+                newpage = self.storage.create_page(self,healthcheckstatus[0],writtenfiles=writtenfiles)
+                self._pages.append(newpage)
+                #the previous page is closed, compress it after the current status is saved
+                self.storage.queue_compression(self)
+
+                newpage.save(healthcheckstatus,writtenfiles=writtenfiles)
+            except FileNotFoundError as ex:
+                #file doesn't exist. maybe delete from disk directly.
+                #reload the pages and do it again
+                self.reset()
+                self.save_healthcheckstatus(healthcheckstatus,writtenfiles=writtenfiles)
+            finally:
+                cleaned = self.managepages(writtenfiles=writtenfiles)
 
-            newpage.save(healthcheckstatus)
-        except FileNotFoundError as ex:
-            #file doesn't exist. maybe delete from disk directly.
-            #reload the pages and do it again
-            self.reset()
-            self.save_healthcheckstatus(healthcheckstatus)
-        finally:
-            cleaned = self.managepages()
+            return cleaned
 
-        return cleaned
 
+    def migrate(self,pageformat):
+        """
+        Convert the pages to the page format('json' or 'binary'), the healthcheck server should be stopped during the migration
+        Return the number of the converted pages
+        """
+        with self._pageslock:
+            if not self.historyenabled:
+                return 0
+            if not isinstance(self.storage,FileHistoryStorage):
+                raise Exception("The pages in {} can't be migrated".format(self.storage))
+            self.reset()
+            self._load()
+            pages = []
+            converted = []
+            for i,page in enumerate(self._pages):
+                pagefile = self.pagefile(page.starttime,pageformat=pageformat)
+                if page.split_compression(page.filepath)[0] == pagefile:
+                    pages.append(page)
+                    continue
+                newpage = HealthCheckPage.get_pagecls(pagefile)(self,page.starttime,pagefile)
+                #the last page can be written after migration
+                newpage.write_items(page.pageitems(),capacity=settings.HEALTHSTATUS_PAGESIZE if i == len(self._pages) - 1 else None)
+                pages.append(newpage)
+                converted.append(page)
+
+            if converted:
+                tmpfile = "{}.tmp".format(self.pageindexfile)
+                with open(tmpfile,'wb') as f:
+                    f.write(b"\n".join(page.serialize().encode() for page in pages))
+                os.replace(tmpfile,self.pageindexfile)
+                self._pages = pages
+                self._version = self.storage.get_version(self)
+                for page in converted:
+                    page.delete()
+                #the converted closed pages are not compressed
+                self.storage.compress_pages(self)
+
+            return len(converted)
+
+    def compress_pages(self,writtenfiles=None):
+        """
+        Compress the closed pages, called by the healthstatus writer
+        Return the number of the compressed pages
+        """
+        with self._pageslock:
+            if self._pages is None:
+                return 0
+            return self.storage.compress_pages(self,writtenfiles=writtenfiles)
 
-    def managepages(self):
+    def managepages(self,writtenfiles=None):
         """
+        writtenfiles: a set to collect the written files if not None
         Return True if expired pages have been cleaned; otherwise return False
         """
-        if not self.historyenabled:
-            #no need to manage
-            return  False
+        with self._pageslock:
+            if not self.historyenabled:
+                #no need to manage
+                return  False
 
-        now = utils.now()
-        if self.next_management_time and now < self.next_management_time:
-            manage_history = False
-        else :
-            manage_history = True
-        if self.next_management_time:
-            self.next_management_time += timedelta(days=1)
-        else:
-            self.next_management_time = datetime(now.year,now.month,now.day,tzinfo=settings.TZ) + timedelta(days=1)
-
-        if manage_history:
-            ealiest_nonexpiretime = datetime(now.year,now.month,now.day,tzinfo=settings.TZ)
-            if self._historyexpire > 1:
-                ealiest_nonexpiretime -= timedelta(days=self._historyexpire - 1)
-            #find the index of the last expired data
-            index_of_latest_expiredata = -1
-            for i in range(1,len(self._pages)):
-                if self._pages[i - 1].starttime < ealiest_nonexpiretime:
-                    index_of_latest_expiredata = i - 1
-                else:
-                    break
-            if index_of_latest_expiredata >= 0:
-                #remove expired data from memory
-                for i in range(index_of_latest_expiredata,-1,-1):
-                    self._pages[i].delete()
-                    del self._pages[i]
-                #save to file
-                with open(self.pageindexfile,'wb') as f:
-                    for i in range(len(self._pages)):
-                        if i > 0:
-                            f.write(b"\n")
-                        f.write(self._pages[i].serialize().encode())
-            return True
-        else:
-            return False
+            now = utils.now()
+            if self.next_management_time and now < self.next_management_time:
+                manage_history = False
+            else :
+                manage_history = True
+            if self.next_management_time:
+                self.next_management_time += timedelta(days=1)
+            else:
+                self.next_management_time = datetime(now.year,now.month,now.day,tzinfo=settings.TZ) + timedelta(days=1)
+
+            if manage_history:
+                ealiest_nonexpiretime = datetime(now.year,now.month,now.day,tzinfo=settings.TZ)
+                if self._historyexpire > 1:
+                    ealiest_nonexpiretime -= timedelta(days=self._historyexpire - 1)
+                #find the index of the last expired data
+                index_of_latest_expiredata = -1
+                for i in range(1,len(self._pages)):
+                    if self._pages[i - 1].starttime < ealiest_nonexpiretime:
+                        index_of_latest_expiredata = i - 1
+                    else:
+                        break
+                if index_of_latest_expiredata >= 0:
+                    #remove expired data from memory and the storage
+                    expiredpages = self._pages[:index_of_latest_expiredata + 1]
+                    del self._pages[:index_of_latest_expiredata + 1]
+                    self.storage.remove_pages(self,expiredpages,writtenfiles=writtenfiles)
+                self.storage.remove_obsolete_files(self)
+                #compress the closed pages which were saved before the compression is enabled
+                self.storage.queue_compression(self)
+                return True
+            else:
+                return False
 
 class HealthCheckPages(BasicHealthCheckPages):
     """
@@ -595,6 +1718,7 @@ class HealthCheckPages(BasicHealthCheckPages):
     _pageindexfilename = "pageindex.json"
     _pagefilename = "page_{}.json"
     _pagefolder = "pages"
+    _historytype = "history"
     def __init__(self,servicehealthcheck):
         super().__init__(servicehealthcheck)
         self.historyenabled = self._servicehealthcheck.historyenabled
@@ -606,22 +1730,42 @@ class HealthCheckPages(BasicHealthCheckPages):
     def errorpages(self):
         return self._errorpages
 
+    def reset(self):
+        """
+        Reset the pages and the error pages to reload them
+        """
+        super().reset()
+        if self._errorpages:
+            self._errorpages.reset()
+
+    @property
+    def checkpoint(self):
+        """
+        Return the checkpoint of the config file; return None if the checkpoint is disabled or the status is not persistent(for example: heartbeat)
+        """
+        if not settings.HEALTHSTATUS_CHECKPOINT or not self._servicehealthcheck.url:
+            return None
+        if self.historyenabled and not self.storage.checkpointed:
+            return None
+        return HealthCheckCheckpoint.get_instance(self._servicehealthcheck.healthcheck.configfile)
+
     @property
     def last_greenhealthcheck(self):
         """
         Called by healthcheck server
         because _pages are loaded and catched in memory and only healthcheck server can change this file, no need to check whether the file was changed by other process after loading.
         """
-        if self._pages is None:
-            self._load()
-        if self._pages:
-            for i in range(len(self._pages) - 1,-1,-1):
-                data = self._pages[i].last_greenhealthcheck
-                if data:
-                    return data
-            return None
-        else:
-            return None
+        with self._pageslock:
+            if self._pages is None:
+                self._load()
+            if self._pages:
+                for i in range(len(self._pages) - 1,-1,-1):
+                    data = self._pages[i].last_greenhealthcheck
+                    if data:
+                        return data
+                return None
+            else:
+                return None
 
     @property
     def last_yellowhealthcheck(self):
@@ -629,16 +1773,17 @@ class HealthCheckPages(BasicHealthCheckPages):
         Called by healthcheck server
         because _pages are loaded and catched in memory and only healthcheck server can change this file, no need to check whether the file was changed by other process after loading.
         """
-        if self._pages is None:
-            self._load()
-        if self._pages:
-            for i in range(len(self._pages) - 1,-1,-1):
-                data = self._pages[i].last_yellowhealthcheck
-                if data:
-                    return data
-            return None
-        else:
-            return None
+        with self._pageslock:
+            if self._pages is None:
+                self._load()
+            if self._pages:
+                for i in range(len(self._pages) - 1,-1,-1):
+                    data = self._pages[i].last_yellowhealthcheck
+                    if data:
+                        return data
+                return None
+            else:
+                return None
 
     @property
     def last_redhealthcheck(self):
@@ -646,16 +1791,17 @@ class HealthCheckPages(BasicHealthCheckPages):
         Called by healthcheck server
         because _pages are loaded and catched in memory and only healthcheck server can change this file, no need to check whether the file was changed by other process after loading.
         """
-        if self._pages is None:
-            self._load()
-        if self._pages:
-            for i in range(len(self._pages) - 1,-1,-1):
-                data = self._pages[i].last_redhealthcheck
-                if data:
-                    return data
-            return None
-        else:
-            return None
+        with self._pageslock:
+            if self._pages is None:
+                self._load()
+            if self._pages:
+                for i in range(len(self._pages) - 1,-1,-1):
+                    data = self._pages[i].last_redhealthcheck
+                    if data:
+                        return data
+                return None
+            else:
+                return None
 
     @property
     def last_errorhealthcheck(self):
@@ -663,20 +1809,21 @@ class HealthCheckPages(BasicHealthCheckPages):
         Called by healthcheck server
         because _pages are loaded and catched in memory and only healthcheck server can change this file, no need to check whether the file was changed by other process after loading.
         """
-        if self._pages is None:
-            self._load()
-        if self._pages:
-            for i in range(len(self._pages) - 1,-1,-1):
-                data = self._pages[i].last_errorhealthcheck
-                if data:
-                    return data
-            return None
-        else:
-            return None
+        with self._pageslock:
+            if self._pages is None:
+                self._load()
+            if self._pages:
+                for i in range(len(self._pages) - 1,-1,-1):
+                    data = self._pages[i].last_errorhealthcheck
+                    if data:
+                        return data
+                return None
+            else:
+                return None
 
-    def pagefile(self,starttime):
+    def pagefile(self,starttime,pageformat=None):
         if self.historyenabled:
-            return super().pagefile(starttime)
+            return super().pagefile(starttime,pageformat=pageformat)
         else:
             return os.path.join(self.basedir,"latesthealthcheck.json")
 
@@ -692,26 +1839,56 @@ class HealthCheckPages(BasicHealthCheckPages):
         return os.path.join(self.basedir,"{}.json".format(starttime.strftime("%Y%m%dT%H%M%S")))
 
     def _load(self):
-        if not self._servicehealthcheck.url:
-            #is not a real healthcheck,for example: heartbeat
-            self._pages = [LastHealthCheckInMemory(self,self.pagefile(None))]
-        elif not self.historyenabled:
-            self._pages = [LastHealthCheck(self,self.pagefile(None))]
-        else:
-            super()._load()
+        with self._pageslock:
+            if not self._servicehealthcheck.url:
+                #is not a real healthcheck,for example: heartbeat
+                self._pages = [LastHealthCheckInMemory(self,self.pagefile(None))]
+            elif not self.historyenabled:
+                self._pages = [LastHealthCheck(self,self.pagefile(None))]
+            else:
+                super()._load()
 
-    def save(self,healthcheckstatus,details=None):
-        cleaned = False
+    def compress_pages(self,writtenfiles=None):
+        with self._lock:
+            return super().compress_pages(writtenfiles=writtenfiles)
+
+    def migrate(self,pageformat):
+        """
+        Convert the pages and the error pages to the page format('json' or 'binary')
+        Return the number of the converted pages
+        """
         with self._lock:
+            converted = super().migrate(pageformat)
+            if self._errorpages:
+                converted += self._errorpages.migrate(pageformat)
+        return converted
+
+    def save(self,healthcheckstatus,details=None,writtenfiles=None):
+        """
+        Save the healthcheck status and details, called by the healthstatus writer in a worker thread
+        writtenfiles: a set to collect the written files if not None
+        """
+        cleaned = False
+        with self._lock,self._pageslock:
             try:
-                cleaned = super().save_healthcheckstatus(healthcheckstatus)
+                cleaned = super().save_healthcheckstatus(healthcheckstatus,writtenfiles=writtenfiles)
             finally:
                 if details:
-                    with open(self._pages[-1].detailfile(healthcheckstatus[0]),'w') as f:
+                    detailfile = self._pages[-1].detailfile(healthcheckstatus[0])
+                    with open(detailfile,'w') as f:
                         f.write(json.dumps(details,cls=serializers.JSONFormater))
+                    if writtenfiles is not None:
+                        writtenfiles.add(detailfile)
+
+            checkpoint = self.checkpoint
+            if checkpoint:
+                try:
+                    checkpoint.update(self,healthcheckstatus)
+                except Exception as ex:
+                    logger.error("Failed to update the checkpoint of service({0}). {1}: {2}".format(self._servicehealthcheck,ex.__class__.__name__,str(ex)))
 
-            if self._errorpages and healthcheckstatus[2] != "green" and healthcheckstatus[2] in self._servicehealthcheck.healthdetailpersistent:
-                cleaned = cleaned or self._errorpages.save_healthcheckstatus(healthcheckstatus)
+            if self._errorpages and healthcheckstatus[2] != "green" and self._servicehealthcheck.is_healthdetailpersistent(healthcheckstatus[2]):
+                cleaned = self._errorpages.save_healthcheckstatus(healthcheckstatus,writtenfiles=writtenfiles) or cleaned
             
             if cleaned:
                 #a history clean action was performed. try to clean the expired details
@@ -719,7 +1896,7 @@ class HealthCheckPages(BasicHealthCheckPages):
                 starttime = None
                 if self._historyexpire > 0:
                     starttime = self._pages[0]._starttime
-                if self._errorpages._historyexpire > 0 and self._errorpages._pages:
+                if self._errorpages and self._errorpages._historyexpire > 0 and self._errorpages._pages:
                     if not starttime:
                         starttime = self._errorpages._pages[0]._starttime
                     elif starttime > self._errorpages._pages[0]._starttime:
@@ -740,12 +1917,178 @@ class HealthCheckErrorPages(BasicHealthCheckPages):
     _pageindexfilename = "errorpageindex.json"
     _pagefilename = "errorpage_{}.json"
     _pagefolder = "errorpages"
+    _historytype = "errorhistory"
     def __init__(self,servicehealthcheck):
         super().__init__(servicehealthcheck)
         self.historyenabled = self._servicehealthcheck.errorhistoryenabled
         self._historyexpire = self._servicehealthcheck.errorhistoryexpire
 
 
+class HealthCheckCheckpoint(object):
+    """
+    The last healthcheck status and the last healthcheck status of each colour of all the services in a config file,
+    saved in one file to load the healthcheck status at startup without reading the pages.
+    The record of a service is only used if the files it was taken from are not changed after that; otherwise the status is loaded from the pages.
+    Updated by the healthstatus writer thread after saving the status, and saved at most once per HEALTHSTATUS_CHECKPOINT_INTERVAL.
+    """
+    _instances = {}
+    _filename = "checkpoint.json"
+    version = 1
+    colours = ("green","yellow","red","error")
+    def __init__(self,configfile):
+        self._basedir = os.path.join(settings.HEALTHCHECK_DATA_DIR,os.path.splitext(os.path.basename(configfile))[0])
+        self._file = os.path.join(self._basedir,self._filename)
+        #key: "{sectionid}.{serviceid}"
+        #value: {"history":history enabled,"last":last status,"green":last green status,"yellow":...,"red":...,"error":...,"files":[[file path relative to the base dir,size,mtime in ns]]}
+        self._services = None
+        #the services whose record is consistent with the pages, only these records can be updated incrementally
+        self._verified = set()
+        self._changed = False
+        self._savetime = None
+        #the records are read by the event loop and updated/saved by the healthstatus writer thread
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return "HealthCheckCheckpoint({})".format(self._file)
+
+    @classmethod
+    def get_instance(cls,configfile):
+        obj = cls._instances.get(configfile)
+        if not obj:
+            obj = cls(configfile)
+            cls._instances[configfile] = obj
+        return obj
+
+    @property
+    def file(self):
+        return self._file
+
+    @staticmethod
+    def get_key(servicehealthcheck):
+        return "{}.{}".format(servicehealthcheck.sectionid,servicehealthcheck.serviceid)
+
+    def _load(self):
+        services = {}
+        if os.path.exists(self._file):
+            try:
+                with open(self._file,'r') as f:
+                    data = json.loads(f.read())
+                if data.get("version") == self.version:
+                    services = data["services"]
+                    for record in services.values():
+                        for name in ("last",) + self.colours:
+                            if record[name]:
+                                record[name][0] = utils.parse_datetime(record[name][0])
+                                record[name][1] = utils.parse_datetime(record[name][1])
+                else:
+                    logger.warning("The version({1}) of the checkpoint file({0}) is not supported, ignore it".format(self._file,data.get("version")))
+            except Exception as ex:
+                logger.error("The checkpoint file({0}) is corrupted, ignore it. {1}: {2}".format(self._file,ex.__class__.__name__,str(ex)))
+                services = {}
+        self._services = services
+
+    def _get_files(self,healthcheckpages):
+        """
+        Return the files which the last status of the service is read from
+        """
+        if healthcheckpages.historyenabled:
+            files = [healthcheckpages.pageindexfile]
+            if healthcheckpages._pages:
+                files.append(healthcheckpages._pages[-1].filepath)
+            return files
+        else:
+            return [healthcheckpages.pagefile(None)]
+
+    def _is_uptodate(self,record):
+        for path,size,mtime in record["files"]:
+            try:
+                stat = os.stat(os.path.join(self._basedir,path))
+            except FileNotFoundError as ex:
+                return False
+            if stat.st_size != size or stat.st_mtime_ns != mtime:
+                return False
+        return True
+
+    def get(self,healthcheckpages):
+        """
+        Return the checkpoint record of the service if it exists and is not stale; otherwise return None
+        Called when loading the healthcheck status, before the healthstatus writer saves any status of the service
+        """
+        key = self.get_key(healthcheckpages.servicehealthcheck)
+        with self._lock:
+            if self._services is None:
+                self._load()
+            record = self._services.get(key)
+            if not record:
+                return None
+            if record["history"] != healthcheckpages.historyenabled or not self._is_uptodate(record):
+                logger.debug("{}: The checkpoint record is stale, load the healthcheck status from the pages".format(healthcheckpages.servicehealthcheck))
+                del self._services[key]
+                self._verified.discard(key)
+                return None
+            self._verified.add(key)
+            return dict(record)
+
+    def update(self,healthcheckpages,healthcheckstatus):
+        """
+        Update the record of the service after the status is saved, called by the healthstatus writer thread
+        """
+        key = self.get_key(healthcheckpages.servicehealthcheck)
+        files = []
+        for f in self._get_files(healthcheckpages):
+            stat = os.stat(f)
+            files.append([os.path.relpath(f,self._basedir),stat.st_size,stat.st_mtime_ns])
+
+        with self._lock:
+            if self._services is None:
+                self._load()
+            record = self._services.get(key) if key in self._verified else None
+            if record is None or record["history"] != healthcheckpages.historyenabled:
+                #the record is not loaded or verified, initialize it from the pages
+                record = {
+                    "history":healthcheckpages.historyenabled,
+                    "last":healthcheckstatus,
+                    "green":healthcheckpages.last_greenhealthcheck,
+                    "yellow":healthcheckpages.last_yellowhealthcheck,
+                    "red":healthcheckpages.last_redhealthcheck,
+                    "error":healthcheckpages.last_errorhealthcheck
+                }
+                self._services[key] = record
+                self._verified.add(key)
+            else:
+                record["last"] = healthcheckstatus
+                record[healthcheckstatus[2] if healthcheckstatus[2] in self.colours else "error"] = healthcheckstatus
+            record["files"] = files
+            self._changed = True
+
+    def save(self,force=False,fsync=False):
+        """
+        Save the checkpoint file if it was changed, at most once per HEALTHSTATUS_CHECKPOINT_INTERVAL unless force is True
+        The file is written into a temporary file first and then replaces the checkpoint file.
+        Return True if saved; otherwise return False
+        """
+        with self._lock:
+            if not self._changed:
+                return False
+            if not force and self._savetime is not None and time.monotonic() - self._savetime < settings.HEALTHSTATUS_CHECKPOINT_INTERVAL:
+                return False
+            data = json.dumps({"version":self.version,"services":self._services},cls=serializers.JSONFormater)
+            self._changed = False
+            self._savetime = time.monotonic()
+        tmpfile = "{}.tmp".format(self._file)
+        try:
+            with open(tmpfile,'w') as f:
+                f.write(data)
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmpfile,self._file)
+        except:
+            with self._lock:
+                self._changed = True
+            raise
+        return True
+
 class ServiceHealthCheck(UserDict):
     selected = False
 
@@ -840,6 +2183,13 @@ class ServiceHealthCheck(UserDict):
     def offset(self):
         return self['offset']
 
+    @staticmethod
+    def get_auto_offset(sectionid,serviceid,interval):
+        """
+        Return a deterministic offset in [0,interval) for the service, used to spread the services with the same interval across the interval
+        """
+        return int(hashlib.sha1("{}.{}".format(sectionid,serviceid).encode()).hexdigest(),16) % interval
+
     @property
     def method(self):
         return self['method']
@@ -890,6 +2240,28 @@ class ServiceHealthCheck(UserDict):
         """
         return self.get("data")
 
+    _requestsignature = None
+    @property
+    def requestsignature(self):
+        """
+        Return the signature of the request, the services with the same signature send the same request.
+        Return None if the service doesn't send a request
+        """
+        if not self._requestsignature and self.url:
+            formdata = self.formdata
+            if formdata and not isinstance(formdata,str):
+                formdata = json.dumps(formdata,sort_keys=True,cls=serializers.JSONFormater)
+            self._requestsignature = (
+                self.method,
+                self.url,
+                tuple(sorted(self.headers.items())) if self.headers else None,
+                self.auth,
+                self.sslverify,
+                self.request_timeout,
+                formdata
+            )
+        return self._requestsignature
+
     @property
     def healthstatus(self):
         """
@@ -900,6 +2272,7 @@ class ServiceHealthCheck(UserDict):
     @healthstatus.setter
     def healthstatus(self,val):
         self["healthstatus"] = val
+        self.healthcheck.healthstatus_changed(self)
 
     @property
     def healthstatus_healthdata(self):
@@ -917,6 +2290,7 @@ class ServiceHealthCheck(UserDict):
         else:
             self.last_errorhealthcheck = val
         self["healthstatus"][1] = val
+        self.healthcheck.healthstatus_changed(self)
 
     @property
     def healthstatus_nextchecktime(self):
@@ -926,6 +2300,7 @@ class ServiceHealthCheck(UserDict):
     @healthstatus_nextchecktime.setter
     def healthstatus_nextchecktime(self,val):
         self["healthstatus"][0] = val
+        self.healthcheck.healthstatus_changed(self)
 
     @property
     def healthstatus_nextcheck(self):
@@ -982,6 +2357,11 @@ class ServiceHealthCheck(UserDict):
     def healthdetailpersistent(self):
         return self["healthdetailpersistent"]
 
+    def is_healthdetailpersistent(self,status):
+        """
+        Return True if the health detail of the status should be persistent; the 'skipped' status is treated as 'error'
+        """
+        return ("error" if status == "skipped" else status) in self["healthdetailpersistent"]
 
     @property
     def prtgenabled(self):
@@ -1075,98 +2455,225 @@ class ServiceHealthCheck(UserDict):
         else:
             details = None
 
-        self.healthcheckpages.save(healthstatus,details)
+        await writer.save(self.healthcheckpages,healthstatus,details)
 
     def load_checkinghistory(self):
-        last_healthcheck = self.healthcheckpages.last_healthcheck
+        checkpoint = self.healthcheckpages.checkpoint
+        record = checkpoint.get(self.healthcheckpages) if checkpoint else None
+        if record:
+            #load the status from the checkpoint, no need to read the pages
+            last_healthcheck = record["last"]
+            self.last_greenhealthcheck = record["green"]
+            self.last_yellowhealthcheck = record["yellow"]
+            self.last_redhealthcheck = record["red"]
+            self.last_errorhealthcheck = record["error"]
+        else:
+            last_healthcheck = self.healthcheckpages.last_healthcheck
 
         next_checktime = self.get_nextchecktime(self["offset"],last_healthcheck[0] if last_healthcheck else None)
         self.healthstatus = [next_checktime,last_healthcheck] 
 
 
-class JsonStatusMixin(object):
-    def get_jsonstatus(self,details=False):
-        now = utils.now()
-        data = {}
-        for section in self.healthchecksections:
-            sectiondata = {}
-            data[section.sectionid] = sectiondata
+class CachedStatus(object):
+    """
+    The cached json status or prtg data of a healthcheck, a view or a prtg sensor.
+    The entry of a service is recomputed only if its healthstatus is changed or becomes outdated,
+    and the result is assembled and encoded only if some entries are changed.
+    """
+    count = 0
+    def __init__(self,healthcheck,view,viewsettings,f_get_entry,f_get_result):
+        self.__class__.count += 1
+        #the cached status is rebuilt if the configuration is reloaded or the settings of the view are changed
+        self.sections = healthcheck.sections
+        self.viewsettings = viewsettings
+        self._f_get_entry = f_get_entry
+        self._f_get_result = f_get_result
+        #list of [section,[[service,entry]]]
+        self._result = []
+        #key: (sectionid,serviceid), value: (section,[service,entry])
+        self._entries = {}
+        for section in view.healthchecksections:
+            services = []
+            self._result.append([section,services])
             for service in section.healthcheckservices:
-                if details:
-                    if service.healthstatus_nextchecktime + timedelta(milliseconds=service["timeout"]) < now:
-                        sectiondata[service.serviceid] = {
-                            'status': "error",
-                            'starttime': "",
-                            'endtime': "",
-                            'message': "The service should be checked at '{}', but it didn't".format(service.healthstatus_nextcheck),
-                            'nextcheck':""
-                        }
-                    else:
-                        sectiondata[service.serviceid] = {
-                            'status': service.healthstatus_name,
-                            'starttime': service.healthstatus_checkstart,
-                            'endtime': service.healthstatus_checkend,
-                            'message':service.healthstatus_info,
-                            'nextcheck':service.healthstatus_nextcheck
-                        }
+                item = [service,None]
+                services.append(item)
+                self._entries[(service.sectionid,service.serviceid)] = (section,item)
+        #the keys of the entries which should be recomputed
+        self._changed = set(self._entries.keys())
+        #the time when the entry becomes outdated, key: (sectionid,serviceid)
+        self._expiretimes = {}
+        self._expiretime = None
+        self._version = 0
+        self._etagprefix = "{}-{}-{}".format(os.getpid(),int(utils.now().timestamp()),self.count)
+        self.data = None
+        self.etag = None
+
+    def changed(self,key):
+        if key in self._entries:
+            self._changed.add(key)
+
+    def get(self):
+        """
+        Return (the encoded result,the etag of the result)
+        """
+        now = utils.now()
+        if self._expiretime and self._expiretime < now:
+            self._changed.update(key for key,expiretime in self._expiretimes.items() if expiretime < now)
+        if self._changed:
+            for key in self._changed:
+                section,item = self._entries[key]
+                item[1],expiretime = self._f_get_entry(section,item[0],now)
+                if expiretime:
+                    self._expiretimes[key] = expiretime
                 else:
-                    if service.healthstatus_nextchecktime + timedelta(milliseconds=service["timeout"]) < now:
-                        #the current healthstatus is outdated
-                        sectiondata[service.serviceid] = "error"
-                    else:
-                        sectiondata[service.serviceid] = service.healthstatus_name
-        return data
+                    self._expiretimes.pop(key,None)
+            self._changed.clear()
+            self._expiretime = min(self._expiretimes.values()) if self._expiretimes else None
+            self._version += 1
+            self.data = json.dumps(self._f_get_result(self._result))
+            self.etag = '"{}-{}"'.format(self._etagprefix,self._version)
+        return (self.data,self.etag)
+
+class CachedStatusMixin(object):
+    @property
+    def basehealthcheck(self):
+        return self._healthcheck
 
-class PRTGMixin(object):
-    def get_prtgdata(self,details=False):
-        data = {"error":0,"result":[],"text":"All checks passed"}
-        failed_services = []
-        warning_services = []
+    @property
+    def cachekey(self):
+        """
+        The key of the cached status, None if the result is same as the result of the healthcheck
+        """
+        return None
+
+    @property
+    def viewsettings(self):
+        return None
+
+    def get_cachedstatus(self,name,f_get_entry,f_get_result):
+        healthcheck = self.basehealthcheck
+        key = (name,self.cachekey)
+        cachedstatus = healthcheck._cachedstatus.get(key)
+        if not cachedstatus or cachedstatus.sections is not healthcheck.sections or cachedstatus.viewsettings is not self.viewsettings:
+            cachedstatus = CachedStatus(healthcheck,self,self.viewsettings,f_get_entry,f_get_result)
+            healthcheck._cachedstatus[key] = cachedstatus
+        return cachedstatus
+
+class JsonStatusMixin(CachedStatusMixin):
+    @staticmethod
+    def _get_jsonstatus_entry(section,service,now,details):
+        """
+        Return (the status of the service,the time when the status becomes outdated or None if already outdated)
+        """
+        expiretime = service.healthstatus_nextchecktime + timedelta(milliseconds=service["timeout"]) if service.healthstatus_nextchecktime else None
+        if details:
+            if not expiretime or expiretime < now:
+                return ({
+                    'status': "error",
+                    'starttime': "",
+                    'endtime': "",
+                    'message': "The service should be checked at '{}', but it didn't".format(service.healthstatus_nextcheck),
+                    'nextcheck':""
+                },None)
+            else:
+                return ({
+                    'status': service.healthstatus_name,
+                    'starttime': service.healthstatus_checkstart,
+                    'endtime': service.healthstatus_checkend,
+                    'message':service.healthstatus_info,
+                    'nextcheck':service.healthstatus_nextcheck
+                },expiretime)
+        else:
+            if not expiretime or expiretime < now:
+                #the current healthstatus is outdated
+                return ("error",None)
+            else:
+                return (service.healthstatus_name,expiretime)
+
+    @staticmethod
+    def _get_jsonstatus_result(sections):
+        """
+        sections: list of [section,[[service,entry]]]
+        """
+        return {section.sectionid:{service.serviceid:entry for service,entry in services} for section,services in sections}
+
+    def get_jsonstatus(self,details=False):
         now = utils.now()
-        servicecritical = {}
-        for section in self.healthchecksections:
-            if not section.enabled:
-                continue
-            if not section.prtgenabled:
-                continue
-            for service in section.healthcheckservices:
-                if not service.enabled:
-                    continue
-                if not service.url:
-                    continue
-                if not service.prtgenabled:
-                    continue
+        return self._get_jsonstatus_result((section,[(service,self._get_jsonstatus_entry(section,service,now,details)[0]) for service in section.healthcheckservices]) for section in self.healthchecksections)
 
-                if not service.healthstatus_nextchecktime or service.healthstatus_nextchecktime + timedelta(milliseconds=service["timeout"]) < now:
-                    #the current healthstatus is outdated
-                    prtgdata = None
-                    healthstatus_name = "error"
-                else:
-                    prtgdata = service.healthstatus_prtgdata
-                    healthstatus_name = service.healthstatus_name
+    def get_cached_jsonstatus(self,details=False):
+        """
+        Return (the encoded json status,etag)
+        """
+        details = bool(details)
+        return self.get_cachedstatus(
+            "json_details" if details else "json",
+            lambda section,service,now:self._get_jsonstatus_entry(section,service,now,details),
+            self._get_jsonstatus_result
+        ).get()
+
+class PRTGMixin(CachedStatusMixin):
+    @staticmethod
+    def _get_prtgdata_entry(section,service,now):
+        """
+        Return ([prtg channels,health status name,critical weight,service name] or None if not included,the time when the entry becomes outdated or None)
+        """
+        if not section.enabled or not section.prtgenabled:
+            return (None,None)
+        if not service.enabled or not service.url or not service.prtgenabled:
+            return (None,None)
+
+        expiretime = service.healthstatus_nextchecktime + timedelta(milliseconds=service["timeout"]) if service.healthstatus_nextchecktime else None
+        if not expiretime or expiretime < now:
+            #the current healthstatus is outdated
+            prtgdata = None
+            healthstatus_name = "error"
+            expiretime = None
+        else:
+            prtgdata = service.healthstatus_prtgdata
+            healthstatus_name = service.healthstatus_name
 
-                if prtgdata == PRTGDATA_NOT_ENABLED:
-                    continue
+        if prtgdata == PRTGDATA_NOT_ENABLED:
+            return (None,expiretime)
+
+        prtgchannels = []
+        if service.prtg :
+            for channelid,prtgconfig in service.prtgchannels:
+                prtgchannel,getdata_map,computed_columns = prtgconfig
+                prtgchannel = dict(prtgchannel)
+                if prtgdata is not None and prtgdata.get(channelid) is not None:
+                    prtgchannel["value"] = prtgdata[channelid]
 
-                if service.prtg :
-                    for channelid,prtgconfig in service.prtgchannels:
-                        prtgchannel,getdata_map,computed_columns = prtgconfig
-                        prtgchannel = dict(prtgchannel)
-                        if prtgdata is not None and prtgdata.get(channelid) is not None:
-                            prtgchannel["value"] = prtgdata[channelid]
+                for k,v in computed_columns.items():
+                    prtgchannel[k] = v(prtgchannel["value"])
 
-                        for k,v in computed_columns.items():
-                            prtgchannel[k] = v(prtgchannel["value"])
+                prtgchannels.append(prtgchannel)
 
+        return ([prtgchannels,healthstatus_name,service.criticalweight,service.servicename],expiretime)
 
-                        data["result"].append(prtgchannel)
+    @staticmethod
+    def _get_prtgdata_result(sections):
+        """
+        sections: list of [section,[[service,entry]]]
+        """
+        data = {"error":0,"result":[],"text":"All checks passed"}
+        failed_services = []
+        warning_services = []
+        servicecritical = {}
+        for section,services in sections:
+            for service,entry in services:
+                if not entry:
+                    continue
+                prtgchannels,healthstatus_name,criticalweight,servicename = entry
+                data["result"].extend(prtgchannels)
 
                 if healthstatus_name in ("red","error"):
-                    if service.criticalweight:
-                        servicecritical[service.criticalweight[0]] = servicecritical.get(service.criticalweight[0],0) + service.criticalweight[1]
-                    failed_services.append(service.servicename)
+                    if criticalweight:
+                        servicecritical[criticalweight[0]] = servicecritical.get(criticalweight[0],0) + criticalweight[1]
+                    failed_services.append(servicename)
                 elif healthstatus_name  == "yellow":
-                    warning_services.append(service.servicename)
+                    warning_services.append(servicename)
 
         if any( (v >= 1) for v in servicecritical.values()):
             data["error"] = 1
@@ -1181,6 +2688,16 @@ class PRTGMixin(object):
 
         return {"prtg":data}
 
+    def get_prtgdata(self,details=False):
+        now = utils.now()
+        return self._get_prtgdata_result((section,[(service,self._get_prtgdata_entry(section,service,now)[0]) for service in section.healthcheckservices]) for section in self.healthchecksections)
+
+    def get_cached_prtgdata(self):
+        """
+        Return (the encoded prtg data,etag)
+        """
+        return self.get_cachedstatus("prtg",self._get_prtgdata_entry,self._get_prtgdata_result).get()
+
 class HealthCheck(PRTGMixin,JsonStatusMixin):
     configfile = None
     _checkingstatus_loaded = False
@@ -1192,8 +2709,11 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
         self.config_hashcode = None
         self.sections = None
         self.configfile = configfile
+        #the cached json status and prtg data of the healthcheck and its views, key: (name,view key)
+        self._cachedstatus = {}
         self._name = "{}({})".format(self.__class__.__name__,os.path.basename(self.configfile))
         self._continuous_check_task = None
+        self._scheduler = ServiceScheduler()
         self.load_configs()
 
     def __str__(self):
@@ -1207,6 +2727,20 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
     def healthchecksections(self):
         return self.sections.values() if self.sections else []
 
+    @property
+    def basehealthcheck(self):
+        return self
+
+    def healthstatus_changed(self,service):
+        """
+        Called when the healthstatus of the service is changed, the cached status containing the service will recompute the status of the service
+        """
+        if not self._cachedstatus:
+            return
+        key = (service.sectionid,service.serviceid)
+        for cachedstatus in self._cachedstatus.values():
+            cachedstatus.changed(key)
+
     def get_service(self,section,service):
         return self.sections.get(section,{}).get("services",{}).get(service)
 
@@ -1219,6 +2753,18 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
         if not changed:
             return False
 
+        #retire the pooled http clients which are not used by the reloaded services
+        clientkeys = set(clientpool.get_key(service) for section in self.healthchecksections for service in section.healthcheckservices if service.url)
+        obsoletekeys = set()
+        for section in (sections.values() if sections else []):
+            for service in section.healthcheckservices:
+                if service.url:
+                    key = clientpool.get_key(service)
+                    if key not in clientkeys:
+                        obsoletekeys.add(key)
+        if obsoletekeys:
+            clientpool.invalidate(obsoletekeys)
+
         now = utils.now()
         today = datetime(year = now.year,month=now.month,day=now.day,tzinfo=settings.TZ)
         tomorrow = today + timedelta(days=1)
@@ -1226,15 +2772,18 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
         for section in self.healthchecksections:
             for service in section.healthcheckservices:
                 existing_service = sections.get(section.sectionid,{}).get("services",{}).get(service.serviceid)
-                next_checktime = today + timedelta(seconds=seconds_in_day - (seconds_in_day % service.interval))
+                #the latest check time which is not later than now
+                next_checktime = today + timedelta(seconds=seconds_in_day - (seconds_in_day % service.interval) + service.offset)
+                if next_checktime > now:
+                    next_checktime -= timedelta(seconds=service.interval)
                 if existing_service and existing_service.healthstatus:
                     service.healthstatus = existing_service.healthstatus
                     if service.healthstatus[0] < next_checktime:
                         service.healthstatus[0] = next_checktime
                     else:
                         next_checktime += timedelta(seconds=service.interval)
-                        if next_checktime  >= tomorrow:
-                            service.healthstatus[0] = tomorrow
+                        if next_checktime  >= tomorrow + timedelta(seconds=service.offset):
+                            service.healthstatus[0] = tomorrow + timedelta(seconds=service.offset)
                         else:
                             service.healthstatus[0] = next_checktime
                 else:
@@ -1362,7 +2911,13 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
             config["checkingtime"] = basecheckingtime
 
             try:
-                baseoffset = int(config.get("offset") or 0)
+                baseoffset = config.get("offset")
+                if isinstance(baseoffset,str) and baseoffset.strip().lower() == AUTO_OFFSET:
+                    baseoffset = AUTO_OFFSET
+                elif baseoffset is None and settings.HEALTHCHECK_AUTO_OFFSET:
+                    baseoffset = AUTO_OFFSET
+                else:
+                    baseoffset = int(baseoffset or 0)
             except Exception as ex:
                 errors.append("Section {}({}): The offset({}) is incorrect.{}".format(sectionindex,sectionid,config.get("offset"),str(ex)))
                 baseoffset = 0
@@ -1623,7 +3178,16 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
                 service["checkingtime"] = checkingtime
 
                 try:
-                    offset = int(service.get("offset") or baseoffset)
+                    offset = service.get("offset")
+                    if isinstance(offset,str) and offset.strip().lower() == AUTO_OFFSET:
+                        offset = AUTO_OFFSET
+                    elif offset or baseoffset != AUTO_OFFSET:
+                        offset = int(offset or baseoffset)
+                    elif offset is not None and offset != "":
+                        #an explicit offset 0 opts out of the auto offset
+                        offset = int(offset)
+                    else:
+                        offset = baseoffset
                 except Exception as ex:
                     errors.append("Service {0}({1}).{2}: The offset({3}) is incorrect.{4}".format(sectionindex,sectionid,serviceindex,service.get("offset"),str(ex)))
                     offset = baseoffset
@@ -1677,6 +3241,9 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
                     errors.append("Service {0}({1}).{2}({3}): The interval({4}) is not an integer".format(sectionindex,sectionid,serviceindex,serviceid,service.get("interval")))
                     continue
 
+                if service["offset"] == AUTO_OFFSET:
+                    service["offset"] = ServiceHealthCheck.get_auto_offset(sectionid,serviceid,service["interval"])
+
                 try:
                     timeout = service.get("timeout")
                     if timeout is None:
@@ -1872,14 +3439,14 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
 
                             if isinstance(service["healthchecks"][key],(list,tuple)):
                                 service["healthchecks"][key] = [
-                                    checks.init_conds(service,service["healthchecks"][key]),
+                                    checks.compile_conds(checks.init_conds(service,service["healthchecks"][key])),
                                     checks.get_message_factory(service,None),
                                     prtgdata_map,
                                     None
                                 ]
                             else:
                                 service["healthchecks"][key] = [
-                                    checks.init_conds(service,service["healthchecks"][key].get("condition")),
+                                    checks.compile_conds(checks.init_conds(service,service["healthchecks"][key].get("condition"))),
                                     checks.get_message_factory(service,service["healthchecks"][key].get('message')),
                                     prtgdata_map,
                                     checks.init_transforms(service["healthchecks"][key].get("transforms")) if service["healthchecks"][key].get("transforms") else None
@@ -1887,14 +3454,14 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
                         else:
                             if isinstance(service["healthchecks"][key],(list,tuple)):
                                 service["healthchecks"][key] = [
-                                    checks.init_conds(service,service["healthchecks"][key]),
+                                    checks.compile_conds(checks.init_conds(service,service["healthchecks"][key])),
                                     checks.get_message_factory(service,None),
                                     None,
                                     None
                                 ]
                             else:
                                 service["healthchecks"][key] = [
-                                    checks.init_conds(service,service["healthchecks"][key].get("condition")),
+                                    checks.compile_conds(checks.init_conds(service,service["healthchecks"][key].get("condition"))),
                                     checks.get_message_factory(service,service["healthchecks"][key].get('message')),
                                     None,
                                     checks.init_transforms(service["healthchecks"][key].get("transforms")) if service["healthchecks"][key].get("transforms") else None
@@ -1934,7 +3501,7 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
 
     def _schedule_continuous_check(self,taskcls,*args):
         shutdown.unregister_scheduled_task(self._continuous_check_task)
-        asyncio.create_task(self._continuous_check(taskcls,*args))
+        self._continuous_check_task = asyncio.create_task(self._continuous_check(taskcls,*args))
 
     def stop_continuous_check(self):
         if not self._continuous_check_task:
@@ -1944,6 +3511,8 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
         shutdown.unregister_scheduled_task(self._continuous_check_task)
         self._continuous_check_task.cancel()
         self._continuous_check_task = None
+        self._scheduler.reset()
+        dispatcher.discard(self)
         logger.debug("{}: Stop continuous health check".format(self))
 
     async def _continuous_check(self,taskcls,*args):
@@ -1961,39 +3530,55 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
         tomorrow = today + timedelta(days=1)
         seconds_in_day = int((now - today).total_seconds())
 
-        self._next_runtime = None
-        for section in self.sections.values():
-            if not section.enabled:
+        dispatcher.cancel_overdue()
+
+        if self._scheduler.is_outdated(self.sections):
+            self._scheduler.rebuild(self.sections,now)
+
+        #only the due services are popped from the scheduler
+        #the due services with the same request signature are checked by one request
+        coalescedtasks = {}
+        for service in list(self._scheduler.pop_dues(now)):
+            next_checktime = service.get_nextchecktime(service["offset"],service.healthstatus_nextchecktime,now,today,tomorrow,seconds_in_day)
+            if next_checktime <= now:
+                #missed some checks, the next check should be scheduled after now
+                next_checktime = service.get_nextchecktime(service["offset"],now,now,today,tomorrow,seconds_in_day)
+            #check this service now
+            logger.debug("{} : Run a task to check the service({}.{}.lastchecktime = {}, next checktime={})  to task runner.".format(self,service.sectionid,service.serviceid,service.healthstatus_nextcheck,next_checktime))
+            service.healthstatus_nextchecktime = next_checktime
+            self._scheduler.push(service)
+            task = taskcls(service,*args)
+            if not dispatcher.accept(task):
                 continue
-            for service in section["services"].values():
-                if not service.enabled:
-                    continue
-                if now >= service.healthstatus_nextchecktime:
-                    #check this service now
-                    logger.debug("{} : Run a task to check the service({}.{}.lastchecktime = {}, next checktime={})  to task runner.".format(self,service.sectionid,service.serviceid,service.healthstatus_nextcheck,service.get_nextchecktime(service["offset"],service.healthstatus_nextchecktime,now,today,tomorrow,seconds_in_day)))
-                    task = taskcls(service,*args)
-                    asyncio.create_task(task.run())
-                    next_checktime = service.get_nextchecktime(service["offset"],service.healthstatus_nextchecktime,now,today,tomorrow,seconds_in_day)
-                    service.healthstatus_nextchecktime = next_checktime
+            signature = service.requestsignature if settings.HEALTHCHECK_COALESCE_REQUESTS else None
+            if signature:
+                tasks = coalescedtasks.get(signature)
+                if tasks:
+                    tasks.append(task)
                 else:
-                    next_checktime = service.healthstatus_nextchecktime
-                if not self._next_runtime or self._next_runtime > next_checktime:
-                    self._next_runtime = next_checktime
+                    coalescedtasks[signature] = [task]
+            else:
+                dispatcher.dispatch(task)
+
+        for tasks in coalescedtasks.values():
+            if len(tasks) == 1:
+                dispatcher.dispatch(tasks[0])
+            else:
+                logger.debug("{} : Check the services({}) with one request".format(self,",".join("{}.{}".format(t.servicehealthcheck.sectionid,t.servicehealthcheck.serviceid) for t in tasks)))
+                dispatcher.dispatch(CoalescedHealthCheckTask(tasks))
 
         if not self._continuous_check_task:
             #already stopped
             return
 
+        self._next_runtime = self._scheduler.next_checktime
         if not self._next_runtime:
             self._next_runtime = now + timedelta(seconds=30)
 
-        seconds = (self._next_runtime - utils.now()).total_seconds()
-        if seconds > 0:
-            logger.debug("Waiting {} seconds to begin the next batch of service health check.".format(seconds))
-            self._continous_check_task = asyncio.get_running_loop().call_later(seconds,self._schedule_continuous_check,taskcls,*args)
-            shutdown.register_scheduled_task(self._continuous_check_task)
-        else:
-            self._continuous_check_task = asyncio.create_task(self._continuous_check(taskcls,*args))
+        seconds = max((self._next_runtime - utils.now()).total_seconds(),0)
+        logger.debug("Waiting {} seconds to begin the next batch of service health check.".format(seconds))
+        self._continuous_check_task = asyncio.get_running_loop().call_later(seconds,self._schedule_continuous_check,taskcls,*args)
+        shutdown.register_scheduled_task(self._continuous_check_task)
 
     @property
     def is_continuous_check_started(self):
@@ -2007,6 +3592,7 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
             logger.info("{}: The continuous health checking is already started.".format(self))
             return 
         logger.info("{}: Start to run the continuous health checking".format(self))
+        self._scheduler.reset()
         self._continuous_check_task = asyncio.create_task(self._continuous_check(taskcls,*args))
 
 
@@ -2016,6 +3602,7 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
         Return [traffic light, msgs,prtg data]
         """
         healthstatus = None
+        res = CachedResponse.wrap(res)
         messages = [] if settings.HEALTHCHECK_CONDITION_VERBOSE else None
         for key in ("green","yellow","red","error"):
             if key not in serviceconfig["healthchecks"]:
@@ -2030,7 +3617,7 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
                     for transform in transforms:
                         res = transform(res)
 
-                checkresult =  checks.check(res,checkconditions,messages=messages)
+                checkresult =  checkconditions(res,messages=messages)
                 if checkresult:
                     checkmsg = get_checkmessage(res)
                     if serviceconfig["prtg"]:
@@ -2074,6 +3661,9 @@ class HealthCheck(PRTGMixin,JsonStatusMixin):
                 healthstatus = ["error","Status Code:{}, Message:{}".format(res.status_code,message),None]
             else:
                 healthstatus = ["error","All healthstatus configured in {} are not satisfied.".format(serviceconfig),None]
+
+        if settings.HEALTHCHECK_CONDITION_VERBOSE and isinstance(res,CachedResponse):
+            logger.info("{}: The response body is parsed once, cache hits: json={}, text={}".format(serviceconfig,res.json_hits,res.text_hits))
     
         return healthstatus
 
@@ -2332,10 +3922,19 @@ class SectionHealthCheckPRTGSensor(object):
 
 
 class HealthCheckView(PRTGMixin,JsonStatusMixin):
-    def __init__(self,healthcheck,viewmeta,viewsettings):
+    def __init__(self,healthcheck,viewmeta,viewsettings,viewid=None):
         self._healthcheck = healthcheck
         self._viewmeta = viewmeta
         self._viewsettings = viewsettings
+        self._viewid = viewid
+
+    @property
+    def cachekey(self):
+        return self._viewid if self._viewsettings else None
+
+    @property
+    def viewsettings(self):
+        return self._viewsettings if self._viewsettings else None
 
     @property
     def title(self):
@@ -2357,6 +3956,14 @@ class HealthCheckPRTGSensor(PRTGMixin,JsonStatusMixin):
         self._sensormeta = sensormeta
         self._sensorsettings = sensorsettings
 
+    @property
+    def cachekey(self):
+        return "prtgsensor:{}".format(self._sensormeta.id)
+
+    @property
+    def viewsettings(self):
+        return self._sensorsettings
+
     @property
     def title(self):
         return self._sensormeta.title if self._sensormeta else ""
@@ -2970,7 +4577,7 @@ class ReleasedHealthCheck(HealthCheck):
             return self
         viewmeta = self.get_viewmeta(viewid)
         viewsettings = self.get_viewsettings(viewid)
-        return HealthCheckView(self,viewmeta,viewsettings)
+        return HealthCheckView(self,viewmeta,viewsettings,viewid)
 
     def get_prtgsensor(self,sensorid):
         if not sensorid:
@@ -10,7 +10,7 @@ import httpx
 
 from status import app,application
 from . import settings
-from .healthcheckclient import healthstatuslistener,editinghealthstatuslistener
+from .healthcheckclient import healthstatuslistener,editinghealthstatuslistener,dump_message
 from .healthcheck import healthcheck,LastHealthCheck,SystemViewMeta,PRTGSensorMeta
 from .socket import commandclient
 from . import shutdown
@@ -49,11 +49,45 @@ def exithandler():
     healthstatuslistener.request2close()
     editinghealthstatuslistener.request2close()
 
+def get_subscribed_keys():
+    """
+    Return the set of (sectionid,serviceid) in the subscribed system views; None if all the services should be subscribed
+    """
+    if not settings.HEALTHSTATUS_SUBSCRIBED_VIEWS:
+        return None
+    keys = set()
+    for viewkey in settings.HEALTHSTATUS_SUBSCRIBED_VIEWS:
+        viewsettings = healthcheck.get_viewsettings(viewkey)
+        if not viewsettings:
+            #the view is not customized, include all the services
+            return None
+        for sectionid,serviceids in viewsettings.items():
+            keys.update((sectionid,serviceid) for serviceid in serviceids)
+    return keys
+
+def is_subscribed(viewsettings):
+    """
+    viewsettings: {sectionid:serviceids} of a view or a prtg sensor; None or empty means all the services
+    Return True if the healthstatus of all the services in the view are subscribed from the healthcheck server; otherwise the view would show stale healthstatus
+    """
+    if not settings.HEALTHSTATUS_SUBSCRIBED_VIEWS:
+        return True
+    keys = get_subscribed_keys()
+    if keys is None:
+        return True
+    elif not viewsettings:
+        return False
+    return all((sectionid,serviceid) in keys for sectionid,serviceids in viewsettings.items() for serviceid in serviceids)
+
+def not_subscribed(viewkey):
+    return "The healthstatus of the view({}) is not subscribed by this app, only the views({}) are served".format(viewkey or "Default",",".join(settings.HEALTHSTATUS_SUBSCRIBED_VIEWS)),409
+
 @app.before_serving
 async def initialize():
     loop = asyncio.get_running_loop()
     for signal in [SIGINT, SIGTERM]:
         loop.add_signal_handler(signal, exithandler)
+    await healthstatuslistener.subscribe(get_subscribed_keys())
     healthstatuslistener.start()
     editinghealthstatuslistener.start()
 
@@ -233,6 +267,8 @@ async def dashboard(system):
     else:
         healthcheckview = healthcheck
 
+    if not is_subscribed(healthcheckview.viewsettings if viewkey else None):
+        return not_subscribed(viewkey)
 
     return await render_template("healthcheck/dashboard.html",healthcheck=healthcheckview,healthservice_nextcheck=healthservice_nextcheck,nextcheck_timeout_delay=settings.NEXTCHECK_TIMEOUT_DELAY,nextcheck_checkinterval=settings.NEXTCHECK_CHECKINTERVAL,baseurl="/healthcheck",statusstreamurl=statusstreamurl,adminable=adminable,heartbeat=settings.HEARTBEAT,user=user,system=system)
 
@@ -244,39 +280,29 @@ async def reload_dashboard():
     except Exception as ex:
         return "Failed to reload the dashboard.{}".format(str(ex)), 500
 
-def dump_servicehealthstatus(sectionid,serviceid,healthstatus):
-    return '[[\"{}\",\"{}\"],[{},[{},{},\"{}\",{},{}]]]\n'.format(
-        sectionid,
-        serviceid,
-        healthstatus[0].strftime("\"%Y-%m-%dT%H:%M:%S.%f\"") if healthstatus[0] else "null",
-        healthstatus[1][0].strftime("\"%Y-%m-%dT%H:%M:%S.%f\"") if healthstatus[1] and healthstatus[1][0] else "null",
-        healthstatus[1][1].strftime("\"%Y-%m-%dT%H:%M:%S.%f\"") if healthstatus[1] and healthstatus[1][1] else "null",
-        healthstatus[1][2] if healthstatus[1] else "" ,
-        json.dumps(healthstatus[1][3] if healthstatus[1] else ""),
-        "true" if healthstatus[1] and healthstatus[1][-1] else "false"
-    )
-
 @app.route("/healthcheck/healthstatusstream",defaults={'system': None})
 @app.route("/healthcheck/healthstatusstream/<system>")
 async def healthstatusstream(system):
     viewkey = system or request.headers.get("X-email")
     viewsettings = healthcheck.get_viewsettings(viewkey)
+    if settings.HEALTHSTATUS_SUBSCRIBED_VIEWS:
+        #the subscribed views may be customized by other app workers
+        await healthstatuslistener.subscribe(get_subscribed_keys())
+        if not is_subscribed(viewsettings):
+            return not_subscribed(viewkey)
 
     @stream_with_context
     async def async_generator():
         for section in healthcheck.healthchecksections:
             for service in section.healthcheckservices:
                 if service.healthstatus:
-                    yield dump_servicehealthstatus(section.sectionid,service.serviceid,service.healthstatus).encode()
+                    yield healthstatuslistener.get_encoded_healthstatus(section.sectionid,service.serviceid,service.healthstatus)
 
         reader = healthstatuslistener.get_healthstatusreader()
         while not shutdown.shutdowning:
             await healthstatuslistener.wait()
-            for healthstatus in reader.items():
-                if isinstance(healthstatus,str):
-                    yield "{}\n".format(json.dumps(healthstatus,cls=serializers.JSONFormater)).encode()
-                else:
-                    yield dump_servicehealthstatus(*healthstatus[0],healthstatus[1]).encode()
+            for healthstatus,data in reader.items():
+                yield data
 
     @stream_with_context
     async def async_generator_view():
@@ -284,21 +310,68 @@ async def healthstatusstream(system):
             serviceset = viewsettings.get(section.sectionid,set())
             for service in section.healthcheckservices:
                 if service.healthstatus and service.serviceid in serviceset:
-                    yield dump_servicehealthstatus(section.sectionid,service.serviceid,service.healthstatus).encode()
+                    yield healthstatuslistener.get_encoded_healthstatus(section.sectionid,service.serviceid,service.healthstatus)
 
         reader = healthstatuslistener.get_healthstatusreader()
         while not shutdown.shutdowning:
             await healthstatuslistener.wait()
-            for healthstatus in reader.items():
-                if isinstance(healthstatus,str):
-                    yield "{}\n".format(json.dumps(healthstatus,cls=serializers.JSONFormater)).encode()
-                elif healthstatus[0][1] in viewsettings.get(healthstatus[0][0],set()):
-                    yield dump_servicehealthstatus(*healthstatus[0],healthstatus[1]).encode()
+            for healthstatus,data in reader.items():
+                if isinstance(healthstatus,str) or healthstatus[0][1] in viewsettings.get(healthstatus[0][0],set()):
+                    yield data
 
     response = await make_response(async_generator_view() if viewsettings else async_generator())
     response.timeout = None  # Prevents Quart from killing the connection
     return response
 
+@app.route("/healthcheck/healthstatusevents",defaults={'system': None})
+@app.route("/healthcheck/healthstatusevents/<system>")
+async def healthstatusevents(system):
+    """
+    The server-sent events of the healthstatus, the event id is the position in the status list of the healthstatus listener.
+    A reconnected browser resumes from the position in the header 'Last-Event-ID' if the missed healthstatus are still kept in the status list;
+    otherwise the healthstatus of all the services are sent again
+    """
+    viewkey = system or request.headers.get("X-email")
+    viewsettings = healthcheck.get_viewsettings(viewkey)
+    if settings.HEALTHSTATUS_SUBSCRIBED_VIEWS:
+        #the subscribed views may be customized by other app workers
+        await healthstatuslistener.subscribe(get_subscribed_keys())
+        if not is_subscribed(viewsettings):
+            return not_subscribed(viewkey)
+    position = healthstatuslistener.parse_eventid(request.headers.get("Last-Event-ID"))
+
+    def is_viewed(sectionid,serviceid):
+        return not viewsettings or serviceid in viewsettings.get(sectionid,set())
+
+    @stream_with_context
+    async def async_generator():
+        nonlocal position
+        while not shutdown.shutdowning:
+            if position is None:
+                #send the healthstatus of all the services, and then the id of the current position
+                position = healthstatuslistener.position
+                for section in healthcheck.healthchecksections:
+                    for service in section.healthcheckservices:
+                        if service.healthstatus and is_viewed(section.sectionid,service.serviceid):
+                            yield b"".join((b"data: ",healthstatuslistener.get_encoded_healthstatus(section.sectionid,service.serviceid,service.healthstatus),b"\n"))
+                yield "id: {}\n\n".format(healthstatuslistener.get_eventid(position)).encode()
+
+            items = healthstatuslistener.get_items_from(position)
+            if items is None:
+                #some of the healthstatus are overwritten before they are sent
+                position = None
+                continue
+            for healthstatus,data in items:
+                position += 1
+                if isinstance(healthstatus,str) or is_viewed(*healthstatus[0]):
+                    yield b"".join((b"id: ",healthstatuslistener.get_eventid(position).encode(),b"\ndata: ",data,b"\n"))
+            if position == healthstatuslistener.position:
+                await healthstatuslistener.wait()
+
+    response = await make_response(async_generator(),200,{"Content-Type":"text/event-stream","Cache-Control":"no-cache","X-Accel-Buffering":"no"})
+    response.timeout = None  # Prevents Quart from killing the connection
+    return response
+
 @app.route("/healthcheck/customize",defaults={'system': None},methods=["GET","POST"])
 @app.route("/healthcheck/config/view/<system>",methods=["GET","POST"])
 async def customize_dashboard(system):
@@ -396,6 +469,16 @@ async def customize_prtgsensor(sensorid):
             msg = str(ex)
         return redirect("/healthcheck")
 
+def get_historylimit():
+    """
+    Return the maximum number of the latest records shown in a history page from the request parameter 'limit'; return None to show all the records
+    """
+    try:
+        limit = int(request.args.get("limit"))
+        return limit if limit > 0 else None
+    except:
+        return None
+
 @app.route("/healthcheck/history/<sectionid>/<serviceid>",defaults={'pageid': ""})
 @app.route("/healthcheck/history/<sectionid>/<serviceid>/<pageid>")
 async def healthcheckhistory(sectionid,serviceid,pageid):
@@ -424,7 +507,7 @@ async def healthcheckhistory(sectionid,serviceid,pageid):
         service.healthcheckpages.reset()
         return redirect("/healthcheck/history/{}/{}".format(sectionid,serviceid))
 
-    return await render_template("healthcheck/healthcheckhistory.html",service=service,pages=reversed(pages),page=page,baseurl="/healthcheck",history="history",title="Health Check Histories")
+    return await render_template("healthcheck/healthcheckhistory.html",service=service,pages=reversed(pages),page=page,baseurl="/healthcheck",history="history",title="Health Check Histories",limit=get_historylimit())
 
 @app.route("/healthcheck/errorhistory/<sectionid>/<serviceid>",defaults={'pageid': ""})
 @app.route("/healthcheck/errorhistory/<sectionid>/<serviceid>/<pageid>")
@@ -458,7 +541,7 @@ async def healthcheckerrorhistory(sectionid,serviceid,pageid):
         service.healthcheckpages.reset()
         return redirect("/healthcheck/errorhistory/{}/{}".format(sectionid,serviceid))
 
-    return await render_template("healthcheck/healthcheckhistory.html",service=service,pages=reversed(pages),page=page,baseurl="/healthcheck",history="errorhistory",title="Health Check Error Histories")
+    return await render_template("healthcheck/healthcheckhistory.html",service=service,pages=reversed(pages),page=page,baseurl="/healthcheck",history="errorhistory",title="Health Check Error Histories",limit=get_historylimit())
 
 @app.route("/healthcheck/details/<sectionid>/<serviceid>/<starttime>")
 async def healthcheckdetails(sectionid,serviceid,starttime):
@@ -629,7 +712,7 @@ async def editinghealthcheckhistory(sectionid,serviceid,pageid):
         service.healthcheckpages.reset()
         return redirect("/healthcheck/config/history/{}/{}".format(sectionid,serviceid))
 
-    return await render_template("healthcheck/healthcheckhistory.html",service=service,pages=reversed(pages),page=page,baseurl="/healthcheck/config",history="history")
+    return await render_template("healthcheck/healthcheckhistory.html",service=service,pages=reversed(pages),page=page,baseurl="/healthcheck/config",history="history",limit=get_historylimit())
 
 @app.route("/healthcheck/config/errorhistory/<sectionid>/<serviceid>",defaults={'pageid': ""})
 @app.route("/healthcheck/config/errorhistory/<sectionid>/<serviceid>/<pageid>")
@@ -665,7 +748,7 @@ async def editinghealthcheckerrorhistory(sectionid,serviceid,pageid):
         service.healthcheckpages.reset()
         return redirect("/healthcheck/config/errorhistory/{}/{}".format(sectionid,serviceid))
 
-    return await render_template("healthcheck/healthcheckhistory.html",service=service,pages=reversed(pages),page=page,baseurl="/healthcheck/config",history="errorhistory")
+    return await render_template("healthcheck/healthcheckhistory.html",service=service,pages=reversed(pages),page=page,baseurl="/healthcheck/config",history="errorhistory",limit=get_historylimit())
 
 @app.route("/healthcheck/config/details/<sectionid>/<serviceid>/<starttime>")
 async def editinghealthcheckdetails(sectionid,serviceid,starttime):
@@ -723,23 +806,41 @@ async def stop_preview_editing_healthcheck():
         return msg,400
 
 
+def cached_response(data,etag):
+    """
+    Return 304 if the client already has the data with the etag; otherwise return the json data
+    """
+    if request.if_none_match.contains_weak(etag.strip('"')):
+        return "",304,{"ETag":etag}
+    return data,200,{"Content-Type":"application/json","ETag":etag}
+
 @app.route("/healthcheck/json",defaults={'system': None})
 @app.route("/healthcheck/json/<system>")
 def jsonstatus(system):
     viewkey = system or request.headers.get("X-email")
     details = request.args.get("details") or ""
-    return healthcheck.get_view(viewkey).get_jsonstatus(details.lower() == "true"),200,{"Content-Type":"application/json"}
+    healthcheckview = healthcheck.get_view(viewkey)
+    if not is_subscribed(healthcheckview.viewsettings if viewkey else None):
+        return not_subscribed(viewkey)
+    return cached_response(*healthcheckview.get_cached_jsonstatus(details.lower() == "true"))
 
 @app.route("/healthcheck/prtg/<sensorid>")
 def prtg(sensorid):
     #frist to try prtg sensor
     try:
-        return healthcheck.get_prtgsensor(sensorid).get_prtgdata(),200,{"Content-Type":"application/json"}
+        prtgsensor = healthcheck.get_prtgsensor(sensorid)
     except:
-        #second to try health checkview
-        if healthcheck.get_viewmeta(sensorid):
-            healthcheckview = healthcheck.get_view(sensorid)
-            return healthcheckview.get_prtgdata(),200,{"Content-Type":"application/json"}
+        prtgsensor = None
+    if prtgsensor:
+        if not is_subscribed(healthcheck.get_prtgsensorsettings(sensorid)):
+            return not_subscribed(sensorid)
+        return cached_response(*prtgsensor.get_cached_prtgdata())
+    #second to try health checkview
+    if healthcheck.get_viewmeta(sensorid):
+        healthcheckview = healthcheck.get_view(sensorid)
+        if not is_subscribed(healthcheckview.viewsettings):
+            return not_subscribed(sensorid)
+        return cached_response(*healthcheckview.get_cached_prtgdata())
     return "PRTG Sensor({}) Not Found".format(sensorid),404
 
 @app.route("/healthcheck/config/healthstatusstream")
@@ -752,22 +853,19 @@ async def editinghealthstatusstream():
     async def async_generator():
         for section in healthcheck.editing_healthcheck.healthchecksections:
             for service in section.healthcheckservices:
-                yield dump_servicehealthstatus(section.sectionid,service.serviceid,service.healthstatus).encode()
+                yield editinghealthstatuslistener.get_encoded_healthstatus(section.sectionid,service.serviceid,service.healthstatus)
 
         if editinghealthstatuslistener.continuouscheck_started:
-            yield "{}\n".format(json.dumps("continuouscheck_started")).encode()
+            yield dump_message("continuouscheck_started").encode()
         else:
-            yield "{}\n".format(json.dumps("continuouscheck_stopped")).encode()
+            yield dump_message("continuouscheck_stopped").encode()
 
         reader = editinghealthstatuslistener.get_healthstatusreader()
         while not shutdown.shutdowning:
             await editinghealthstatuslistener.wait()
 
-            for healthstatus in reader.items():
-                if isinstance(healthstatus,str):
-                    yield "{}\n".format(json.dumps(healthstatus,cls=serializers.JSONFormater)).encode()
-                else:
-                    yield dump_servicehealthstatus(*healthstatus[0],healthstatus[1]).encode()
+            for healthstatus,data in reader.items():
+                yield data
 
     response = await make_response(async_generator())
     response.timeout = None  # Prevents Quart from killing the connection
@@ -1,11 +1,14 @@
 import asyncio
 import logging
+import json
+import os
 
 from . import exceptions
 from . import shutdown
 from . import socket
 from .lists import CycleList
 from . import settings
+from . import serializers
 from .healthcheck import healthcheck
 from . import utils
 
@@ -49,13 +52,70 @@ class Event(object):
             self.locks[self.index][0].clear()
             self.locks[self.index][1] = 0
 
+def dump_servicehealthstatus(sectionid,serviceid,healthstatus):
+    return '[[\"{}\",\"{}\"],[{},[{},{},\"{}\",{},{}]]]\n'.format(
+        sectionid,
+        serviceid,
+        healthstatus[0].strftime("\"%Y-%m-%dT%H:%M:%S.%f\"") if healthstatus[0] else "null",
+        healthstatus[1][0].strftime("\"%Y-%m-%dT%H:%M:%S.%f\"") if healthstatus[1] and healthstatus[1][0] else "null",
+        healthstatus[1][1].strftime("\"%Y-%m-%dT%H:%M:%S.%f\"") if healthstatus[1] and healthstatus[1][1] else "null",
+        healthstatus[1][2] if healthstatus[1] else "" ,
+        json.dumps(healthstatus[1][3] if healthstatus[1] else ""),
+        "true" if healthstatus[1] and healthstatus[1][-1] else "false"
+    )
+
+def dump_message(message):
+    return "{}\n".format(json.dumps(message,cls=serializers.JSONFormater))
+
 class BaseHealthStatusListenerClient(socket.SocketClient):
+    """
+    The received healthstatus and messages are kept in a cycle list with their encoded lines,
+    so the line is encoded once and shared by all the streams reading the list
+    """
     def __init__(self,timeout):
         super().__init__(timeout = timeout)
+        #list of [healthstatus or message,encoded line]
         self._statuslist = CycleList(settings.HEALTHSTATUS_BUFFER)
+        #the encoded line of the current healthstatus of the services, key: (sectionid,serviceid), value: [healthstatus,encoded line]
+        self._encoded = {}
         self._healthstatus_task = None
         self._wait = Event()
         self.continuouscheck_started = False
+        #the stream id and the sequence of the last received frame, sent to the server to receive the missed frames after reconnecting
+        self._streamid = None
+        self._lastseq = None
+        #the subscribed services, None means all the services
+        self._keys = None
+        self._handshake_keys = None
+
+    @property
+    def handshake(self):
+        options = {}
+        if self._streamid is not None and self._lastseq is not None:
+            options["streamid"] = self._streamid
+            options["lastseq"] = self._lastseq
+        if self._keys is not None:
+            options["keys"] = self._keys
+        self._handshake_keys = self._keys
+        return [self.conn_type,options] if options else self.conn_type
+
+    async def subscribe(self,keys):
+        """
+        Only receive the healthstatus of the services in keys, the healthstatus of the other services are not updated anymore
+        keys: None to subscribe all the services; otherwise a collection of (sectionid,serviceid)
+        """
+        keys = None if keys is None else sorted(set(tuple(k) for k in keys))
+        if keys == self._keys:
+            return
+        self._keys = keys
+        if self._conn:
+            try:
+                await self._conn.send([socket.HEALTHSTATUS_SUBSCRIBE,keys])
+                return
+            except Exception as ex:
+                logger.error("{}: Failed to send the subscribed services.{}: {}".format(self,ex.__class__.__name__,str(ex)))
+        #the subscribed services are sent when connecting, ask for a snapshot because the missed frames of the newly subscribed services are not resent
+        self._lastseq = None
 
     async def wait(self):
         """
@@ -66,7 +126,7 @@ class BaseHealthStatusListenerClient(socket.SocketClient):
     async def close(self):
         await super().close()
         if self.continuouscheck_started:
-            self._statuslist.add("continuouscheck_stopped")
+            self._add("continuouscheck_stopped")
             self.continuouscheck_started = False
             self._wait.set()
 
@@ -79,7 +139,70 @@ class BaseHealthStatusListenerClient(socket.SocketClient):
 
         self._healthstatus_task = None
 
+    def _add(self,data):
+        """
+        Add the healthstatus([[sectionid,serviceid],healthstatus]) or the message to the status list with its encoded line
+        """
+        if isinstance(data,str):
+            self._statuslist.add([data,dump_message(data).encode()])
+        else:
+            encoded = dump_servicehealthstatus(*data[0],data[1]).encode()
+            self._encoded[tuple(data[0])] = [data[1],encoded]
+            self._statuslist.add([data,encoded])
+
+    def get_encoded_healthstatus(self,sectionid,serviceid,healthstatus):
+        """
+        Return the encoded line of the healthstatus of the service, the line is shared if the healthstatus was received by the listener
+        """
+        data = self._encoded.get((sectionid,serviceid))
+        if data and data[0] is healthstatus:
+            return data[1]
+        encoded = dump_servicehealthstatus(sectionid,serviceid,healthstatus).encode()
+        self._encoded[(sectionid,serviceid)] = [healthstatus,encoded]
+        return encoded
+
+    @property
+    def position(self):
+        """
+        The number of the items added to the status list
+        """
+        return self._statuslist.totalsize
+
+    def get_eventid(self,position):
+        """
+        Return the event id of the position in the status list, which is unique across the app workers and restarts
+        """
+        return "{}-{}-{}".format(os.getpid(),self._statuslist.id,position)
+
+    def parse_eventid(self,eventid):
+        """
+        Return the position of the event id if it was issued by this listener and the items after it are still kept in the status list; otherwise return None
+        """
+        if not eventid:
+            return None
+        try:
+            prefix,position = eventid.rsplit("-",1)
+            position = int(position)
+        except Exception as ex:
+            return None
+        if prefix != "{}-{}".format(os.getpid(),self._statuslist.id):
+            return None
+        if position != self._statuslist.totalsize and not self._statuslist.contains(position):
+            return None
+        return position
+
+    def get_items_from(self,position):
+        """
+        Return the list of the items([healthstatus or message,encoded line]) added after the position; None if some of them are not kept anymore
+        """
+        if position != self._statuslist.totalsize and not self._statuslist.contains(position):
+            return None
+        return list(self._statuslist.items_from(position))
+
     def get_healthstatusreader(self,startindex=None):
+        """
+        Return the reader of the status list, the items are [healthstatus or message,encoded line]
+        """
         if startindex is None:
             startindex = self._statuslist.index
         return self._statuslist.get_reader(startindex)
@@ -91,12 +214,17 @@ class BaseHealthStatusListenerClient(socket.SocketClient):
                 try:
                     data = None
                     status_code = None
-                    status_code,data = await self.receive(-1)
+                    frame = await self.receive(-1)
+                    status_code,data = frame[0],frame[1]
+                    if len(frame) > 2 and (self._lastseq is None or frame[2] > self._lastseq):
+                        #keep the greatest received sequence
+                        self._lastseq = frame[2]
                     #logger.error("Receiving health status data: code={}, data={}".format(status_code,data))
                     if status_code == socket.HEALTHCONFIG_HAHSCODE:
                         if self.healthcheck.config_hashcode != data:
                             self.healthcheck.reload()
-                            self._statuslist.add("reload")
+                            self._encoded.clear()
+                            self._add("reload")
                             self._wait.set()
                     elif status_code == socket.INITIAL_HEALTHSTATUS:
                         service = self.healthcheck.get_service(*data[0])
@@ -108,8 +236,33 @@ class BaseHealthStatusListenerClient(socket.SocketClient):
                         else:
                             logger.error("The service({}.{}) doesn't exist".format(*data[0]))
                             continue
-                        self._statuslist.add(data)
+                        self._add(data)
                         self._wait.set()
+                    elif status_code == socket.HEALTHSTATUS_STREAM:
+                        if self._streamid != data[0]:
+                            #connected to a new stream
+                            self._streamid = data[0]
+                            self._lastseq = None
+                        if self._handshake_keys != self._keys:
+                            #the subscribed services were changed during connecting
+                            await self.send([socket.HEALTHSTATUS_SUBSCRIBE,self._keys],0)
+                            self._handshake_keys = self._keys
+                    elif status_code == socket.HEALTHSTATUS_SNAPSHOT:
+                        #apply the healthstatus of all the services without waiting, and then wake up the waiting clients once
+                        changed = False
+                        for servicekey,healthstatus in data:
+                            service = self.healthcheck.get_service(*servicekey)
+                            if not service:
+                                logger.error("The service({}.{}) doesn't exist".format(*servicekey))
+                                continue
+                            if service.healthstatus and service.healthstatus[0] == healthstatus[0]:
+                                #status is not changed
+                                continue
+                            service.healthstatus = healthstatus
+                            self._add([servicekey,healthstatus])
+                            changed = True
+                        if changed:
+                            self._wait.set()
                     elif status_code == socket.HEALTHSTATUS:
                         service = self.healthcheck.get_service(*data[0])
                         if service:
@@ -117,17 +270,17 @@ class BaseHealthStatusListenerClient(socket.SocketClient):
                         else:
                             logger.error("The service({}.{}) doesn't exist".format(*data[0]))
                             continue
-                        self._statuslist.add(data)
+                        self._add(data)
                         self._wait.set()
                     elif status_code == socket.RELOAD_DASHBOARD:
-                        self._statuslist.add("reload")
+                        self._add("reload")
                         self._wait.set()
                     elif status_code == socket.CONTINUOUSCHECK_STARTED:
-                        self._statuslist.add("continuouscheck_started")
+                        self._add("continuouscheck_started")
                         self.continuouscheck_started = True
                         self._wait.set()
                     elif status_code == socket.CONTINUOUSCHECK_STOPPED:
-                        self._statuslist.add("continuouscheck_stopped")
+                        self._add("continuouscheck_stopped")
                         self.continuouscheck_started = False
                         self._wait.set()
                     elif status_code < 0:
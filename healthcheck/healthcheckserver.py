@@ -1,29 +1,123 @@
+import abc
 import logging
 import socket as builtinsocket
 import asyncio
 import threading
 import sys
 import os
+from collections import deque
 
 from . import shutdown
 from . import settings
 from .healthcheck import BaseServiceHealthCheckTask,healthcheck
+from .clientpool import clientpool
+from .scheduler import dispatcher
+from .writer import writer
+from .lists import CycleList
 from . import socket
 from . import exceptions
 from . import utils
 
 logger = logging.getLogger("healthcheck.healthcheckserver")
 
-class BaseHealthStatusSubscriptor(socket.Connection):
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+
+#the key of the queued snapshot, which is replaced by the next coalesced snapshot
+SNAPSHOT = "snapshot"
+
+class BaseHealthStatusSubscriptor(socket.Connection,abc.ABC):
+    """
+    The data is put into the bounded queue of the subscriptor and sent by the sender task of the subscriptor,
+    so a slow subscriptor never blocks the broadcast and the other subscriptors.
+    The overflow policy is applied if the queue is full.
+    Each broadcasted frame is stamped with a sequence number and kept in a cycle list, 
+    a reconnected subscriptor receives the frames it missed, or a snapshot if the missed frames are not kept anymore.
+    A subscriptor can subscribe a set of services by the option 'keys' or a HEALTHSTATUS_SUBSCRIBE frame, 
+    only the healthstatus of the subscribed services are sent to it, the other frames are sent to all subscriptors.
+    """
     subscriptors = None
-    _lock = None
-    def __init__(self,server,clientaddr,reader,writer):
+    #the recent broadcasted frames, the sequence of a frame is the number of the frames broadcasted before it plus 1
+    _frames = None
+    _streamid = None
+    def __init__(self,server,clientaddr,reader,writer,queuesize=settings.HEALTHSTATUS_SUBSCRIPTOR_QUEUESIZE,overflow=settings.HEALTHSTATUS_SUBSCRIPTOR_OVERFLOW):
         super().__init__(server,clientaddr,reader,writer)
+        self.queuesize = queuesize
+        self.overflow = overflow
+        #list of [service key,encoded data], the service key is None if the data is not a healthstatus, SNAPSHOT if the data is a snapshot
+        self._queue = deque()
+        self._ready = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
         self._send_task = None
-        self.__class__.subscriptors.append(self)
+        #statistics
+        self._sent = 0
+        self._max_queuedepth = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._replayed = None
+        #the subscribed services, None means all the services
+        self.keys = None
+        self._receive_task = None
+
+    @property
+    @abc.abstractmethod
+    def healthcheck(self):
+        """
+        The healthcheck whose healthstatus are sent to the subscriptor
+        """
+        pass
 
-    async def receive(self):
-        raise Exception("Receiving data Not Supported")
+    def subscribe(self,keys):
+        """
+        keys: None to subscribe all the services; otherwise the list of [sectionid,serviceid]
+        Return the set of the newly subscribed services, None if all the services are subscribed
+        """
+        oldkeys = self.keys
+        self.keys = None if keys is None else set(tuple(k) for k in keys)
+        if self.keys is None:
+            return None
+        return self.keys if oldkeys is None else self.keys - oldkeys
+
+    def is_subscribed(self,key):
+        return self.keys is None or key in self.keys
+
+    def start(self):
+        """
+        Start the sender task and the task to receive the subscribe frames, called after the initial data is sent
+        """
+        if not self._send_task:
+            self._send_task = asyncio.create_task(self._send_queued())
+        if not self._receive_task:
+            self._receive_task = asyncio.create_task(self._receive_subscriptions())
+
+    async def _receive_subscriptions(self):
+        """
+        Receive the HEALTHSTATUS_SUBSCRIBE frames from the subscriber, and queue a snapshot of the newly subscribed services
+        """
+        try:
+            while True:
+                data = await self.receive()
+                if not isinstance(data,(list,tuple)) or len(data) < 2 or data[0] != socket.HEALTHSTATUS_SUBSCRIBE:
+                    logger.error("{}: The data({}) Not Support".format(self,data))
+                    continue
+                keys = self.subscribe(data[1])
+                logger.debug("{}: Subscribe {} services".format(self,"all" if self.keys is None else len(self.keys)))
+                if keys is None or keys:
+                    self.put(self.encode([socket.HEALTHSTATUS_SNAPSHOT,self.get_snapshot(self.healthcheck,keys),self.__class__._frames.totalsize]),SNAPSHOT)
+        except exceptions.ConnectionClosed as ex:
+            pass
+        except exceptions.SystemShutdown as ex:
+            pass
+        except asyncio.CancelledError as ex:
+            raise
+        except Exception as ex:
+            logger.error("{}: Failed to receive the subscriptions.{}: {}".format(self,ex.__class__.__name__,str(ex)))
+        finally:
+            if self._receive_task is asyncio.current_task():
+                self._receive_task = None
+                await self.close()
 
     async def close(self):
         await super().close()
@@ -31,38 +125,171 @@ class BaseHealthStatusSubscriptor(socket.Connection):
             self.__class__.subscriptors.remove(self)
         except ValueError as ex:
             pass
-
-    @classmethod
-    async def _send_data(cls,data):
+        self._queue.clear()
+        self._idle.set()
+        if self._send_task and self._send_task is not asyncio.current_task():
+            self._send_task.cancel()
+        self._send_task = None
+        if self._receive_task and self._receive_task is not asyncio.current_task():
+            self._receive_task.cancel()
+        self._receive_task = None
+
+    def put(self,data,key=None):
+        """
+        Put the encoded data into the queue
+        key: the service key (sectionid,serviceid) if the data is a healthstatus
+        """
+        if not self.writer or self.writer.is_closing():
+            #already closed
+            return
+        if len(self._queue) >= self.queuesize and not self._overflow(data,key):
+            return
+        self._queue.append([key,data])
+        if len(self._queue) > self._max_queuedepth:
+            self._max_queuedepth = len(self._queue)
+        self._idle.clear()
+        self._ready.set()
+
+    def _overflow(self,data,key):
+        """
+        Apply the overflow policy when the queue is full
+        Return True if the data should be put into the queue; otherwise return False
+        """
+        if self.overflow == DISCONNECT:
+            logger.warning("{}: The send queue is full({}), close the connection".format(self,self.queuesize))
+            #abort the connection, the buffered data can't be sent to a stalled subscriptor
+            self.writer.transport.abort()
+            asyncio.create_task(self.close())
+            return False
+        if self.overflow == COALESCE and key:
+            #replace all the queued healthstatus with a snapshot of the subscribed services.
+            #the snapshot is stamped with the latest sequence and sent after the other queued frames, 
+            #so the subscriber never resumes from a sequence greater than the frames which are not sent.
+            queue = deque(item for item in self._queue if not item[0])
+            self._coalesced += len(self._queue) - len(queue) + 1
+            self._queue = queue
+            self._queue.append([SNAPSHOT,self.encode([socket.HEALTHSTATUS_SNAPSHOT,self.get_snapshot(self.healthcheck,self.keys),self.__class__._frames.totalsize])])
+            if len(self._queue) > self.queuesize:
+                self._queue.popleft()
+                self._dropped += 1
+            return False
+        #drop the oldest data
+        self._queue.popleft()
+        self._dropped += 1
+        if self._dropped == 1 or self._dropped % 1000 == 0:
+            logger.warning("{}: The send queue is full({}), {} data have been dropped".format(self,self.queuesize,self._dropped))
+        return True
+
+    async def _send_queued(self):
         try:
-            async with cls._lock:
-                for index in range(len(cls.subscriptors) - 1,-1,-1):
-                    try:
-                        subscriptor = cls.subscriptors[index]
-                    except IndexError as ex:
-                        continue
-                    subscriptor._send_task = asyncio.create_task(subscriptor.send(data))
-    
-                for index in range(len(cls.subscriptors) - 1,-1,-1):
-                    try:
-                        subscriptor = cls.subscriptors[index]
-                        if subscriptor._send_task:
-                            try:
-                                await subscriptor._send_task
-                            finally:
-                                subscriptor._send_task = None
-                    except IndexError as ex:
-                        continue
+            while True:
+                if not self._queue:
+                    self._idle.set()
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                item = self._queue.popleft()
+                await self.send_bytes(item[1])
+                self._sent += 1
         except exceptions.ConnectionClosed as ex:
             pass
+        except exceptions.SystemShutdown as ex:
+            pass
+        except asyncio.CancelledError as ex:
+            raise
+        except Exception as ex:
+            logger.error("{}: Failed to send the queued data.{}: {}".format(self,ex.__class__.__name__,str(ex)))
+        finally:
+            self._idle.set()
+            if self._send_task is asyncio.current_task():
+                self._send_task = None
+                await self.close()
+
+    async def flush(self):
+        """
+        Wait until all the queued data are sent
+        """
+        await self._idle.wait()
+
+    @property
+    def stats(self):
+        return {
+            "subscriptor":str(self),
+            "queuedepth":len(self._queue),
+            "max_queuedepth":self._max_queuedepth,
+            "sent":self._sent,
+            "dropped":self._dropped,
+            "coalesced":self._coalesced,
+            "replayed":self._replayed,
+            "subscribed":"all" if self.keys is None else len(self.keys)
+        }
+
+    @classmethod
+    def get_streamid(cls):
+        """
+        The id of the frame stream, the sequence numbers are only meaningful in the same stream
+        """
+        if not cls._streamid:
+            cls._streamid = "{}-{}".format(os.getpid(),cls._frames.id)
+        return cls._streamid
+
+    async def send_initial_healthstatus(self,healthcheck):
+        """
+        Send the config hashcode and the stream id, and then
+        resend the missed frames if the subscriptor is reconnected to the same stream and all the missed frames are still kept; 
+        otherwise send a snapshot of the healthstatus of all the services.
+        The initial frames are prepared and the subscriptor is registered without any await in between, 
+        the frames broadcasted later are queued and sent after the initial frames, so no frame is missed, duplicated or out of order.
+        """
+        cls = self.__class__
+        seq = cls._frames.totalsize
+        options = self.options or {}
+        if "keys" in options:
+            self.subscribe(options["keys"])
+        frames = [
+            self.encode([socket.HEALTHCONFIG_HAHSCODE,healthcheck.config_hashcode]),
+            self.encode([socket.HEALTHSTATUS_STREAM,[cls.get_streamid(),seq]])
+        ]
+        lastseq = options.get("lastseq")
+        if options.get("streamid") == cls.get_streamid() and isinstance(lastseq,int) and (lastseq == seq or cls._frames.contains(lastseq)):
+            missed = [data for key,data in cls._frames.items_from(lastseq,seq) if not key or self.is_subscribed(key)]
+            self._replayed = len(missed)
+            frames.extend(missed)
+            logger.debug("{}: Resend {} missed frames after the sequence {}".format(self,len(missed),lastseq))
+        else:
+            frames.append(self.encode([socket.HEALTHSTATUS_SNAPSHOT,self.get_snapshot(healthcheck,self.keys),seq]))
+        cls.subscriptors.append(self)
+
+        for data in frames:
+            await self.send_bytes(data)
+
+    @staticmethod
+    def get_snapshot(healthcheck,keys=None):
+        """
+        keys: only include the services in keys if not None
+        Return the healthstatus of all the services which have a healthstatus, sent in one frame
+        """
+        return [[[service.sectionid,service.serviceid],service["healthstatus"]] for section in healthcheck.sections.values() for service in section["services"].values() if service.get("healthstatus") and (keys is None or (service.sectionid,service.serviceid) in keys)]
+
+    @classmethod
+    async def _send_data(cls,data,key=None):
+        """
+        Stamp the data with the next sequence, encode it once and put it into the queues of the subscriptors which subscribe the service, never wait for the subscriptors
+        The frame is kept even if no subscriptor is connected, a subscriptor can reconnect and ask for it
+        key: the service key (sectionid,serviceid) if the data is a healthstatus; None if the data should be sent to all the subscriptors
+        """
+        try:
+            data = socket.Connection.encode([*data,cls._frames.totalsize + 1])
         except Exception as ex:
-            if not shutdown.shutdowning:
-                raise ex
-            
+            raise exceptions.MalformedData("{}: Failed to encode the data.{}: {}".format(cls.__name__,ex.__class__.__name__,str(ex)))
+        cls._frames.add((key,data))
+        for subscriptor in list(cls.subscriptors):
+            if not key or subscriptor.is_subscribed(key):
+                subscriptor.put(data,key)
 
     @classmethod
     async def send_healthstatus(cls,data):
-        await cls._send_data([socket.HEALTHSTATUS,data])
+        await cls._send_data([socket.HEALTHSTATUS,data],tuple(data[0]))
     
     @classmethod
     async def reload_dashboard(cls):
@@ -79,15 +306,16 @@ class BaseHealthStatusSubscriptor(socket.Connection):
 
 class HealthStatusSubscriptor(BaseHealthStatusSubscriptor):
     subscriptors = []
-    _lock = asyncio.Lock()
+    _frames = CycleList(settings.HEALTHSTATUS_REPLAY_BUFFER)
     conn_type = socket.HEALTHSTATUS_SUBSCRIPTOR
 
+    @property
+    def healthcheck(self):
+        return healthcheck
+
     async def initialize(self):
-        await self.send([socket.HEALTHCONFIG_HAHSCODE,healthcheck.config_hashcode])
-        for section in healthcheck.sections.values():
-            for service in section["services"].values():
-                if service.get("healthstatus"):
-                    await self.send([socket.INITIAL_HEALTHSTATUS,[[service.sectionid,service.serviceid],service["healthstatus"]]])
+        await self.send_initial_healthstatus(healthcheck)
+        self.start()
 
     @classmethod
     async def healthconfig_changed(cls):
@@ -96,16 +324,17 @@ class HealthStatusSubscriptor(BaseHealthStatusSubscriptor):
 
 class EditingHealthStatusSubscriptor(BaseHealthStatusSubscriptor):
     subscriptors = []
-    _lock = asyncio.Lock()
+    _frames = CycleList(settings.HEALTHSTATUS_REPLAY_BUFFER)
     conn_type = socket.EDITING_HEALTHSTATUS_SUBSCRIPTOR
 
+    @property
+    def healthcheck(self):
+        return healthcheck.editing_healthcheck
+
     async def initialize(self):
-        await self.send([socket.HEALTHCONFIG_HAHSCODE,healthcheck.editing_healthcheck.config_hashcode])
-        for section in healthcheck.editing_healthcheck.sections.values():
-            for service in section["services"].values():
-                if service.get("healthstatus"):
-                    await self.send([socket.INITIAL_HEALTHSTATUS,[[service.sectionid,service.serviceid],service["healthstatus"]]])
+        await self.send_initial_healthstatus(healthcheck.editing_healthcheck)
 
+        self.start()
         if healthcheck.editing_healthcheck.is_continuous_check_started:
             await self.continuouscheck_started()
         else:
@@ -169,6 +398,30 @@ class CommandConnection(socket.CommandConnection):
         await HealthStatusSubscriptor.reload_dashboard()
         return [True,"OK"]
 
+    def httpclients(self):
+        """
+        Return the statistics of the pooled http clients, include the connection reuse rate
+        """
+        return clientpool.stats
+
+    def dispatcher(self):
+        """
+        Return the statistics of the healthcheck task dispatcher, include the queue depth and the wait time
+        """
+        return dispatcher.stats
+
+    def writer(self):
+        """
+        Return the statistics of the healthstatus writer
+        """
+        return writer.stats
+
+    def subscriptors(self):
+        """
+        Return the statistics of the send queues of the healthstatus subscriptors
+        """
+        return [s.stats for s in HealthStatusSubscriptor.subscriptors + EditingHealthStatusSubscriptor.subscriptors]
+
     def healthcheck(self):
         if not healthcheck.is_continuous_check_started:
             return [False,"Continuous Health Check is not running"]
@@ -193,13 +446,32 @@ class HealthCheckServer(socket.SocketServer):
         lockfile = os.path.join(settings.HEALTHCHECK_DATA_DIR,".healthcheckserver.lock")
         if os.path.exists(lockfile):
             #shutdown the current server first
-            try:
-                with open(lockfile) as f:
-                    data = f.read().strip()
-                host,port = data.split(":",1)
-                port = int(port)
-                commandclient = socket.CommandClient(host,port)
-                await commandclient.exec("shutdown",0)
+            #the lock file contains one address per line, the unix domain socket is only reachable from the same host, try the next address if it is not reachable
+            with open(lockfile) as f:
+                data = f.read().strip()
+            for address in data.splitlines():
+                address = address.strip()
+                if not address:
+                    continue
+                try:
+                    if address.startswith("unix:"):
+                        commandclient = socket.CommandClient(path=address[5:])
+                    else:
+                        host,port = address.split(":",1)
+                        port = int(port)
+                        commandclient = socket.CommandClient(host,port,path=None)
+                    await commandclient.exec("shutdown",0)
+                except ConnectionRefusedError as ex:
+                    #The healthcheck server is not running or not reachable via this address
+                    continue
+                except asyncio.TimeoutError as ex:
+                    #The healthcheck server is not running or not reachable via this address
+                    continue
+                except OSError as ex:
+                    #The healthcheck server is not running or not reachable via this address
+                    continue
+                except Exception as ex:
+                    raise Exception("The lock file({0}) is corrupted. data={1}. {2}: {3}".format(lockfile,data,ex.__class__.__name__,str(ex)))
                 logger.info("Wait the current healthcheck server to shutdown...")
                 while True:
                     try:
@@ -209,20 +481,14 @@ class HealthCheckServer(socket.SocketServer):
                     except:
                         break
                 logger.info("The current healthcheck server has already shutdown")
-            except ConnectionRefusedError as ex:
-                #The healthcheck server is not running
-                pass
-            except asyncio.TimeoutError as ex:
-                #The healthcheck server is not running
-                pass
-            except OSError as ex:
-                #The healthcheck server is not running
-                pass
-            except Exception as ex:
-                raise Exception("The lock file({0}) is corrupted. data={1}. {2}: {3}".format(lockfile,data,ex.__class__.__name__,str(ex)))
+                break
 
+        addresses = []
+        if self.path:
+            #the unix domain socket can only be connected from the same host
+            addresses.append("unix:{}".format(os.path.abspath(self.path)))
         lockfile_ex = None
-        for url in ("8.8.8.8",settings.AUTH2_URL):
+        for url in (("8.8.8.8",settings.AUTH2_URL) if self.port else []):
             if not url:
                 continue
             s = None
@@ -230,8 +496,7 @@ class HealthCheckServer(socket.SocketServer):
                 s = builtinsocket.socket(builtinsocket.AF_INET, builtinsocket.SOCK_DGRAM)
                 s.connect((url, 80))
                 ip = s.getsockname()[0]
-                with open(lockfile,'w') as f:
-                    f.write("{}:{}".format(ip,settings.HEALTHCHECKSERVER_PORT))
+                addresses.append("{}:{}".format(ip,self.port))
                 lockfile_ex = None
                 break
             except Exception as ex:
@@ -242,7 +507,12 @@ class HealthCheckServer(socket.SocketServer):
                     s.close()
 
         if lockfile_ex:
-            raise Exception("Failed to create the lock file({}) for socket server.{}: {}".format(lockfile,lockfile_ex.__class__.__name__,str(lockfile_ex)))
+            if not addresses:
+                raise Exception("Failed to create the lock file({}) for socket server.{}: {}".format(lockfile,lockfile_ex.__class__.__name__,str(lockfile_ex)))
+            logger.error("Failed to find the ip address of the socket server, only the unix domain socket is saved in the lock file({}).{}: {}".format(lockfile,lockfile_ex.__class__.__name__,str(lockfile_ex)))
+
+        with open(lockfile,'w') as f:
+            f.write("\n".join(addresses))
 
         await super().start()
 
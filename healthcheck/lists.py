@@ -27,8 +27,11 @@ class CycleList:
         return self._list[index]
 
     def __len__(self):
-        with self._lock:
-            return len(self._list)
+        return len(self._list)
+
+    @property
+    def id(self):
+        return self._id
 
     @property
     def totalsize(self):
@@ -66,7 +69,23 @@ class CycleList:
                     self._index = 0
 
         def is_compatible(self,listid,nextindex):
-            return self._list._id == listid and (self._list.totalsize - nextindex) <= self._maxlen
+            return self._list._id == listid and (self._list.totalsize - nextindex) <= self._list._maxlen
+
+    def contains(self,totalindex):
+        """
+        totalindex: the number of the items added before the item
+        Return True if the item is still in the list
+        """
+        return totalindex >= 0 and totalindex < self._size and self._size - totalindex <= self._maxlen
+
+    def items_from(self,totalindex,end=None):
+        """
+        totalindex: the number of the items added before the first returned item
+        end: the number of the items added before the item after the last returned item, None means the size of the list
+        Return the items from the item to the last item; the caller should check whether the item is still in the list by 'contains'
+        """
+        for i in range(totalindex,self._size if end is None else min(end,self._size)):
+            yield self._list[i % self._maxlen]
 
     def get_reader(self,index = 0):
         if index >= 0:
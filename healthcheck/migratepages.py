@@ -0,0 +1,37 @@
+"""
+Convert the history pages and the error history pages of all the services to the page format
+The healthcheck server should be stopped during the migration, and HEALTHSTATUS_PAGE_FORMAT should be set to the same format before it is started again
+Usage: python -m healthcheck.migratepages json|binary [config file]
+"""
+import sys
+import os
+
+from . import settings
+from .healthcheck import HealthCheck
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("json","binary"):
+        print("Usage: python -m healthcheck.migratepages json|binary [config file]")
+        exit(1)
+    pageformat = sys.argv[1]
+    configfile = os.path.join(settings.HEALTHCHECK_DATA_DIR,sys.argv[2]) if len(sys.argv) > 2 else settings.HEALTHCHECK_CONFIGFILE
+
+    healthcheck = HealthCheck(configfile)
+    failed = False
+    total = 0
+    for section in healthcheck.sections.values():
+        for service in section["services"].values():
+            try:
+                converted = service.healthcheckpages.migrate(pageformat)
+                total += converted
+                if converted:
+                    print("{}.{}: {} pages are converted to {} format".format(service.sectionid,service.serviceid,converted,pageformat))
+            except Exception as ex:
+                failed = True
+                print("{}.{}: Failed to convert the pages to {} format.{}: {}".format(service.sectionid,service.serviceid,pageformat,ex.__class__.__name__,str(ex)))
+    print("{} pages are converted to {} format".format(total,pageformat))
+    if failed:
+        exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import copy
 import json
 
 class TestResponse(object):
@@ -17,3 +18,101 @@ class TestResponse(object):
             return self.jsondata
         else:
             raise Exception("Invalid json data")
+
+class CachedResponse(object):
+    """
+    A proxy of the http response which parses the response body only once.
+    The parsed json data, the parsing error and the text are cached, and shared by all conditions, messages, prtg data and transforms
+    The cached json data is read-only: the built-in accessors never change it, and the user lambdas read it from 'private'
+    Other attributes are delegated to the original response
+    """
+    def __init__(self,res):
+        self._res = res
+        self._json = None
+        self._json_ex = None
+        self._json_parsed = False
+        self._text = None
+        self._text_loaded = False
+        self.json_hits = 0
+        self.text_hits = 0
+        self._private = None
+
+    def __getattr__(self,name):
+        return getattr(self.__dict__["_res"],name)
+
+    def __bool__(self):
+        return self._res is not None
+
+    @property
+    def private(self):
+        """
+        Return the response used by the user lambdas, its json data is a copy of the cached json data
+        The copy is created only once when it is read, and shared by all the user lambdas of the response
+        """
+        if self._private is None:
+            self._private = PrivateResponse(self)
+        return self._private
+
+    @property
+    def response(self):
+        return self._res
+
+    def json(self):
+        if self._json_parsed:
+            self.json_hits += 1
+        else:
+            self._json_parsed = True
+            try:
+                self._json = self._res.json()
+            except Exception as ex:
+                self._json_ex = ex
+        if self._json_ex:
+            raise self._json_ex
+        return self._json
+
+    @property
+    def text(self):
+        if self._text_loaded:
+            self.text_hits += 1
+        else:
+            self._text = self._res.text
+            self._text_loaded = True
+        return self._text
+
+    @property
+    def cachehits(self):
+        return self.json_hits + self.text_hits
+
+    @classmethod
+    def wrap(cls,res):
+        if res is None or isinstance(res,cls):
+            return res
+        return cls(res)
+
+class PrivateResponse(object):
+    """
+    A proxy of the cached response for the user lambdas, the json data is copied from the cached response when it is read first time,
+    so the user lambdas can't change the json data used by the conditions, messages and prtg data
+    Other attributes are delegated to the cached response
+    """
+    def __init__(self,res):
+        self._res = res
+        self._json = None
+        self._json_copied = False
+
+    def __getattr__(self,name):
+        return getattr(self.__dict__["_res"],name)
+
+    def __bool__(self):
+        return bool(self._res)
+
+    def json(self):
+        if not self._json_copied:
+            data = self._res.json()
+            try:
+                #parsing the body again is faster than a deep copy
+                self._json = json.loads(self._res.content)
+            except Exception as ex:
+                self._json = copy.deepcopy(data)
+            self._json_copied = True
+        return self._json
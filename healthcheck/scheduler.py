@@ -0,0 +1,323 @@
+import heapq
+import time
+import asyncio
+import logging
+import traceback
+import urllib.parse
+from collections import deque
+
+from . import settings
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+class ServiceScheduler(object):
+    """
+    A priority queue of (next checktime, sequence, service) for the enabled services.
+    Only the due services are popped in each wake-up, the caller should push them back after their next checktime is computed.
+    The sequence is used to keep the order of the services with the same next checktime and avoid comparing the services.
+    """
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+        self._sections = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def is_outdated(self,sections):
+        """
+        Return True if the scheduler was not built from the sections
+        """
+        return self._sections is None or self._sections is not sections
+
+    def reset(self):
+        self._heap.clear()
+        self._sections = None
+
+    def rebuild(self,sections,now):
+        """
+        Rebuild the queue from all the enabled services in the sections
+        """
+        self._heap.clear()
+        self._sections = sections
+        for section in sections.values():
+            if not section.enabled:
+                continue
+            for service in section["services"].values():
+                if not service.enabled:
+                    continue
+                self._seq += 1
+                self._heap.append((service.healthstatus_nextchecktime or now,self._seq,service))
+        heapq.heapify(self._heap)
+        logger.debug("Rebuild the scheduler with {} services".format(len(self._heap)))
+
+    def push(self,service):
+        self._seq += 1
+        heapq.heappush(self._heap,(service.healthstatus_nextchecktime,self._seq,service))
+
+    def pop_dues(self,now):
+        """
+        Pop and return the services whose next checktime is not later than now
+        """
+        while self._heap and self._heap[0][0] <= now:
+            checktime,seq,service = heapq.heappop(self._heap)
+            if service.healthstatus_nextchecktime and checktime != service.healthstatus_nextchecktime:
+                #the next checktime was changed after the service was pushed, requeue it with the current next checktime
+                self.push(service)
+                continue
+            yield service
+
+    @property
+    def next_checktime(self):
+        return self._heap[0][0] if self._heap else None
+
+QUEUED = 1
+RUNNING = 2
+
+class Dispatcher(object):
+    """
+    Run the due healthcheck tasks with a global in-flight limit and a per-host in-flight limit.
+    The tasks which can't be run immediately are queued and run in FIFO order, the tasks of a busy host don't block the tasks of other hosts.
+    Only one task per service can be queued or running, the tasks of a service are keyed by (healthcheck,section id,service id), so the key is not changed after reloading.
+    Only one dispatcher per process, shared by all the healthchecks.
+    """
+    def __init__(self,max_inflight=settings.HEALTHCHECK_MAX_INFLIGHT,max_inflight_per_host=settings.HEALTHCHECK_MAX_INFLIGHT_PER_HOST):
+        self.max_inflight = max_inflight
+        self.max_inflight_per_host = max_inflight_per_host
+        #list of (service keys,host,task,queued time)
+        self._queue = deque()
+        self._inflight = 0
+        self._hosts = {}
+        #the queued or running check of the services, key: service key, value: [status,asyncio task,deadline,service keys]
+        self._checks = {}
+        #the skipped checks of the services, key: service key, value: [skipped times,last skipped time]
+        self._skips = {}
+        #the running tasks to save the skipped status
+        self._skiptasks = set()
+        #statistics
+        self._dispatched = 0
+        self._queued = 0
+        self._max_queuedepth = 0
+        self._total_waittime = 0
+        self._max_waittime = 0
+        self._merged = 0
+        self._skipped = 0
+        self._cancelled = 0
+        self._coalesced = 0
+
+    def __str__(self):
+        return "Dispatcher"
+
+    @staticmethod
+    def get_key(servicehealthcheck):
+        return (servicehealthcheck.healthcheck,servicehealthcheck.sectionid,servicehealthcheck.serviceid)
+
+    @staticmethod
+    def get_host(servicehealthcheck):
+        url = servicehealthcheck.url
+        if not url:
+            return None
+        try:
+            return urllib.parse.urlsplit(url).netloc.lower() or None
+        except Exception as ex:
+            return None
+
+    @staticmethod
+    def get_deadline(servicehealthcheck):
+        return time.monotonic() + servicehealthcheck.timeout / 1000 + 2 * settings.HEALTHCHECK_DEADLINE_GRACE
+
+    def _is_available(self,host):
+        if host is None:
+            #no network request, not limited
+            return True
+        if self.max_inflight > 0 and self._inflight >= self.max_inflight:
+            return False
+        if self.max_inflight_per_host > 0 and self._hosts.get(host,0) >= self.max_inflight_per_host:
+            return False
+        return True
+
+    def accept(self,task):
+        """
+        Return True if the new task of the service can be dispatched.
+        If the previous task of the service is still queued, the new task is merged into the queued one;
+        if the previous task of the service is still running, the new task is skipped and a skipped status is saved in the history after the running task is finished, unless the running task has passed its deadline.
+        """
+        servicehealthcheck = task.servicehealthcheck
+        key = self.get_key(servicehealthcheck)
+        check = self._checks.get(key)
+        if not check:
+            return True
+        if check[0] == QUEUED:
+            self._merged += 1
+            logger.debug("{}: The previous healthcheck task is still waiting to run, merge the new one into it.".format(servicehealthcheck))
+            return False
+        elif time.monotonic() < check[2]:
+            self._skip(key,task,check)
+            return False
+        else:
+            self._cancel(check)
+            return True
+
+    def dispatch(self,task):
+        """
+        Run the task if the limits are not reached; otherwise queue it.
+        The task can check multiple services with one request, the services should be accepted before.
+        """
+        servicehealthchecks = task.servicehealthchecks
+        keys = [self.get_key(s) for s in servicehealthchecks]
+        if len(keys) > 1:
+            self._coalesced += len(keys) - 1
+        host = self.get_host(task.servicehealthcheck)
+        if host is None or (not self._queue and self._is_available(host)):
+            #the task without network request is not limited, never queue it
+            self._start(keys,host,task,None)
+            return
+        check = [QUEUED,None,None,keys]
+        for key in keys:
+            self._checks[key] = check
+        self._queue.append((keys,host,task,time.monotonic()))
+        self._queued += 1
+        if len(self._queue) > self._max_queuedepth:
+            self._max_queuedepth = len(self._queue)
+        self._dispatch_queue()
+
+    def _skip(self,key,task,check):
+        self._skipped += 1
+        skiptime = utils.now()
+        skip = self._skips.get(key)
+        if skip:
+            skip[0] += 1
+            skip[1] = skiptime
+        else:
+            self._skips[key] = [1,skiptime]
+        reason = "The previous healthcheck task is still running, skip the check. The previous task will be cancelled if it is still running after {} seconds".format(max(0,round(check[2] - time.monotonic(),1)))
+        logger.warning("{}: {}".format(task.servicehealthcheck,reason))
+        #save the skipped status after the running task is finished, so the history is in order
+        skiptask = asyncio.create_task(self._run_skip(task,check[1],skiptime,reason))
+        self._skiptasks.add(skiptask)
+        skiptask.add_done_callback(self._skiptasks.discard)
+
+    async def _run_skip(self,task,runningtask,skiptime,reason):
+        try:
+            #wait doesn't raise the exception or the cancellation of the running task
+            await asyncio.wait([runningtask])
+            await task.skip(skiptime,reason)
+        except asyncio.CancelledError as ex:
+            raise
+        except Exception as ex:
+            logger.error("Failed to save the skipped status of the healthcheck task({}).{}: {}".format(task.servicehealthcheck,ex.__class__.__name__,str(ex)))
+
+    def _cancel(self,check):
+        self._cancelled += 1
+        for key in check[3]:
+            if self._checks.get(key) is check:
+                del self._checks[key]
+        logger.warning("{}: The healthcheck task is still running after its deadline, cancel it.".format(",".join("{}.{}.{}".format(*key) for key in check[3])))
+        check[1].cancel()
+
+    def cancel_overdue(self):
+        """
+        Cancel the running tasks which have passed their deadline.
+        """
+        if not self._checks:
+            return
+        now = time.monotonic()
+        #a check can be shared by multiple services
+        for check in list({id(c):c for c in self._checks.values()}.values()):
+            if check[0] == RUNNING and now >= check[2]:
+                self._cancel(check)
+
+    def _dispatch_queue(self):
+        """
+        Start the queued tasks in order until the limits are reached, the tasks of a blocked host are kept in the queue.
+        All the queued tasks have a host, because the tasks without network request are never queued.
+        """
+        if not self._queue:
+            return
+        blocked = deque()
+        blocked_hosts = set()
+        while self._queue:
+            if self.max_inflight > 0 and self._inflight >= self.max_inflight:
+                break
+            item = self._queue.popleft()
+            if item[1] in blocked_hosts or not self._is_available(item[1]):
+                blocked_hosts.add(item[1])
+                blocked.append(item)
+                continue
+            self._start(*item)
+        if blocked:
+            #put the blocked tasks back to the head of the queue in the original order
+            self._queue.extendleft(reversed(blocked))
+
+    def _start(self,keys,host,task,queuedtime):
+        if queuedtime is not None:
+            waittime = time.monotonic() - queuedtime
+            self._total_waittime += waittime
+            if waittime > self._max_waittime:
+                self._max_waittime = waittime
+        self._dispatched += 1
+        if host is not None:
+            self._inflight += 1
+            self._hosts[host] = self._hosts.get(host,0) + 1
+        check = [RUNNING,None,self.get_deadline(task.servicehealthcheck),keys]
+        for key in keys:
+            self._checks[key] = check
+        check[1] = asyncio.create_task(self._run(host,task,check))
+
+    async def _run(self,host,task,check):
+        try:
+            await task.run()
+        except asyncio.CancelledError as ex:
+            raise
+        except Exception as ex:
+            traceback.print_exc()
+            logger.error("Failed to run the healthcheck task({}).{}: {}".format(task.servicehealthcheck,ex.__class__.__name__,str(ex)))
+        finally:
+            for key in check[3]:
+                if self._checks.get(key) is check:
+                    del self._checks[key]
+            if host is not None:
+                self._inflight -= 1
+                if self._hosts[host] <= 1:
+                    del self._hosts[host]
+                else:
+                    self._hosts[host] -= 1
+            self._dispatch_queue()
+
+    def discard(self,healthcheck):
+        """
+        Remove the queued tasks of the healthcheck, called when the continuous check of the healthcheck is stopped.
+        """
+        if not self._queue:
+            return
+        queue = deque()
+        for t in self._queue:
+            if t[0][0][0] is healthcheck:
+                for key in t[0]:
+                    del self._checks[key]
+            else:
+                queue.append(t)
+        self._queue = queue
+
+    @property
+    def stats(self):
+        return {
+            "max_inflight":self.max_inflight,
+            "max_inflight_per_host":self.max_inflight_per_host,
+            "inflight":self._inflight,
+            "hosts":dict(self._hosts),
+            "queuedepth":len(self._queue),
+            "max_queuedepth":self._max_queuedepth,
+            "dispatched":self._dispatched,
+            "queued":self._queued,
+            "avg_waittime":round(self._total_waittime / self._queued,3) if self._queued else 0,
+            "max_waittime":round(self._max_waittime,3),
+            "merged":self._merged,
+            "skipped":self._skipped,
+            "cancelled":self._cancelled,
+            "coalesced":self._coalesced,
+            "skippedservices":dict(("{}.{}.{}".format(*k),v) for k,v in self._skips.items())
+        }
+
+dispatcher = Dispatcher()
@@ -28,6 +28,30 @@ BLOCK_TIMEOUT = int(os.environ.get("BLOCK_TIMEOUT",5)) # in seconds,
 SOCKET_ATTEMPTS = int(os.environ.get("SOCKET_ATTEMPTS",3))
 HEALTHCHECKSERVER_HOST = os.environ.get("HEALTHCHECKSERVER_HOST","localhost")
 HEALTHCHECKSERVER_PORT = int(os.environ.get("HEALTHCHECKSERVER_PORT",9080))
+#the unix domain socket of the healthcheck server, the clients connect to the unix domain socket instead of the tcp port if configured
+HEALTHCHECKSERVER_UNIX_SOCKET = os.environ.get("HEALTHCHECKSERVER_UNIX_SOCKET") or None
+#listen on the tcp port, can be disabled if the unix domain socket is configured and all the clients are in the same host
+HEALTHCHECKSERVER_TCP = os.environ.get("HEALTHCHECKSERVER_TCP","true").lower() == "true" or not HEALTHCHECKSERVER_UNIX_SOCKET
+
+#the pooled http clients used by the healthcheck server, the keep-alive connections are reused across the healthcheck runs
+HTTPCLIENT_MAX_CONNECTIONS = int(os.environ.get("HTTPCLIENT_MAX_CONNECTIONS",0)) # 0 means no limit
+HTTPCLIENT_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTPCLIENT_MAX_KEEPALIVE_CONNECTIONS",20))
+HTTPCLIENT_KEEPALIVE_EXPIRY = int(os.environ.get("HTTPCLIENT_KEEPALIVE_EXPIRY",300)) # in seconds, should be greater than the healthcheck interval to reuse the connection
+HTTPCLIENT_IDLE_TIMEOUT = int(os.environ.get("HTTPCLIENT_IDLE_TIMEOUT",900)) # in seconds, close the pooled client if it is not used in the timeout
+HTTPCLIENT_SWEEP_INTERVAL = int(os.environ.get("HTTPCLIENT_SWEEP_INTERVAL",60)) # in seconds
+
+#the limits of the running healthcheck tasks, the due tasks are queued if the limit is reached
+HEALTHCHECK_MAX_INFLIGHT = int(os.environ.get("HEALTHCHECK_MAX_INFLIGHT",100)) # 0 means no limit
+HEALTHCHECK_MAX_INFLIGHT_PER_HOST = int(os.environ.get("HEALTHCHECK_MAX_INFLIGHT_PER_HOST",10)) # 0 means no limit
+#in seconds, the request of a healthcheck task is cancelled if it is not finished in (timeout + grace)
+#and the healthcheck task is cancelled if it is not finished in (timeout + 2 * grace)
+HEALTHCHECK_DEADLINE_GRACE = int(os.environ.get("HEALTHCHECK_DEADLINE_GRACE",5))
+
+#spread the services with the same interval across the interval if the offset is not configured, the offset of a service can also be configured to 'auto'
+HEALTHCHECK_AUTO_OFFSET = os.environ.get("HEALTHCHECK_AUTO_OFFSET","false").lower() == "true"
+
+#the due services with the same request(method,url,headers,auth,sslverify,timeout,data) are checked by one request
+HEALTHCHECK_COALESCE_REQUESTS = os.environ.get("HEALTHCHECK_COALESCE_REQUESTS","true").lower() == "true"
 
 HEALTHCHECK_CONFIGFILE = os.path.join(HEALTHCHECK_DATA_DIR,os.environ.get("HEALTHCHECK_CONFIGFILE","healthcheck.json"))
 
@@ -40,6 +64,54 @@ try:
 except :
     HEALTHSTATUS_PAGESIZE = 100
 HEALTHSTATUS_BUFFER = int(os.environ.get("HEALTHSTATUS_BUFFER",1000))
+#each history page has a sidecar index file, the size and the last status of each colour of the page are loaded from the index file without parsing the page
+HEALTHSTATUS_PAGE_INDEX = os.environ.get("HEALTHSTATUS_PAGE_INDEX","true").lower() == "true"
+#the format of the new history pages
+#json: one json status per line
+#binary: fixed-width status headers and a string section, memory-mapped and read without parsing json and datetime strings
+#the existing pages are read in their own format, and can be converted by 'python -m healthcheck.migratepages'
+HEALTHSTATUS_PAGE_FORMAT = os.environ.get("HEALTHSTATUS_PAGE_FORMAT","json").lower()
+if HEALTHSTATUS_PAGE_FORMAT not in ("json","binary"):
+    HEALTHSTATUS_PAGE_FORMAT = "json"
+#compress the closed history pages in the file storage: none, gzip or lzma; the compressed pages are read transparently
+#and the page index file refers to the compressed page files
+HEALTHSTATUS_PAGE_COMPRESSION = os.environ.get("HEALTHSTATUS_PAGE_COMPRESSION","none").lower()
+if HEALTHSTATUS_PAGE_COMPRESSION not in ("none","gzip","lzma"):
+    HEALTHSTATUS_PAGE_COMPRESSION = "none"
+#the storage of the history pages
+#file: a page index file and the page files per service
+#sqlite: one sqlite database in WAL mode per config file, the statuses of all the services are indexed by (section,service,starttime) and (status,starttime)
+HEALTHSTATUS_STORAGE = os.environ.get("HEALTHSTATUS_STORAGE","file").lower()
+if HEALTHSTATUS_STORAGE not in ("file","sqlite"):
+    HEALTHSTATUS_STORAGE = "file"
+
+#the healthcheck status is saved by a writer thread in batches
+HEALTHSTATUS_WRITER_QUEUESIZE = int(os.environ.get("HEALTHSTATUS_WRITER_QUEUESIZE",10000))
+HEALTHSTATUS_WRITER_BATCHSIZE = int(os.environ.get("HEALTHSTATUS_WRITER_BATCHSIZE",100))
+#none: don't call fsync; batch: fsync the written files after each batch; record: fsync the written files after each record
+HEALTHSTATUS_WRITER_DURABILITY = os.environ.get("HEALTHSTATUS_WRITER_DURABILITY","none").lower()
+if HEALTHSTATUS_WRITER_DURABILITY not in ("none","batch","record"):
+    HEALTHSTATUS_WRITER_DURABILITY = "none"
+#the last status and the last status of each colour of the services are saved in a checkpoint file to load them at startup without reading the pages
+HEALTHSTATUS_CHECKPOINT = os.environ.get("HEALTHSTATUS_CHECKPOINT","true").lower() == "true"
+HEALTHSTATUS_CHECKPOINT_INTERVAL = int(os.environ.get("HEALTHSTATUS_CHECKPOINT_INTERVAL",10)) # in seconds, the min interval between two saves of the checkpoint file, 0 means saving after each batch
+
+#the data sent to a healthstatus subscriptor is queued in its own bounded queue and sent by its own task, the broadcast never waits for a slow subscriptor
+HEALTHSTATUS_SUBSCRIPTOR_QUEUESIZE = int(os.environ.get("HEALTHSTATUS_SUBSCRIPTOR_QUEUESIZE",1000))
+#the policy if the queue is full
+#drop_oldest: drop the oldest queued data
+#coalesce: replace all the queued status with a snapshot of the subscribed services
+#disconnect: close the connection, the client will reconnect and receive the current status
+HEALTHSTATUS_SUBSCRIPTOR_OVERFLOW = os.environ.get("HEALTHSTATUS_SUBSCRIPTOR_OVERFLOW","coalesce").lower()
+if HEALTHSTATUS_SUBSCRIPTOR_OVERFLOW not in ("drop_oldest","coalesce","disconnect"):
+    HEALTHSTATUS_SUBSCRIPTOR_OVERFLOW = "coalesce"
+#the number of the recent frames kept by the healthcheck server, the frames missed by a reconnected subscriptor are resent if they are still kept; otherwise a snapshot is sent
+HEALTHSTATUS_REPLAY_BUFFER = int(os.environ.get("HEALTHSTATUS_REPLAY_BUFFER",1000))
+#the system views served by the app, comma separated; if configured, the app only subscribes the healthstatus of the services in these views from the healthcheck server,
+#and the healthstatus of the other services are not updated, so the app only serves these views and the views whose services are all subscribed;
+#the dashboard, the healthstatus stream/events, the json status and the prtg data of the other views(including the default view of all services) return 409.
+#the history pages are read from the history storage, and are served for all the services
+HEALTHSTATUS_SUBSCRIBED_VIEWS = [v.strip() for v in os.environ.get("HEALTHSTATUS_SUBSCRIBED_VIEWS","").split(",") if v.strip()]
 
 
 EDITINGHEALTHCHECK_CONTINUOUSCHECK_MAXTIME = HEALTHCHECK_DATA_DIR,os.environ.get("EDITINGHEALTHCHECK_CONTINUOUSCHECK_MAXTIME",3600) #in seconds
@@ -68,6 +68,14 @@ class BaseConnection(object):
             await shutdown.process_userinterruption()
 
 
+    @staticmethod
+    def encode(data):
+        """
+        Return the encoded line of the data, which can be sent to multiple connections by 'send_bytes'
+        """
+        data = json.dumps(data,cls=serializers.JSONEncoder)
+        return "{}\n".format(data).encode()
+
     async def send(self,data):
         if shutdown.shutdowning:
             await self.shutdown()
@@ -77,11 +85,23 @@ class BaseConnection(object):
             return
 
         try:
-            data = json.dumps(data,cls=serializers.JSONEncoder)
-            data = "{}\n".format(data).encode()
+            data = self.encode(data)
         except Exception as ex:
             raise exceptions.MalformedData("{}: Failed to encode the response.{}: {}".format(self,ex.__class__.__name__,str(ex)))
 
+        await self.send_bytes(data)
+
+    async def send_bytes(self,data):
+        """
+        Send the encoded data
+        """
+        if shutdown.shutdowning:
+            await self.shutdown()
+            raise exceptions.SystemShutdown()
+        if not self.writer:
+            #already closed
+            return
+
         try:
             self.writer.write(data)
             await self.writer.drain()
@@ -20,12 +20,19 @@ logger = logging.getLogger("healthcheck.socketclient")
 class SocketClient(object):
     count = 0
     conn_type = None
-    def __init__(self,host=settings.HEALTHCHECKSERVER_HOST,port=settings.HEALTHCHECKSERVER_PORT,timeout=0):
+    def __init__(self,host=settings.HEALTHCHECKSERVER_HOST,port=settings.HEALTHCHECKSERVER_PORT,timeout=0,path=settings.HEALTHCHECKSERVER_UNIX_SOCKET):
+        """
+        path: the unix domain socket of the server, connect to the unix domain socket instead of host:port if not None
+        """
         self.host = host
         self.port = port
+        self.path = path
         self.timeout = timeout
         self.__class__.count += 1
-        self.name = "{} socketclient({}:{})_{}".format(self.conn_type,self.host,self.port,self.count)
+        if self.path:
+            self.name = "{} socketclient(unix:{})_{}".format(self.conn_type,self.path,self.count)
+        else:
+            self.name = "{} socketclient({}:{})_{}".format(self.conn_type,self.host,self.port,self.count)
         self._conn = None #[reader,writer]
         shutdown.register_service(self)
 
@@ -36,6 +43,13 @@ class SocketClient(object):
     def shutdown(self):
         pass
 
+    @property
+    def handshake(self):
+        """
+        Return the data sent to the server to establish the connection, the connection type or [connection type,options]
+        """
+        return self.conn_type
+
     def post_connected(self):
         """
         Called right after the client is established
@@ -71,7 +85,10 @@ class SocketClient(object):
                     logger.debug("{}: Try to connect to socket server.".format(self))
 
                     async with asyncio.timeout(1):
-                        reader,writer = await asyncio.open_connection(self.host,self.port) 
+                        if self.path:
+                            reader,writer = await asyncio.open_unix_connection(self.path)
+                        else:
+                            reader,writer = await asyncio.open_connection(self.host,self.port) 
 
                     conn = base.BaseConnection(reader,writer)
                     logger.info("{} : Connected".format(self))
@@ -80,7 +97,7 @@ class SocketClient(object):
                         raise exceptions.SystemShutdown()
 
                     #send connection type
-                    await conn.send(self.conn_type)
+                    await conn.send(self.handshake)
 
                     if shutdown.shutdowning:
                         raise exceptions.SystemShutdown()
@@ -180,55 +197,123 @@ class SocketClient(object):
 
 class CommandClient(SocketClient):
     conn_type = connectiontype.COMMAND
-    def __init__(self,host=settings.HEALTHCHECKSERVER_HOST,port=settings.HEALTHCHECKSERVER_PORT):
-        super().__init__(host=host,port=port)
+    def __init__(self,host=settings.HEALTHCHECKSERVER_HOST,port=settings.HEALTHCHECKSERVER_PORT,path=settings.HEALTHCHECKSERVER_UNIX_SOCKET):
+        super().__init__(host=host,port=port,path=path)
+        #only used to connect and send the request, multiple commands can be in flight on one connection
         self._lock = asyncio.Lock()
+        self._reqid = 0
+        #the connection read by the reader task
+        self._reader_conn = None
+        self._reader_task = None
+        #the futures of the in-flight requests of the current connection, key is the request id
+        self._futures = {}
 
-    async def exec(self,command,reconnect_attempts=-1):
+    async def close(self):
+        await super().close()
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._reader_conn = None
 
-        async with self._lock:
-            reconnect = 0
+    async def _read_responses(self,conn,futures):
+        """
+        Read the responses [status,result,reqid] from the connection and resolve the future of the request
+        All the in-flight requests are failed with ConnectionClosed if the connection is broken,
+        or with FailedResponse if a response without request id is received, because the request it belongs to is unknown
+        """
+        error = None
+        try:
             while True:
-                try:
-                    logger.debug("{}: Begin to send command({}) to server".format(self,command))
-                    await self.send(command,0)
-                    logger.debug("{}: Succeed to send command({}) to server, wait the response".format(self,command))
-                    while True:
-                        res = await self.receive(0)
-                        if res[0] == status.WAITING:
-                            logger.debug(res[1])
-                            continue
-                        else:
-                            break
-                    logger.debug("{0}: Receive the response({2}) of the command({1}) from server".format(self,command,res))
-                    if res[0] > 0:
-                        return res[1]
+                res = await conn.receive()
+                if not isinstance(res,(list,tuple)) or len(res) < 3:
+                    logger.error("{}: Receive a response({}) without request id, fail all the in-flight requests and close the connection".format(self,res))
+                    if isinstance(res,(list,tuple)) and len(res) == 2:
+                        error = exceptions.FailedResponse(res[1])
                     else:
-                        raise exceptions.FailedResponse(res[1])
-                except exceptions.SystemShutdown as ex:
-                    raise ex
-                except exceptions.SocketClientTypeNotSupport as ex:
-                    await self.close()
-                    raise ex
-                except exceptions.MalformedData as ex:
+                        error = exceptions.FailedResponse("Receive a response({}) without request id".format(res))
+                    break
+                if res[0] == status.WAITING:
+                    logger.debug(res[1])
+                    continue
+                future = futures.pop(res[2],None)
+                if future and not future.done():
+                    future.set_result(res)
+                else:
+                    logger.error("{}: Receive a response of the unknown request({}), ignore it".format(self,res[2]))
+        except asyncio.CancelledError as ex:
+            error = exceptions.ConnectionClosed("{}: Connection has been closed".format(self))
+        except Exception as ex:
+            error = ex if isinstance(ex,(exceptions.ConnectionClosed,exceptions.SystemShutdown)) else exceptions.ConnectionClosed("{}: Connection is broken.{}: {}".format(self,ex.__class__.__name__,str(ex)))
+        finally:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(error or exceptions.ConnectionClosed("{}: Connection has been closed".format(self)))
+            futures.clear()
+            if self._conn is conn:
+                self._reader_task = None
+                self._reader_conn = None
+                await super().close()
+
+    async def _send_request(self,command):
+        """
+        Send the command with a new request id
+        Return the future of the response
+        """
+        async with self._lock:
+            conn = await self.get_connection(0)
+            if conn is not self._reader_conn:
+                #a new connection, start a reader task for it
+                self._futures = {}
+                self._reader_conn = conn
+                self._reader_task = asyncio.create_task(self._read_responses(conn,self._futures))
+            self._reqid += 1
+            reqid = self._reqid
+            future = asyncio.get_running_loop().create_future()
+            self._futures[reqid] = future
+            try:
+                await self.send({"reqid":reqid,"command":command},0)
+            except Exception as ex:
+                self._futures.pop(reqid,None)
+                raise ex
+            return future
+
+    async def exec(self,command,reconnect_attempts=-1):
+        reconnect = 0
+        while True:
+            try:
+                logger.debug("{}: Begin to send command({}) to server".format(self,command))
+                future = await self._send_request(command)
+                logger.debug("{}: Succeed to send command({}) to server, wait the response".format(self,command))
+                res = await future
+                logger.debug("{0}: Receive the response({2}) of the command({1}) from server".format(self,command,res))
+                if res[0] > 0:
+                    return res[1]
+                else:
+                    raise exceptions.FailedResponse(res[1])
+            except exceptions.SystemShutdown as ex:
+                raise ex
+            except exceptions.SocketClientTypeNotSupport as ex:
+                await self.close()
+                raise ex
+            except exceptions.MalformedData as ex:
+                raise ex
+            except exceptions.FailedResponse as ex:
+                raise ex
+            except exceptions.ConnectionClosed as ex:
+                reconnect += 1
+                if (reconnect_attempts == -1 or reconnect <= reconnect_attempts): 
+                    continue
+                else:
                     raise ex
-                except exceptions.FailedResponse as ex:
+            except Exception as ex:
+                logger.error("{}: Unexpected exception.\n{}".format(self,str(ex)))
+                reconnect += 1
+                if (reconnect_attempts == -1 or reconnect <= reconnect_attempts): 
+                    if reconnect > 1:
+                        await asyncio.sleep(settings.BLOCK_TIMEOUT)
+                    continue
+                else:
                     raise ex
-                except exceptions.ConnectionClosed as ex:
-                    reconnect += 1
-                    if (reconnect_attempts == -1 or reconnect <= reconnect_attempts): 
-                        continue
-                    else:
-                        raise ex
-                except Exception as ex:
-                    logger.error("{}: Unexpected exception.\n{}".format(self,str(ex)))
-                    reconnect += 1
-                    if (reconnect_attempts == -1 or reconnect <= reconnect_attempts): 
-                        if reconnect > 1:
-                            await asyncio.sleep(settings.BLOCK_TIMEOUT)
-                        continue
-                    else:
-                        raise ex
 
 commandclient = CommandClient()
 
@@ -5,6 +5,7 @@ import logging
 import json
 import re
 import os
+import stat
 
 from .. import settings
 from .. import shutdown
@@ -12,6 +13,7 @@ from .. import serializers
 from .commands import CommandsMixin
 from .. import exceptions
 from .. import lists
+from .. import utils
 from signal import SIGINT, SIGTERM
 
 from . import status
@@ -27,6 +29,8 @@ def exithandler():
 class Connection(base.BaseConnection):
     connectid = 0
     conn_type = None
+    #the options sent by the client with the connection type
+    options = None
     def __init__(self,server,clientaddr,reader,writer):
         super().__init__(reader,writer)
         self.__class__.connectid += 1
@@ -55,6 +59,10 @@ class CommandConnection(CommandsMixin,Connection):
     def __init__(self,server,clientaddr,reader,writer):
         super().__init__(server,clientaddr,reader,writer)
         self._run_task = None
+        #the running tasks of the commands with request id
+        self._command_tasks = set()
+        #the responses of the concurrent commands are sent by different tasks
+        self._send_lock = asyncio.Lock()
         self.start()
 
     async def close(self):
@@ -62,55 +70,93 @@ class CommandConnection(CommandsMixin,Connection):
         if self._run_task:
             self._run_task.cancel()
             self._run_task = None
+        while self._command_tasks:
+            self._command_tasks.pop().cancel()
 
-    async def run(self):
+    async def execute(self,data):
+        """
+        Execute the command, data is the command or [command,*args]
+        Return the response [status,result]
+        """
+        command = None
+        args = None
         try:
-            logger.debug("{}: The command client is created for client({}).".format(self,self.clientaddr))
-            while not shutdown.shutdowning:
-                command = None
+            if isinstance(data,str):
+                command = data.lower()
                 args = None
-                result = None
+            else:
+                command = data[0].lower()
+                args = data[1:]
+            logger.debug("{}: Receive the command '{}'".format(self,command))
+            if hasattr(self,command):
                 try:
-                    data = await self.receive()
-                    if isinstance(data,str):
-                        command = data.lower()
-                        args = None
+                    func = getattr(self,command)
+                    if inspect.iscoroutinefunction(func):
+                        if args:
+                            result = await func(*args)
+                        else:
+                            result = await func()
                     else:
-                        command = data[0].lower()
-                        args = data[1:]
-                    logger.debug("{}: Receive the command '{}'".format(self,command))
-                    if hasattr(self,command):
-                        try:
-                            func = getattr(self,command)
-                            if inspect.iscoroutinefunction(func):
-                                if args:
-                                    result = await func(*args)
-                                else:
-                                    result = await func()
-                            else:
-                                if args:
-                                    result = func(*args)
-                                else:
-                                    result = func()
-
-                            result = [status.SUCCEED,result]
-                        except Exception as ex:
-                            traceback.print_exc()
-                            result = [status.FAILED,str(ex)]
-                    else:
-                        result = [status.FAILED,"Command({}) Not Support".format(command)]
-                    await self.send(result)
-                except exceptions.ConnectionClosed as ex:
-                    raise ex
-                except exceptions.SystemShutdown as ex:
-                    raise ex
+                        if args:
+                            result = func(*args)
+                        else:
+                            result = func()
+
+                    return [status.SUCCEED,result]
                 except Exception as ex:
                     traceback.print_exc()
-                    if args:
-                        result = [status.FAILED,"Failed to execute the command({}({})). {} : {}".format(command,",".join([str(a) for a in args]),ex.__class__.__name__,str(ex))]
-                    else:
-                        result = [status.FAILED,"Failed to execute the command({}()). {} : {}".format(command,args,ex.__class__.__name__,str(ex))]
-                    await self.send(result)
+                    return [status.FAILED,str(ex)]
+            else:
+                return [status.FAILED,"Command({}) Not Support".format(command)]
+        except exceptions.ConnectionClosed as ex:
+            raise ex
+        except exceptions.SystemShutdown as ex:
+            raise ex
+        except Exception as ex:
+            traceback.print_exc()
+            if args:
+                return [status.FAILED,"Failed to execute the command({}({})). {} : {}".format(command,",".join([str(a) for a in args]),ex.__class__.__name__,str(ex))]
+            else:
+                return [status.FAILED,"Failed to execute the command({}()). {} : {}".format(command,args,ex.__class__.__name__,str(ex))]
+
+    async def send_response(self,result):
+        async with self._send_lock:
+            await self.send(result)
+
+    async def execute_request(self,reqid,data):
+        """
+        Execute the command with request id and send the response [status,result,reqid]
+        """
+        try:
+            result = await self.execute(data)
+            result.append(reqid)
+            await self.send_response(result)
+        except (exceptions.ConnectionClosed,exceptions.SystemShutdown) as ex:
+            pass
+        except Exception as ex:
+            logger.error("{}: Failed to execute the request({}).{}: {}".format(self,reqid,ex.__class__.__name__,str(ex)))
+
+    async def run(self):
+        try:
+            logger.debug("{}: The command client is created for client({}).".format(self,self.clientaddr))
+            while not shutdown.shutdowning:
+                try:
+                    data = await self.receive()
+                except exceptions.MalformedData as ex:
+                    #the request id of the unparsable command is unknown, reply without request id and close the connection,
+                    #so the client can fail all its in-flight requests instead of waiting for their responses
+                    logger.error("{}: Failed to parse the command, close the connection. {} : {}".format(self,ex.__class__.__name__,str(ex)))
+                    await self.send_response([status.FAILED,"Failed to parse the command. {} : {}".format(ex.__class__.__name__,str(ex))])
+                    break
+                if isinstance(data,dict):
+                    #{"reqid":reqid,"command":command or [command,*args]}, the command is executed in its own task,
+                    #and the response is sent when it is finished, the responses can be out of order
+                    task = asyncio.create_task(self.execute_request(data.get("reqid"),data.get("command")))
+                    self._command_tasks.add(task)
+                    task.add_done_callback(self._command_tasks.discard)
+                else:
+                    #the command without request id is executed in order
+                    await self.send_response(await self.execute(data))
         except exceptions.ConnectionClosed as ex:
             pass
         except exceptions.SystemShutdown as ex:
@@ -125,11 +171,19 @@ class CommandConnection(CommandsMixin,Connection):
 
 port_in_use_re = re.compile("Errno\\s+98",re.IGNORECASE)
 class SocketServer(object):
-    def __init__(self,f_get_connection_cls = lambda conn_type:None):
+    def __init__(self,f_get_connection_cls = lambda conn_type:None,path=settings.HEALTHCHECKSERVER_UNIX_SOCKET,tcp=settings.HEALTHCHECKSERVER_TCP):
         self.host = "0.0.0.0"
-        self.port = settings.HEALTHCHECKSERVER_PORT
-        self.name = "Socket Server({}:{})".format(self.host,self.port)
+        self.port = settings.HEALTHCHECKSERVER_PORT if tcp else None
+        #the path of the unix domain socket
+        self.path = path
+        if self.path and self.port:
+            self.name = "Socket Server({}:{},unix:{})".format(self.host,self.port,self.path)
+        elif self.path:
+            self.name = "Socket Server(unix:{})".format(self.path)
+        else:
+            self.name = "Socket Server({}:{})".format(self.host,self.port)
         self.connections = set()
+        self._servers = []
         self.f_get_connection_cls = staticmethod(f_get_connection_cls)
         shutdown.register_service(self)
 
@@ -152,13 +206,29 @@ class SocketServer(object):
                 if conn:
                     logger.error("{}: Failed to close the connection.{}: {}".format(conn,ex.__class__.__name__,str(ex)))
 
+        while self._servers:
+            self._servers.pop().close()
+        if self.path:
+            self._remove_socketfile()
+
+    def _remove_socketfile(self):
+        try:
+            if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.remove(self.path)
+        except Exception as ex:
+            logger.error("{}: Failed to remove the unix domain socket file({}).{}: {}".format(self,self.path,ex.__class__.__name__,str(ex)))
 
     async def _create_connection(self,reader,writer):
         conn = base.BaseConnection(reader,writer)
         try:
             clientaddr = writer.get_extra_info('peername')
             logger.debug("The connection({1} -> {0}: Connection is established".format(self,clientaddr))
+            #the connection type or [connection type,options]
             conn_type = await conn.receive()
+            options = None
+            if isinstance(conn_type,(list,tuple)):
+                options = conn_type[1] if len(conn_type) > 1 else None
+                conn_type = conn_type[0]
             logger.debug("{}: Receive connection type({}) from client".format(self,conn_type))
             conn_cls = self.f_get_connection_cls(conn_type)
             if not conn_cls:
@@ -169,6 +239,7 @@ class SocketServer(object):
             if conn_cls:
                 await conn.send([status.SUCCEED,"OK"])
                 conn_obj = conn_cls(self,clientaddr,reader,writer)
+                conn_obj.options = options
                 if hasattr(conn_obj,"initialize"):
                     if inspect.iscoroutinefunction(conn_obj.initialize):
                         await conn_obj.initialize()
@@ -189,9 +260,24 @@ class SocketServer(object):
 
 
     async def start(self):
+        if self.path:
+            utils.makedir(os.path.dirname(os.path.abspath(self.path)))
+            while True:
+                try:
+                    #the socket file is left if the previous server was not shutdown gracefully
+                    self._remove_socketfile()
+                    self._servers.append(await asyncio.start_unix_server(self._create_connection,path = self.path))
+                    break
+                except OSError as ex:
+                    logger.error("Failed to start unix domain socket server, wait 5 seconds and try again.{}: {}".format(ex.__class__.__name__,str(ex)))
+                    await asyncio.sleep(5)
+
+        if not self.port:
+            return
+
         while True:
             try:
-                await asyncio.start_server(self._create_connection,host = self.host,port = self.port)
+                self._servers.append(await asyncio.start_server(self._create_connection,host = self.host,port = self.port))
                 break
             except OSError as ex:
                 logger.error("Failed to start socket server, wait 5 seconds and try again.{}: {}".format(ex.__class__.__name__,str(ex)))
@@ -4,6 +4,12 @@ FAILED = -1
 HEALTHCONFIG_HAHSCODE = 10
 INITIAL_HEALTHSTATUS = 20
 HEALTHSTATUS = 21
+#the healthstatus of all the services in one frame
+HEALTHSTATUS_SNAPSHOT = 22
+#the stream id and the current sequence of the healthstatus frames, sent before the replayed frames or the snapshot
+HEALTHSTATUS_STREAM = 23
+#sent by the subscriber to change the services it subscribes, followed by a snapshot of the newly subscribed services
+HEALTHSTATUS_SUBSCRIBE = 24
 
 RELOAD_DASHBOARD = 30
 
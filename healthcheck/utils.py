@@ -3,7 +3,7 @@ import shutil
 import logging
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+from datetime import datetime,timedelta,timezone
 
 from . import settings
 
@@ -50,6 +50,13 @@ def now():
 def parse_datetime(dt,pattern="%Y-%m-%dT%H:%M:%S.%f"):
     return datetime.strptime(dt,pattern).replace(tzinfo=settings.TZ)
 
+EPOCH = datetime(1970,1,1,tzinfo=timezone.utc)
+def to_epoch_microseconds(dt):
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+def from_epoch_microseconds(microseconds):
+    return (EPOCH + timedelta(microseconds=microseconds)).astimezone(settings.TZ)
+
 def format_time(dt,pattern="%H:%M:%S"):
     return dt.strftime(pattern)
 
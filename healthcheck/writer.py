@@ -0,0 +1,213 @@
+import os
+import time
+import asyncio
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from . import settings
+from . import shutdown
+
+logger = logging.getLogger(__name__)
+
+class HealthStatusWriter(object):
+    """
+    Save the healthcheck status and details in a dedicated worker thread, to avoid blocking the event loop by the disk io.
+    The status records are put into a bounded queue and saved in batches, the caller is blocked only if the queue is full.
+    The in-memory healthstatus of the service should be updated by the caller before putting the record into the queue.
+    Only one writer per process.
+    """
+    def __init__(self,queuesize=settings.HEALTHSTATUS_WRITER_QUEUESIZE,batchsize=settings.HEALTHSTATUS_WRITER_BATCHSIZE,durability=settings.HEALTHSTATUS_WRITER_DURABILITY):
+        self.queuesize = queuesize
+        self.batchsize = batchsize
+        self.durability = durability
+        self._queue = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1,thread_name_prefix="healthstatus-writer")
+        #the checkpoints updated by the writer
+        self._checkpoints = set()
+        #statistics
+        self._records = 0
+        self._batches = 0
+        self._failed = 0
+        self._max_batchsize = 0
+        self._max_queuedepth = 0
+        self._writetime = 0
+        self._checkpoint_saves = 0
+        self._compressed = 0
+        self._compresstime = 0
+        shutdown.register_service(self)
+
+    def __str__(self):
+        return "HealthStatusWriter"
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.queuesize)
+            self._task = asyncio.create_task(self._run())
+
+    async def save(self,healthcheckpages,healthstatus,details=None):
+        """
+        Put the status record into the queue
+        """
+        self._start()
+        if self._queue.full():
+            logger.warning("The healthstatus writer queue is full({}), waiting".format(self.queuesize))
+        await self._queue.put((healthcheckpages,healthstatus,details))
+        if self._queue.qsize() > self._max_queuedepth:
+            self._max_queuedepth = self._queue.qsize()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batchsize and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                storages = await loop.run_in_executor(self._executor,self._write,batch)
+                if storages:
+                    #compress the closed pages in a separate job after the batch is saved, never delay the status writing
+                    await loop.run_in_executor(self._executor,self._compress,storages)
+            finally:
+                for i in range(len(batch)):
+                    self._queue.task_done()
+
+    def _fsync(self,files):
+        for f in files:
+            try:
+                fd = os.open(f,os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except FileNotFoundError as ex:
+                #the file was removed by the page management
+                continue
+            except Exception as ex:
+                logger.error("Failed to fsync the file({}).{}: {}".format(f,ex.__class__.__name__,str(ex)))
+
+    def _write(self,batch):
+        """
+        Save a batch of status records, running in the worker thread
+        """
+        starttime = time.monotonic()
+        writtenfiles = set() if self.durability != "none" else None
+        checkpoints = set()
+        #the history storages which support batched saving, each status is committed if the durability is 'record'
+        storages = set(healthcheckpages.storage for healthcheckpages,healthstatus,details in batch)
+        if self.durability != "record":
+            for storage in storages:
+                storage.begin_batch()
+        for healthcheckpages,healthstatus,details in batch:
+            try:
+                healthcheckpages.save(healthstatus,details,writtenfiles=writtenfiles)
+                checkpoint = healthcheckpages.checkpoint
+                if checkpoint:
+                    checkpoints.add(checkpoint)
+            except Exception as ex:
+                self._failed += 1
+                traceback.print_exc()
+                logger.error("Failed to save the healthcheck status({1}) of service({0}). {2}: {3}".format(healthcheckpages.servicehealthcheck,healthstatus,ex.__class__.__name__,str(ex)))
+            if self.durability == "record" and writtenfiles:
+                self._fsync(writtenfiles)
+                writtenfiles.clear()
+
+        for storage in storages:
+            try:
+                storage.commit()
+            except Exception as ex:
+                logger.error("Failed to commit the healthcheck status to {}. {}: {}".format(storage,ex.__class__.__name__,str(ex)))
+                #the statuses are rolled back, reload the pages which may refer to the rolled back pages and statuses
+                for healthcheckpages,healthstatus,details in batch:
+                    if healthcheckpages.storage is storage:
+                        self._failed += 1
+                        healthcheckpages.reset()
+
+        if self.durability == "batch" and writtenfiles:
+            self._fsync(writtenfiles)
+
+        self._checkpoints.update(checkpoints)
+        self._save_checkpoints(checkpoints)
+
+        self._records += len(batch)
+        self._batches += 1
+        if len(batch) > self._max_batchsize:
+            self._max_batchsize = len(batch)
+        self._writetime += time.monotonic() - starttime
+        #the storages with the queued compressions
+        return [storage for storage in storages if storage.queued_compressions]
+
+    def _compress(self,storages):
+        """
+        Compress the queued closed pages, running in the worker thread
+        """
+        starttime = time.monotonic()
+        writtenfiles = set() if self.durability != "none" else None
+        for storage in storages:
+            try:
+                self._compressed += storage.compress_queued_pages(writtenfiles=writtenfiles)
+            except Exception as ex:
+                logger.error("Failed to compress the pages in {}. {}: {}".format(storage,ex.__class__.__name__,str(ex)))
+        if writtenfiles:
+            self._fsync(writtenfiles)
+        self._compresstime += time.monotonic() - starttime
+
+    def _save_checkpoints(self,checkpoints,force=False):
+        """
+        Save the changed checkpoints, running in the worker thread
+        The checkpoint is saved after the status files, so a checkpoint record never refers to unwritten status
+        """
+        for checkpoint in checkpoints:
+            try:
+                if checkpoint.save(force=force,fsync=self.durability != "none"):
+                    self._checkpoint_saves += 1
+            except Exception as ex:
+                logger.error("Failed to save the checkpoint({}). {}: {}".format(checkpoint,ex.__class__.__name__,str(ex)))
+
+    async def flush(self):
+        """
+        Wait until all the queued records and the checkpoints are saved
+        """
+        if self._queue is not None and self._task and not self._task.done():
+            await self._queue.join()
+        if self._checkpoints:
+            await asyncio.get_running_loop().run_in_executor(self._executor,self._save_checkpoints,list(self._checkpoints),True)
+
+    @property
+    def stats(self):
+        return {
+            "durability":self.durability,
+            "queuesize":self.queuesize,
+            "queuedepth":self._queue.qsize() if self._queue is not None else 0,
+            "max_queuedepth":self._max_queuedepth,
+            "records":self._records,
+            "batches":self._batches,
+            "failed":self._failed,
+            "max_batchsize":self._max_batchsize,
+            "avg_batchsize":round(self._records / self._batches,2) if self._batches else 0,
+            "avg_writetime":round(self._writetime / self._batches,4) if self._batches else 0,
+            "checkpoint_saves":self._checkpoint_saves,
+            "compressed_pages":self._compressed,
+            "compresstime":round(self._compresstime,4)
+        }
+
+    async def shutdown(self):
+        """
+        Save all the queued records and the checkpoints before shutdown
+        The writer task is already cancelled by the shutdown, the batch in process is finished by the worker thread
+        """
+        batch = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+        if batch:
+            logger.info("Save the {} queued healthcheck status before shutdown".format(len(batch)))
+            storages = await asyncio.get_running_loop().run_in_executor(self._executor,self._write,batch)
+            if storages:
+                await asyncio.get_running_loop().run_in_executor(self._executor,self._compress,storages)
+        if self._checkpoints:
+            await asyncio.get_running_loop().run_in_executor(self._executor,self._save_checkpoints,list(self._checkpoints),True)
+        self._executor.shutdown(wait=True)
+
+writer = HealthStatusWriter()
@@ -0,0 +1,297 @@
+"""Unit tests for the healthcheck conditions in healthcheck/checks."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from healthcheck import checks
+from healthcheck import response
+from healthcheck import settings
+
+
+# --- Helpers ---
+
+
+def compile_conds(conds):
+    """Initialize and compile the conditions, return the compiled and the initialized conditions."""
+    conds = checks.init_conds(None, conds)
+    return checks.compile_conds(conds), conds
+
+
+def cached_response(data, status_code=200):
+    return response.CachedResponse(response.TestResponse(status_code, data=data))
+
+
+# --- Shared cached json document ---
+
+
+def test_ignore_order_does_not_reorder_cached_document():
+    """Two conditions on the same list path share the cached json document."""
+    func, conds = compile_conds(
+        [
+            "and",
+            ["json", "items", "==", [1, 2, 3], {"dtype": "list", "ignore_order": True}],
+            ["json", "items[0]", "==", 3],
+        ]
+    )
+    res = cached_response({"items": [3, 1, 2]})
+
+    assert func(res) is True
+    assert checks.check(res, conds) is True
+    assert res.json() == {"items": [3, 1, 2]}
+    assert res.json_hits > 0
+
+
+def test_lambda_cannot_mutate_cached_document():
+    func, _ = compile_conds(
+        [
+            "and",
+            ["json", "items", "lambda d:d.pop() is not None"],
+            ["json", "items", "lambda svc,d:d.clear() is None"],
+            ["json", "items[2]", "==", 2],
+        ]
+    )
+    res = cached_response({"items": [3, 1, 2]})
+
+    assert func(res) is True
+    assert res.json() == {"items": [3, 1, 2]}
+
+
+def test_lambdas_share_one_copy_of_cached_document(monkeypatch):
+    """The json document is copied once per response, not once per lambda."""
+    copies = []
+    deepcopy = response.copy.deepcopy
+    monkeypatch.setattr(response.copy, "deepcopy", lambda data: copies.append(data) or deepcopy(data))
+    func, _ = compile_conds(
+        [
+            "and",
+            ["json", "items", "lambda d:len(d) == 3"],
+            ["json", "items[0]", "lambda d:d == 3"],
+            ["json", "items", "==", [3, 1, 2]],
+        ]
+    )
+    message = checks.get_message_factory(None, ["json", "items", "lambda d:sum(d)"])
+    prtgdata = checks.get_prtg_factory(None, "lambda res:len(res.json()['items'])")
+    res = cached_response({"items": [3, 1, 2]})
+
+    assert func(res) is True
+    assert message(res) == 6
+    assert prtgdata(res) == 3
+    assert len(copies) == 1
+    assert res.private.json() is not res.json()
+
+    #conditions without lambdas never copy the document
+    func, _ = compile_conds(["json", "items[0]", "==", 3])
+    assert func(cached_response({"items": [3, 1, 2]})) is True
+    assert len(copies) == 1
+
+
+# --- Compiled conditions ---
+
+
+def assert_same_as_check(conds, res):
+    """The compiled conditions have the same result and messages as checks.check."""
+    func, conds = compile_conds(conds)
+    messages = []
+    expected_messages = []
+    result = func(res, messages=messages)
+    assert result == checks.check(res, conds, messages=expected_messages)
+    assert messages == expected_messages
+    return result
+
+
+DOCUMENT = {
+    "status": "ok",
+    "count": 5,
+    "ratio": 0.5,
+    "enabled": "yes",
+    "name": "healthcheck-server",
+    "nothing": None,
+    "items": [3, 1, 2],
+    "version": "2.1",
+    "day": "2026-01-02",
+}
+
+
+@pytest.mark.parametrize(
+    "conds,expected",
+    [
+        (["json", "status", "exists"], True),
+        (["json", "missing", "exist"], False),
+        (["json", "missing", "not_exists"], True),
+        (["json", "status", "not_exist"], False),
+        (["json", "nothing", "is_null"], True),
+        (["json", "missing", "is_null"], True),
+        (["json", "status", "is_not_null"], True),
+        (["json", "nothing", "is_not_null"], False),
+        (["json", "status", "==", "ok"], True),
+        (["json", "status", "=", "failed"], False),
+        (["json", "status", "ok"], True),
+        (["json", "status", "!=", "ok"], False),
+        (["json", "status", "<>", "failed"], True),
+        (["json", "count", ">", 4], True),
+        (["json", "count", ">=", 5], True),
+        (["json", "count", "<", 5], False),
+        (["json", "count", "<=", 5], True),
+        (["json", "count", "between", [5, 6]], True),
+        (["json", "count", "between", [1, 5]], False),
+        (["json", "ratio", "between", [0.1, 1.0]], True),
+        (["json", "status", "in", ["ok", "warning"]], True),
+        (["json", "status", "not_in", ["ok", "warning"]], False),
+        (["json", "name", "startswith", "healthcheck"], True),
+        (["json", "name", "mstartswith", ["status", "health"]], True),
+        (["json", "name", "endswith", "client"], False),
+        (["json", "name", "mendswith", ["client", "server"]], True),
+        (["json", "name", "contain", "check"], True),
+        (["json", "name", "mcontain", ["status", "prtg"]], False),
+        (["json", "name", "pattern", "^HEALTH", {"flags": "IGNORECASE"}], True),
+        (["json", "name", "pattern", "^HEALTH"], False),
+        (["json", "name", "mpattern", ["^status", "-server$"]], True),
+        (["json", "count", "==", "5", {"dtype": "int"}], True),
+        (["json", "version", ">", 2.0, {"dtype": "float"}], True),
+        (["json", "enabled", "==", True, {"dtype": "bool"}], True),
+        (["json", "items", "==", [1, 2, 3]], False),
+        (["json", "items", "==", [1, 2, 3], {"dtype": "list", "ignore_order": True}], True),
+        (["json", "items[1]", "==", 1], True),
+        (["json", "items[5]", "==", 1], False),
+        (["json", "items[5]", "not_exists"], True),
+        (["json", "day", "==", "2026-01-02", {"dtype": "date"}], True),
+        (["json", "count", "lambda d:d % 5 == 0"], True),
+        (["json", "count", "lambda svc,d:svc is None and d > 5"], False),
+        (["httpstatus", 200], True),
+        (["httpstatus", "in", [200, 201]], True),
+        (["httpstatus", ">=", 400], False),
+    ],
+)
+def test_operator(conds, expected):
+    assert assert_same_as_check(conds, cached_response(DOCUMENT)) is expected
+
+
+def test_operator_on_missing_value_is_false():
+    """The value operators are False if the data is not found or null."""
+    for operator, operand in [(">", 1), ("==", None), ("startswith", "a"), ("in", [1])]:
+        for key in ("missing", "nothing"):
+            if operand is None:
+                conds = ["json", key, "==", "ok"]
+            else:
+                conds = ["json", key, operator, operand]
+            assert assert_same_as_check(conds, cached_response(DOCUMENT)) is False
+
+
+@pytest.mark.parametrize(
+    "conds,expected",
+    [
+        (["and", ["json", "status", "ok"], ["httpstatus", 200]], True),
+        (["and", ["json", "status", "ok"], ["httpstatus", 500]], False),
+        (["or", ["json", "status", "failed"], ["httpstatus", 200]], True),
+        (["or", ["json", "status", "failed"], ["httpstatus", 500]], False),
+        (["not", ["json", "status", "failed"]], True),
+        (["not", ["and", ["json", "status", "ok"], ["httpstatus", 200]]], False),
+        (["or", ["not", ["httpstatus", 200]], ["and", ["json", "count", ">", 1], ["json", "ratio", "<", 1]]], True),
+        (["json", "and", ["status", "ok"], ["count", ">", 1]], True),
+        (["json", "or", ["status", "failed"], ["count", ">", 10]], False),
+        (["json", "not", ["status", "failed"]], True),
+    ],
+)
+def test_logical_operator(conds, expected):
+    assert assert_same_as_check(conds, cached_response(DOCUMENT)) is expected
+
+
+def test_and_or_stop_at_the_first_decisive_condition():
+    func, _ = compile_conds(["or", ["httpstatus", 200], ["json", "status", "ok"]])
+    messages = []
+    assert func(cached_response(DOCUMENT), messages=messages) is True
+    assert len(messages) == 1
+
+    func, _ = compile_conds(["and", ["httpstatus", 500], ["json", "status", "ok"]])
+    messages = []
+    assert func(cached_response(DOCUMENT), messages=messages) is False
+    assert len(messages) == 1
+
+
+def test_no_condition_is_always_true():
+    assert checks.compile_conds(checks.init_conds(None, None))(cached_response(DOCUMENT)) is True
+    assert checks.compile_conds(checks.init_conds(None, []))(cached_response(DOCUMENT)) is True
+
+
+# --- Relative dates ---
+
+
+def test_relative_date_is_relative_to_the_checking_time(monkeypatch):
+    now = datetime(2026, 1, 2, 12, 0, tzinfo=settings.TZ)
+    monkeypatch.setattr(checks.utils, "now", lambda: now)
+    document = {"updated": (now - timedelta(minutes=30)).isoformat()}
+    func, conds = compile_conds(["json", "updated", ">=", "-1 hours"])
+    assert conds[4]["dtype"] is datetime
+
+    assert assert_same_as_check(["json", "updated", ">=", "-1 hours"], cached_response(document)) is True
+    assert func(cached_response(document)) is True
+
+    #the expected value is recomputed in each checking
+    now = now + timedelta(hours=1)
+    assert func(cached_response(document)) is False
+    assert assert_same_as_check(["json", "updated", ">=", "-1 hours"], cached_response(document)) is False
+
+
+@pytest.mark.parametrize(
+    "expression,delta",
+    [
+        ("1 day", timedelta(days=1)),
+        ("-2 days 3 hours", -timedelta(days=2, hours=3)),
+        ("+10 mins 5 seconds", timedelta(minutes=10, seconds=5)),
+        ("-1 minute", -timedelta(minutes=1)),
+    ],
+)
+def test_relative_date_expression(monkeypatch, expression, delta):
+    now = datetime(2026, 1, 2, 12, 0, tzinfo=settings.TZ)
+    monkeypatch.setattr(checks.utils, "now", lambda: now)
+    document = {"updated": (now + delta).isoformat()}
+    assert assert_same_as_check(["json", "updated", "==", expression], cached_response(document)) is True
+    assert assert_same_as_check(["json", "updated", "==", "-3 seconds"], cached_response(document)) is False
+
+
+# --- Errors ---
+
+
+def test_conversion_error_is_raised():
+    document = {"count": "many", "day": "yesterday"}
+    for conds in (
+        ["json", "count", ">", 4, {"dtype": "int"}],
+        ["json", "count", "==", 4],
+        ["json", "day", "==", "2026-01-02", {"dtype": "date"}],
+    ):
+        func, initialized = compile_conds(conds)
+        with pytest.raises(ValueError):
+            func(cached_response(document))
+        with pytest.raises(ValueError):
+            checks.check(cached_response(document), initialized)
+
+
+def test_invalid_json_is_raised():
+    func, conds = compile_conds(["json", "status", "ok"])
+    res = response.CachedResponse(response.TestResponse(200, data=None))
+    with pytest.raises(Exception, match="Invalid json data"):
+        func(res)
+    with pytest.raises(Exception, match="Invalid json data"):
+        checks.check(res, conds)
+
+
+@pytest.mark.parametrize(
+    "conds,error",
+    [
+        (["json"], "is invalid"),
+        (["unknown", "status", "ok"], "doesn't exist"),
+        (["json", "count", ">"], "must have one operand"),
+        (["json", "count", ">", [1, 2]], "only accept one primitive data"),
+        (["json", "count", "between", [1]], "must have 2 operands"),
+        (["json", "count", "in", []], "at least one operands"),
+        (["json", "count", "in", [[1], 2]], "list of primitive data"),
+        (["json", "status", "exists", "ok"], "doesn't have any operands"),
+        (["json", "status", "lambda d:"], "lambda operation"),
+        (["not", ["httpstatus", 200], ["httpstatus", 201]], "only accept one logical expression"),
+        (["and", ["httpstatus", 200], "status"], "must be type list or tuple"),
+    ],
+)
+def test_invalid_condition(conds, error):
+    with pytest.raises(Exception, match=error):
+        checks.init_conds(None, conds)
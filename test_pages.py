@@ -0,0 +1,400 @@
+"""Unit tests for the binary healthcheck pages, the sqlite history storage and the page migration in healthcheck/migratepages.py."""
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+from healthcheck import migratepages
+from healthcheck import settings
+from healthcheck.healthcheck import BinaryHealthCheckPage, HealthCheck, HealthCheckPage, SqliteHealthCheckPage, SqliteHistoryStorage
+from healthcheck.writer import HealthStatusWriter
+
+# --- Fixtures ---
+
+
+@pytest.fixture
+def page_settings(tmp_path, monkeypatch):
+    """Small pages saved in the temporary data dir."""
+    monkeypatch.setattr(settings, "HEALTHCHECK_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "HEALTHSTATUS_STORAGE", "file")
+    monkeypatch.setattr(settings, "HEALTHSTATUS_PAGESIZE", 5)
+    monkeypatch.setattr(settings, "HEALTHSTATUS_PAGE_FORMAT", "json")
+    monkeypatch.setattr(settings, "HEALTHSTATUS_PAGE_COMPRESSION", "none")
+    monkeypatch.setattr(settings, "HEALTHSTATUS_CHECKPOINT", False)
+    return tmp_path
+
+
+def make_healthcheck(folder, name="pages.json", serviceids=("service0",)):
+    """A healthcheck with services which have history and error history, the config file is in the folder."""
+    configfile = folder / name
+    configfile.write_text(
+        json.dumps(
+            [
+                {
+                    "id": "section0",
+                    "name": "section0",
+                    "interval": 60,
+                    "services": [
+                        {
+                            "id": serviceid,
+                            "name": serviceid,
+                            "historyexpire": 60,
+                            "errorhistoryexpire": 60,
+                            "location": "http://127.0.0.1/{}".format(serviceid),
+                            "healthchecks": {"green": ["httpstatus", "=", 200]},
+                        }
+                        for serviceid in serviceids
+                    ],
+                }
+            ]
+        )
+    )
+    return HealthCheck(str(configfile))
+
+
+@pytest.fixture
+def service(page_settings):
+    """A service with history and error history, the config file is in the temporary data dir."""
+    return make_healthcheck(page_settings).sections["section0"]["services"]["service0"]
+
+
+@pytest.fixture
+def sqlite_services(page_settings, monkeypatch):
+    """Two services whose histories are saved in the sqlite history storage."""
+    monkeypatch.setattr(settings, "HEALTHSTATUS_STORAGE", "sqlite")
+    healthcheck = make_healthcheck(page_settings, "sqlitepages.json", ("service0", "service1"))
+    return list(healthcheck.sections["section0"]["services"].values())
+
+
+# --- Helpers ---
+
+# The statuses are saved in the last two days, which are not expired.
+BASETIME = datetime.combine(date.today() - timedelta(days=2), time(), tzinfo=settings.TZ)
+
+
+def make_status(index, status="green", message="OK", prtgdata=None, persistent=False):
+    starttime = BASETIME + timedelta(hours=index, microseconds=index)
+    return [starttime, starttime + timedelta(milliseconds=5), status, message, prtgdata, persistent]
+
+
+# The statuses cover None and empty messages, non-string messages, and unknown statuses with prtgdata.
+STATUSES = [
+    make_status(0),
+    make_status(1, "yellow", None, persistent=True),
+    make_status(2, "grey", "unknown status", prtgdata={"channel": "grey", "value": 1}),
+    make_status(3, "red", "", prtgdata=[1, 2]),
+    make_status(4, "error", {"code": 500, "reason": "failed"}, persistent=True),
+    make_status(5, "skipped", 12),
+    make_status(6, "green", "héalthy"),
+]
+
+
+def page_snapshot(healthcheckpages):
+    """The statuses of the pages and the last statuses of each colour."""
+    return [
+        [list(page.pageitems()) for page in healthcheckpages.get_pages()],
+        [
+            healthcheckpages.last_healthcheck,
+            healthcheckpages.last_greenhealthcheck,
+            healthcheckpages.last_yellowhealthcheck,
+            healthcheckpages.last_redhealthcheck,
+            healthcheckpages.last_errorhealthcheck,
+        ],
+        [list(page.pageitems()) for page in healthcheckpages.errorpages.get_pages()],
+    ]
+
+
+def page_files(healthcheckpages):
+    """The file names of the pages, the uncompressed files of the compressed pages are kept for a while and not included."""
+    return [os.path.basename(page.filepath) for page in healthcheckpages.get_pages()]
+
+
+# --- Binary page ---
+
+
+def test_binary_page_round_trip(page_settings, monkeypatch):
+    monkeypatch.setattr(settings, "HEALTHSTATUS_PAGESIZE", 10)
+    filepath = str(page_settings / "page.bin")
+    page = BinaryHealthCheckPage(None, BASETIME, filepath)
+    for status in STATUSES:
+        assert page.save(status) is True
+
+    #read the statuses from a new page object
+    page = BinaryHealthCheckPage(None, BASETIME, filepath)
+    assert page.size == len(STATUSES)
+    assert list(page.pageitems()) == STATUSES
+    assert list(page.reversed_pageitems()) == STATUSES[::-1]
+    assert list(page.reversed_pageitems(limit=2)) == STATUSES[:-3:-1]
+    assert list(page.reversed_pageitems(limit=0)) == []
+
+    page = BinaryHealthCheckPage(None, BASETIME, filepath)
+    assert page.last_healthcheck == STATUSES[6]
+    assert page.last_greenhealthcheck == STATUSES[6]
+    assert page.last_yellowhealthcheck == STATUSES[1]
+    assert page.last_redhealthcheck == STATUSES[3]
+    #the unknown statuses are error statuses
+    assert page.last_errorhealthcheck == STATUSES[5]
+
+
+def test_binary_page_keeps_message_type(page_settings):
+    filepath = str(page_settings / "page.bin")
+    page = BinaryHealthCheckPage(None, BASETIME, filepath)
+    for status in STATUSES:
+        page.save(status)
+
+    messages = [status[3] for status in BinaryHealthCheckPage(None, BASETIME, filepath).pageitems()]
+    assert messages[:5] == [status[3] for status in STATUSES[:5]]
+    assert messages[1] is None
+    assert messages[3] == ""
+    assert messages[4] == {"code": 500, "reason": "failed"}
+
+
+def test_binary_page_has_the_same_statuses_as_json_page(page_settings):
+    jsonpage = HealthCheckPage(None, BASETIME, str(page_settings / "page.json"))
+    binarypage = BinaryHealthCheckPage(None, BASETIME, str(page_settings / "page.bin"))
+    for status in STATUSES[:5]:
+        jsonpage.save(status)
+        binarypage.save(status)
+
+    jsonpage = HealthCheckPage(None, BASETIME, jsonpage.filepath)
+    binarypage = BinaryHealthCheckPage(None, BASETIME, binarypage.filepath)
+    assert list(binarypage.pageitems()) == list(jsonpage.pageitems())
+    assert list(binarypage.reversed_pageitems()) == list(jsonpage.reversed_pageitems())
+
+
+def test_binary_page_reader_sees_appended_statuses(page_settings, monkeypatch):
+    """A reader keeps its page object while the healthcheck server appends statuses to the same page."""
+    monkeypatch.setattr(settings, "HEALTHSTATUS_PAGESIZE", 4)
+    filepath = str(page_settings / "page.bin")
+    writer = BinaryHealthCheckPage(None, BASETIME, filepath)
+    reader = BinaryHealthCheckPage(None, BASETIME, filepath)
+    assert list(reader.pageitems()) == []
+
+    writer.save(STATUSES[0])
+    writer.save(STATUSES[1])
+    assert list(reader.pageitems()) == STATUSES[:2]
+    assert reader.last_healthcheck == STATUSES[1]
+
+    writer.save(STATUSES[2])
+    writer.save(STATUSES[3])
+    assert list(reader.pageitems()) == STATUSES[:4]
+    assert list(reader.reversed_pageitems(limit=3)) == STATUSES[3:0:-1]
+    assert reader.size == 4
+    assert reader.last_healthcheck == STATUSES[3]
+    assert reader.last_redhealthcheck == STATUSES[3]
+
+    #the page is full
+    assert writer.save(STATUSES[4]) is False
+    assert list(reader.pageitems()) == STATUSES[:4]
+
+
+def test_full_binary_page_rejects_status(page_settings, monkeypatch):
+    monkeypatch.setattr(settings, "HEALTHSTATUS_PAGESIZE", 3)
+    filepath = str(page_settings / "page.bin")
+    page = BinaryHealthCheckPage(None, BASETIME, filepath)
+    assert [page.save(status) for status in STATUSES[:4]] == [True, True, True, False]
+    assert page.size == 3
+
+    #the capacity is saved in the page, a reloaded page is full even if the page size is changed
+    monkeypatch.setattr(settings, "HEALTHSTATUS_PAGESIZE", 10)
+    page = BinaryHealthCheckPage(None, BASETIME, filepath)
+    assert page.save(STATUSES[4]) is False
+    assert list(page.pageitems()) == STATUSES[:3]
+    assert page.last_healthcheck == STATUSES[2]
+
+
+def test_corrupted_binary_page_is_rejected(page_settings):
+    filepath = page_settings / "page.bin"
+    filepath.write_bytes(b"HCBX" + bytes(12))
+    with pytest.raises(Exception, match="corrupted"):
+        BinaryHealthCheckPage(None, BASETIME, str(filepath)).size
+
+
+# --- Sqlite history storage ---
+
+# The message column of the sqlite storage is text, only the string and None messages are kept as they are.
+SQLITE_STATUSES = [status for status in STATUSES if status[3] is None or isinstance(status[3], str)]
+
+
+def save_sqlite_statuses(service, count, hours=0):
+    healthcheckpages = service.healthcheckpages
+    statuses = []
+    for i in range(count):
+        status = SQLITE_STATUSES[i % len(SQLITE_STATUSES)]
+        statuses.append(make_status(i + hours, status[2], status[3], status[4], status[5]))
+        healthcheckpages.save(statuses[-1])
+    return statuses
+
+
+def test_sqlite_pages_rollover(sqlite_services):
+    service = sqlite_services[0]
+    statuses = save_sqlite_statuses(service, 12)
+    healthcheckpages = service.healthcheckpages
+    expected = page_snapshot(healthcheckpages)
+    pages = healthcheckpages.get_pages()
+    assert all(isinstance(page, SqliteHealthCheckPage) for page in pages)
+    assert [page.size for page in pages] == [5, 5, 2]
+    assert expected[0] == [statuses[:5], statuses[5:10], statuses[10:]]
+    assert list(pages[1].reversed_pageitems(limit=2)) == statuses[9:7:-1]
+
+    #the pages and the last statuses are reloaded from the database
+    healthcheckpages.reset()
+    assert page_snapshot(healthcheckpages) == expected
+    assert healthcheckpages.last_healthcheck == statuses[11]
+    assert healthcheckpages.last_redhealthcheck == [status for status in statuses if status[2] == "red"][-1]
+    #the unknown statuses are error statuses
+    assert healthcheckpages.last_errorhealthcheck == [status for status in statuses if status[2] == "grey"][-1]
+
+    #the statuses of the other service are saved in their own pages
+    assert sqlite_services[1].healthcheckpages.get_pages() == []
+
+
+def test_sqlite_pages_have_the_same_statuses_as_file_pages(page_settings, monkeypatch, sqlite_services):
+    monkeypatch.setattr(settings, "HEALTHSTATUS_STORAGE", "file")
+    fileservice = make_healthcheck(page_settings).sections["section0"]["services"]["service0"]
+    save_sqlite_statuses(fileservice, 12)
+    save_sqlite_statuses(sqlite_services[0], 12)
+    assert page_snapshot(sqlite_services[0].healthcheckpages) == page_snapshot(fileservice.healthcheckpages)
+
+
+def test_sqlite_error_pages(sqlite_services):
+    service = sqlite_services[0]
+    statuses = save_sqlite_statuses(service, 12)
+    errorstatuses = [status for status in statuses if status[2] != "green" and service.is_healthdetailpersistent(status[2])]
+    assert errorstatuses
+
+    errorpages = service.healthcheckpages.errorpages
+    assert [item for page in errorpages.get_pages() for item in page.pageitems()] == errorstatuses
+    errorpages.reset()
+    assert [item for page in errorpages.get_pages() for item in page.pageitems()] == errorstatuses
+    assert errorpages.last_healthcheck == errorstatuses[-1]
+
+
+def test_sqlite_query(sqlite_services):
+    statuses0 = save_sqlite_statuses(sqlite_services[0], 12)
+    statuses1 = save_sqlite_statuses(sqlite_services[1], 6, hours=12)
+    storage = SqliteHistoryStorage.get_instance(sqlite_services[0].healthcheck.configfile)
+
+    assert storage.query(service="service1") == [["section0", "service1", status] for status in statuses1]
+    #the statuses of both services are ordered by the start time
+    assert storage.query(section="section0", status="red") == [
+        ["section0", service.serviceid, status]
+        for service, statuses in zip(sqlite_services, (statuses0, statuses1))
+        for status in statuses
+        if status[2] == "red"
+    ]
+    starttime = statuses0[4][0]
+    assert storage.query(service="service0", starttime=starttime, endtime=statuses0[8][0], limit=3) == [
+        ["section0", "service0", status] for status in statuses0[4:7]
+    ]
+    errorstatuses = [status for status in statuses0 if status[2] != "green" and sqlite_services[0].is_healthdetailpersistent(status[2])]
+    assert storage.query(service="service0", history="errorhistory") == [["section0", "service0", status] for status in errorstatuses]
+    assert storage.query(service="service2") == []
+
+
+def test_sqlite_writer_commit_failure(sqlite_services, monkeypatch):
+    """The statuses of a failed batch are rolled back, and the pages are reset to the saved statuses."""
+    service0, service1 = sqlite_services
+    statuses = save_sqlite_statuses(service0, 4)
+    save_sqlite_statuses(service1, 4)
+    storage = SqliteHistoryStorage.get_instance(service0.healthcheck.configfile)
+    expected = [page_snapshot(service0.healthcheckpages), page_snapshot(service1.healthcheckpages)]
+
+    conn = storage.conn
+
+    class FailedCommitConnection:
+        def __getattr__(self, name):
+            return getattr(conn, name)
+
+        def commit(self):
+            raise sqlite3.OperationalError("disk I/O error")
+
+    writer = HealthStatusWriter(batchsize=10, durability="batch")
+    snapshots = []
+
+    async def save():
+        monkeypatch.setattr(storage, "_conn", FailedCommitConnection())
+        #the second status of service0 opens a new page which is rolled back too
+        for status in [make_status(4, "red", "failed"), make_status(5, "red", "failed")]:
+            await writer.save(service0.healthcheckpages, status)
+        await writer.save(service1.healthcheckpages, make_status(4, "green", "OK"))
+        await writer.flush()
+        monkeypatch.setattr(storage, "_conn", conn)
+        snapshots.append([page_snapshot(service0.healthcheckpages), page_snapshot(service1.healthcheckpages)])
+
+        #the pages can be written after the failure
+        await writer.save(service0.healthcheckpages, make_status(6))
+        await writer.flush()
+
+    asyncio.run(save())
+    assert conn.in_transaction is False
+    assert writer.stats["failed"] == 3
+    assert snapshots[0] == expected
+    service0.healthcheckpages.reset()
+    assert page_snapshot(service0.healthcheckpages)[0] == [[*statuses, make_status(6)]]
+
+
+# --- Migration ---
+
+
+def save_statuses(service, count):
+    healthcheckpages = service.healthcheckpages
+    for i in range(count):
+        status = STATUSES[i % len(STATUSES)]
+        healthcheckpages.save(make_status(i, status[2], status[3], status[4], status[5]))
+    return healthcheckpages
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "lzma"])
+def test_migrate_pages(service, monkeypatch, compression):
+    monkeypatch.setattr(settings, "HEALTHSTATUS_PAGE_COMPRESSION", compression)
+    healthcheckpages = save_statuses(service, 12)
+    healthcheckpages.compress_pages()
+    healthcheckpages.reset()
+    expected = page_snapshot(healthcheckpages)
+    assert len(expected[0]) == 3
+    ext = {"none": "", "gzip": ".gz", "lzma": ".xz"}[compression]
+    names = ["page_{}".format((BASETIME + timedelta(hours=hours)).strftime("%Y%m%dT%H%M%S")) for hours in (0, 5, 10)]
+    assert page_files(healthcheckpages) == [names[0] + ".json" + ext, names[1] + ".json" + ext, names[2] + ".json"]
+
+    assert healthcheckpages.migrate("binary") == 3 + len(expected[2])
+    assert page_snapshot(healthcheckpages) == expected
+    #the closed pages are compressed again and the last page is not compressed
+    assert page_files(healthcheckpages) == [names[0] + ".bin" + ext, names[1] + ".bin" + ext, names[2] + ".bin"]
+    assert all(".bin" in f for f in page_files(healthcheckpages.errorpages))
+    healthcheckpages.reset()
+    assert page_snapshot(healthcheckpages) == expected
+
+    #the migrated last page can be written
+    healthcheckpages.save(make_status(12))
+    assert healthcheckpages.last_healthcheck == make_status(12)
+
+    assert healthcheckpages.migrate("json") > 0
+    assert healthcheckpages.migrate("json") == 0
+    assert all(".json" in f for f in page_files(healthcheckpages) + page_files(healthcheckpages.errorpages))
+    healthcheckpages.reset()
+    assert page_snapshot(healthcheckpages)[0] == [*expected[0][:2], [*expected[0][2], make_status(12)]]
+
+
+def test_migratepages_command(service, monkeypatch, capsys):
+    healthcheckpages = save_statuses(service, 7)
+    healthcheckpages.reset()
+    expected = page_snapshot(healthcheckpages)
+
+    monkeypatch.setattr(sys, "argv", ["migratepages", "binary", "pages.json"])
+    migratepages.main()
+    assert "pages are converted to binary format" in capsys.readouterr().out
+    assert all(f.endswith(".bin") for f in page_files(healthcheckpages))
+    healthcheckpages.reset()
+    assert page_snapshot(healthcheckpages) == expected
+
+
+def test_migratepages_command_rejects_unknown_format(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["migratepages", "xml"])
+    with pytest.raises(SystemExit):
+        migratepages.main()